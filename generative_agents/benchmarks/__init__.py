@@ -0,0 +1,7 @@
+"""Benchmarks of the simulation, run in the generative_agents directory:
+
+    python -m benchmarks.bench_simulate --agents 1,5,25,100 --steps 10,100,1000
+    python -m benchmarks.bench_simulate --agents 100,500 --steps 10 --town
+    python -m benchmarks.bench_micro
+    python -m benchmarks.bench_import
+"""
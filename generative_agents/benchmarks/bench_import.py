@@ -0,0 +1,68 @@
+"""Import time of the entry points, each measured in a fresh interpreter
+
+The heaviest packages are taken from `python -X importtime`, to see which
+dependency (llama_index, torch, openai...) an entry point pays for.
+"""
+
+import sys
+import time
+import argparse
+import subprocess
+
+from benchmarks import common
+
+entry_points = ["start", "compress", "replay", "sweep", "generate_town"]
+
+
+def _parse_importtime(stderr):
+    """Import time (ms) of each top-level package, the sum of the self time of its modules"""
+
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        name = name.strip().split(".")[0]
+        packages[name] = packages.get(name, 0) + int(self_us) / 1000
+    return packages
+
+
+def bench_import(module, repeat=5, top=5):
+    seconds, packages, error = [], {}, None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import " + module],
+            capture_output=True,
+            text=True,
+        )
+        seconds.append(time.perf_counter() - begin)
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()[-1]
+            break
+        packages = _parse_importtime(proc.stderr)
+    heaviest = sorted(packages.items(), key=lambda p: p[1], reverse=True)[:top]
+    result = {
+        "best_ms": round(min(seconds) * 1000, 2),
+        "mean_ms": round(sum(seconds) / len(seconds) * 1000, 2),
+        "heaviest_ms": {n: round(t, 2) for n, t in heaviest},
+    }
+    if error:
+        result["error"] = error
+    return result
+
+
+parser = argparse.ArgumentParser(description="import time of the entry points")
+parser.add_argument("--modules", type=str, default=",".join(entry_points), help="Comma-separated modules to import")
+parser.add_argument("--repeat", type=int, default=5, help="Interpreters started for each module")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    results = {}
+    for module in args.modules.split(","):
+        results[module] = bench_import(module, args.repeat)
+        print("{:<15} {}".format(module, results[module]), flush=True)
+    print("report saved to " + common.save_report("import", results))
@@ -0,0 +1,163 @@
+"""Microbenchmarks of the hot paths: find_path, percept, retrieve_focus, parse_llm_output and generate_movement"""
+
+import os
+import shutil
+import random
+import argparse
+import datetime
+import itertools
+
+from benchmarks import common
+from modules import utils, memory
+from modules.maze import Maze
+from modules.model import parse_llm_output
+
+
+def _reachable(maze, start):
+    """Coords connected to start, so that find_path always terminates"""
+
+    frontier, visited = [tuple(start)], {tuple(start)}
+    while frontier:
+        new_frontier = []
+        for coord in frontier:
+            for c in maze.get_around(coord):
+                if (
+                    0 < c[0] < maze.maze_width - 1
+                    and 0 < c[1] < maze.maze_height - 1
+                    and c not in visited
+                ):
+                    visited.add(c)
+                    new_frontier.append(c)
+        frontier = new_frontier
+    return sorted(visited)
+
+
+def bench_find_path(number, rnd):
+    maze = Maze(utils.load_dict(os.path.join(common.village_root, "maze.json")), None)
+    start = utils.load_dict(
+        os.path.join(common.village_root, "agents", common.personas[0], "agent.json")
+    )["coord"]
+    coords = _reachable(maze, start)
+    pairs = [(list(rnd.choice(coords)), list(rnd.choice(coords))) for _ in range(number)]
+    pairs_iter = iter(pairs * 5)
+    result = common.measure(lambda: maze.find_path(*next(pairs_iter)), number=number)
+    result["reachable_tiles"] = len(coords)
+    return result
+
+
+def bench_parse_llm_output(number, rnd):
+    response = "\n".join(
+        ["[{}:00] {}は読書をする。".format(h, common.personas[0]) for h in range(6, 24)]
+    )
+    patterns = [
+        r"\[(\d{1,2}:\d{2})\] " + common.personas[0] + r"(.*)。",
+        r"\[(\d{1,2}:\d{2})\] " + common.personas[0] + r"(.*)",
+        r"\[(\d{1,2}:\d{2})\] " + r"(.*)。",
+        r"\[(\d{1,2}:\d{2})\] " + r"(.*)",
+    ]
+    return {
+        "schedule_daily": common.measure(
+            lambda: parse_llm_output(response, patterns, mode="match_all"), number=number
+        ),
+        "poignancy": common.measure(
+            lambda: parse_llm_output("評価：7", [r"評価[:： ]+(\d{1,2})", r"(\d{1,2})"]),
+            number=number,
+        ),
+    }
+
+
+def _warm_server(agents_num, steps, stride=10):
+    """Run a short simulation with the stub backends, returns the server with memory filled"""
+
+    from start import SimulateServer
+
+    names = common.personas[:agents_num]
+    config = common.simulation_config(names, stride)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    name = f"benchmark-micro-{stamp}"
+    # INFOのログ（ステップや知覚の度に出る）で計測結果が埋もれないようにする
+    server = SimulateServer(
+        name, "frontend/static", f"results/checkpoints/{name}", config, 0, "warn", "simulate.log", False
+    )
+    server.simulate(steps, stride)
+    return server
+
+
+def _percept_new_events(agent):
+    """percept with new events on the tile of the agent on each call
+
+    The events of the previous call are replaced, so every call evaluates the
+    poignancy of the new events (up to att_bandwidth) and adds them to the
+    memory, instead of skipping the events already remembered.
+    """
+
+    tile, counter, placed = agent.get_tile(), itertools.count(), []
+
+    def _percept():
+        for event in placed:
+            tile.remove_events(event=event)
+        placed.clear()
+        for _ in range(agent.percept_config["att_bandwidth"]):
+            idx = next(counter)
+            event = memory.Event(
+                f"ベンチ{idx}", "現在", f"作業{idx}", address=tile.get_address(), describe=f"ベンチ{idx}は作業{idx}をしている"
+            )
+            placed.append(tile.add_event(event))
+        agent.percept()
+
+    return _percept
+
+
+def bench_agent(server, number):
+    agent = list(server.game.agents.values())[0]
+    focus = [agent.get_event().get_describe(), agent.scratch.currently]
+    nodes = agent.associate.index.nodes_num
+    result = common.measure(_percept_new_events(agent), number=number, repeat=3)
+    # 1回あたりに記憶へ追加された新しいイベントの数
+    result["new_events"] = round((agent.associate.index.nodes_num - nodes) / (number * 3), 2)
+    return {
+        "nodes": nodes,
+        "percept": result,
+        "retrieve_focus": common.measure(
+            lambda: agent.associate.retrieve_focus(focus), number=number, repeat=3
+        ),
+    }
+
+
+def bench_generate_movement(server, number):
+    from compress import generate_movement
+
+    compressed_folder = os.path.join(common.benchmark_root, "compressed")
+    os.makedirs(compressed_folder, exist_ok=True)
+    result = common.measure(
+        lambda: generate_movement(server.checkpoints_folder, compressed_folder, "movement.json"),
+        number=number,
+        repeat=3,
+    )
+    result["steps"] = server.config["step"]
+    shutil.rmtree(compressed_folder, ignore_errors=True)
+    return result
+
+
+parser = argparse.ArgumentParser(description="microbenchmarks of the simulation")
+parser.add_argument("--number", type=int, default=100, help="Calls of each timing loop")
+parser.add_argument("--agents", type=int, default=5, help="Agents of the warm-up simulation")
+parser.add_argument("--steps", type=int, default=50, help="Steps of the warm-up simulation")
+parser.add_argument("--seed", type=int, default=0, help="The random seed")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    random.seed(args.seed)
+    rnd = random.Random(args.seed)
+    results = {
+        "find_path": bench_find_path(args.number, rnd),
+        "parse_llm_output": bench_parse_llm_output(args.number * 10, rnd),
+    }
+    server = _warm_server(args.agents, args.steps)
+    results.update(bench_agent(server, args.number))
+    results["generate_movement"] = bench_generate_movement(server, max(args.number // 50, 1))
+    shutil.rmtree(server.checkpoints_folder, ignore_errors=True)
+    for key, value in results.items():
+        print("{:<20} {}".format(key, value))
+    print("report saved to " + common.save_report("micro", results))
@@ -0,0 +1,123 @@
+"""Throughput of SimulateServer with the stub llm and embedding
+
+Each case runs in a fresh process, so that the peak RSS and the global maps
+(timer, game, models) belong to that case only.
+"""
+
+import json
+import time
+import shutil
+import random
+import argparse
+import datetime
+import multiprocessing
+
+from benchmarks import common
+
+
+def run_case(agents_num, steps, stride=10, latency=0, seed=0, keep=False, town=False):
+    from start import SimulateServer
+    from modules import utils
+
+    random.seed(seed)
+    if town:
+        static_root, names, assets_root = common.prepare_town(agents_num, seed)
+    else:
+        (static_root, names), assets_root = common.prepare_static(agents_num), None
+    config = common.simulation_config(
+        names, stride, latency=latency, seed=seed, assets_root=assets_root
+    )
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    name = f"benchmark-{agents_num}x{steps}-{stamp}"
+    checkpoints_folder = f"results/checkpoints/{name}"
+
+    utils.set_profiler(enabled=True)
+    begin = time.perf_counter()
+    server = SimulateServer(
+        name, static_root, checkpoints_folder, config, 0, "info", "simulate.log", False
+    )
+    setup = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    server.simulate(steps, stride)
+    duration = time.perf_counter() - begin
+
+    phases, llm_seconds = {}, 0
+    with open(f"{server.profile_folder}/steps.jsonl", "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            llm_seconds += record["llm_seconds"]
+            for path, span in record["spans"].items():
+                phases[path] = phases.get(path, 0) + span["seconds"]
+    nodes = {n: a.associate.index.nodes_num for n, a in server.game.agents.items()}
+    result = {
+        "agents": agents_num,
+        "steps": steps,
+        "setup_seconds": round(setup, 4),
+        "seconds": round(duration, 4),
+        "steps_per_sec": round(steps / duration, 4),
+        "agent_steps_per_sec": round(steps * agents_num / duration, 4),
+        "llm_seconds": round(llm_seconds, 4),
+        "phases": {p: round(s, 4) for p, s in sorted(phases.items())},
+        "peak_rss_mb": common.peak_rss_mb(),
+        "checkpoint_bytes": common.folder_size(checkpoints_folder),
+        "nodes": {
+            "min": min(nodes.values()),
+            "mean": round(sum(nodes.values()) / len(nodes), 2),
+            "max": max(nodes.values()),
+            "per_agent": nodes,
+        },
+    }
+    if not keep:
+        shutil.rmtree(checkpoints_folder, ignore_errors=True)
+    return result
+
+
+def _run_case(kwargs):
+    return run_case(**kwargs)
+
+
+def format_result(result):
+    top = {p: s for p, s in result["phases"].items() if "/" not in p}
+    return "agents {:>4} steps {:>5} | {:>8.2f} steps/s {:>9.2f} agent-steps/s | rss {:>8.1f}MB | checkpoint {:>10}B | nodes {} | {}".format(
+        result["agents"],
+        result["steps"],
+        result["steps_per_sec"],
+        result["agent_steps_per_sec"],
+        result["peak_rss_mb"],
+        result["checkpoint_bytes"],
+        result["nodes"]["mean"],
+        ", ".join("{} {:.2f}s".format(p, s) for p, s in top.items()),
+    )
+
+
+parser = argparse.ArgumentParser(description="benchmark of the simulation throughput")
+parser.add_argument("--agents", type=str, default="1,5,25,100", help="Comma-separated numbers of agents")
+parser.add_argument("--steps", type=str, default="10,100,1000", help="Comma-separated numbers of steps")
+parser.add_argument("--stride", type=int, default=10, help="The step stride in minute")
+parser.add_argument("--latency", type=float, default=0, help="Injected latency of the stub llm in seconds")
+parser.add_argument("--seed", type=int, default=0, help="The random seed")
+parser.add_argument("--town", action="store_true", help="Run in a synthetic town generated for the number of agents")
+parser.add_argument("--keep", action="store_true", help="Keep the checkpoints of the benchmark")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for agents_num in [int(a) for a in args.agents.split(",")]:
+        for steps in [int(s) for s in args.steps.split(",")]:
+            case = {
+                "agents_num": agents_num,
+                "steps": steps,
+                "stride": args.stride,
+                "latency": args.latency,
+                "seed": args.seed,
+                "keep": args.keep,
+                "town": args.town,
+            }
+            with ctx.Pool(1) as pool:
+                result = pool.apply(_run_case, (case,))
+            print(format_result(result), flush=True)
+            results.append(result)
+    print("report saved to " + common.save_report("simulate", results))
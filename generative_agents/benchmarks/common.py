@@ -0,0 +1,131 @@
+"""benchmarks.common"""
+
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import resource
+import datetime
+
+from modules.constants import personas
+from modules import utils
+from modules.town import TownGenerator, save_town
+
+benchmark_root = "results/benchmarks"
+village_root = "frontend/static/assets/village"
+
+
+def stub_config(config, latency=0, seed=0, dim=256):
+    """Replace the llm and embedding of the simulation config with the stub providers"""
+
+    config = copy.deepcopy(config)
+    agent_base = config.setdefault("agent_base", {})
+    llm = agent_base.setdefault("think", {}).get("llm", {})
+    agent_base["think"]["llm"] = {
+        "provider": "stub",
+        "seed": seed,
+        "latency": latency,
+        "num_parallel": llm.get("num_parallel", 1),
+        "batch_window": llm.get("batch_window", 0.05),
+    }
+    agent_base.setdefault("associate", {})["embedding"] = {"provider": "stub", "dim": dim}
+    return config
+
+
+def clone_personas(num):
+    """Names of num agents, the personas are reused with a suffix when num exceeds them"""
+
+    names = []
+    for i in range(num):
+        name = personas[i % len(personas)]
+        if i >= len(personas):
+            name += str(i // len(personas) + 1)
+        names.append(name)
+    return names
+
+
+def prepare_static(num):
+    """Create a static root holding the village maze and num (cloned) agents"""
+
+    static_root = os.path.join(benchmark_root, "static")
+    agents_root = os.path.join(static_root, "assets", "village", "agents")
+    os.makedirs(agents_root, exist_ok=True)
+    maze_path = os.path.join(static_root, "assets", "village", "maze.json")
+    if not os.path.exists(maze_path):
+        shutil.copy(os.path.join(village_root, "maze.json"), maze_path)
+    names = clone_personas(num)
+    for name in names:
+        agent_path = os.path.join(agents_root, name, "agent.json")
+        if os.path.exists(agent_path):
+            continue
+        origin = personas[personas.index(name.rstrip("0123456789"))]
+        agent_config = utils.load_dict(os.path.join(village_root, "agents", origin, "agent.json"))
+        agent_config["name"] = name
+        os.makedirs(os.path.dirname(agent_path), exist_ok=True)
+        utils.save_dict(agent_config, agent_path)
+    return static_root, names
+
+
+def prepare_town(num, seed=0):
+    """Create a static root holding a synthetic town of num agents"""
+
+    static_root = os.path.join(benchmark_root, "static")
+    assets_name = f"town-{num}-{seed}"
+    if not os.path.exists(os.path.join(static_root, "assets", assets_name, "maze.json")):
+        maze, agents = TownGenerator(num, seed=seed).generate()
+        save_town(maze, agents, static_root, assets_name)
+    agents_root = os.path.join(static_root, "assets", assets_name, "agents")
+    return static_root, sorted(os.listdir(agents_root)), os.path.join("assets", assets_name)
+
+
+def simulation_config(names, stride=10, start="20240213-09:30", latency=0, seed=0, assets_root=None):
+    from start import get_config
+
+    return stub_config(
+        get_config(start, stride, names, assets_root), latency=latency, seed=seed
+    )
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB"""
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KB, macOS reports bytes
+    if sys.platform == "darwin":
+        return round(rss / 1024 / 1024, 2)
+    return round(rss / 1024, 2)
+
+
+def folder_size(folder):
+    size = 0
+    for root, _, files in os.walk(folder):
+        size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return size
+
+
+def measure(func, number=100, repeat=5):
+    """Time func like timeit, returns the per-call time in milliseconds"""
+
+    times = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - begin) / number * 1000)
+    return {
+        "number": number,
+        "repeat": repeat,
+        "best_ms": round(min(times), 4),
+        "mean_ms": round(sum(times) / len(times), 4),
+    }
+
+
+def save_report(kind, results):
+    os.makedirs(benchmark_root, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(benchmark_root, f"{kind}-{stamp}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(results, indent=2, ensure_ascii=False))
+    return path
@@ -1,47 +1,28 @@
 import os
 import json
+import shutil
 import argparse
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from modules.maze import Maze
-from start import personas
+from modules.maze import Maze, load_maze_config
+from modules.checkpoint import iter_checkpoints, load_conversation
+from modules.movement import MOVEMENT_FORMAT, StringTable, encode_path, decode_path
+from modules.movement import get_location, get_action, get_step_conversation, clip_path
+from modules.constants import file_markdown, file_movement, frames_per_step
+from modules.constants import folder_chunks, file_chunk_index, chunk_steps, file_compress_state
+from modules import utils
 
-file_markdown = "simulation.md"
-file_movement = "movement.json"
-
-frames_per_step = 60  # 每个step包含的帧数
-
-
-# 从存档文件中读取stride
-def get_stride(json_files):
-    if len(json_files) < 1:
-        return 1
-
-    with open(json_files[-1], "r", encoding="utf-8") as f:
-        config = json.load(f)
-
-    return config["stride"]
-
-
-# 将address转换为字符串
-def get_location(address):
-    # 仅为兼容原版
-    # if address[0] == "<waiting>" or address[0] == "<persona>":
-    #     return None
-
-    # 不需要显示address第一级（"the Ville"）
-    location = "、".join(address[1:])
-
-    return location
+static_root = "frontend/static"
 
 
 # 插入第0帧数据（Agent的初始状态）
-def insert_frame0(init_pos, movement, agent_name):
+def insert_frame0(init_pos, movement, agent_name, config_path=None):
     key = "0"
     if key not in movement.keys():
         movement[key] = dict()
 
-    json_path = f"frontend/static/assets/village/agents/{agent_name}/agent.json"
+    config_path = config_path or f"assets/village/agents/{agent_name}/agent.json"
+    json_path = os.path.join(static_root, config_path)
     with open(json_path, "r", encoding="utf-8") as f:
         json_data = json.load(f)
         address = json_data["spatial"]["address"]["living_area"]
@@ -59,223 +40,472 @@ def insert_frame0(init_pos, movement, agent_name):
     }
 
 
-# 从所有存档文件中提取数据（用于回放）
-def generate_movement(checkpoints_folder, compressed_folder, compressed_file):
-    movement_file = os.path.join(compressed_folder, compressed_file)
-
-    conversation_file = "conversation.json"
-    conversation = {}
-    if os.path.exists(os.path.join(checkpoints_folder, conversation_file)):
-        with open(os.path.join(checkpoints_folder, conversation_file), "r", encoding="utf-8") as f:
-            conversation = json.load(f)
-
-    files = sorted(os.listdir(checkpoints_folder))
-    json_files = list()
-    for file_name in files:
-        if file_name.endswith(".json") and file_name != conversation_file:
-            json_files.append(os.path.join(checkpoints_folder, file_name))
-
-    persona_init_pos = dict()
-    all_movement = dict()
-    all_movement["description"] = dict()
-    all_movement["conversation"] = dict()
-
-    stride = get_stride(json_files)
-    sec_per_step = stride
-
-    result = {
-        "start_datetime": "",  # 起始时间
-        "stride": stride,  # 每个step对应的分钟数（必须与生成时的参数一致）
-        "sec_per_step": sec_per_step,  # 回放时每一帧对应的秒数
-        "persona_init_pos": persona_init_pos,  # 每个Agent的初始位置
-        "all_movement": all_movement,  # 所有Agent在每个setp中的位置变化
-    }
-
-    last_location = dict()
-
-    # 加载地图数据，用于计算Agent移动路径
-    json_path = "frontend/static/assets/village/maze.json"
-    with open(json_path, "r", encoding="utf-8") as f:
-        json_data = json.load(f)
-        maze = Maze(json_data, None)
-
-    for file_name in json_files:
-        # 依次读取所有存档文件
-        with open(file_name, "r", encoding="utf-8") as f:
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+class MovementSink:
+    """Write the compact replay data (movement.json) segment by segment while the checkpoints are read.
+
+    Only the last state of each agent and the string table are kept in memory,
+    the conversation texts are spooled to a temporary file and appended at the end.
+    With chunk_folder, the segments are also split into self-contained chunks of
+    chunk_steps steps with an index, for the replay to load them on demand. Each
+    chunk starts with a keyframe (the state of all the agents), so a step is
+    sought by reading the single chunk holding it.
+
+    The sink can be resumed from its state(): movement.json is cut back where
+    the segments end and the new segments are appended from there.
+    """
+
+    name = "movement"
+
+    def __init__(self, movement_file, chunk_folder=None, chunk_steps=chunk_steps):
+        self.movement_file = movement_file
+        self.chunk_folder = chunk_folder
+        self.chunk_steps = chunk_steps
+        self.chunks = []
+        self._chunk = None
+        self._file = None
+        self._conversation = None
+        self._conversation_num = 0
+        self._segments_num = 0
+        self._offsets = None
+        self.maze = None
+        self.maze_path = None
+        self.agents = dict()
+        self.strings = StringTable()
+        self.last_state = dict()
+        self.frame0 = dict()
+        self.description = dict()
+        self.next_frame = 1
+        self.result = {"start_datetime": "", "stride": 1, "sec_per_step": 1}
+
+    def can_resume(self, state):
+        if not state or state.get("maze_path") is None:
+            return False
+        if (state["chunk_steps"], state["frames_per_step"]) != (self.chunk_steps, frames_per_step):
+            return False
+        if bool(state["chunks"] or state["chunk"]) != bool(self.chunk_folder):
+            return False
+        if self.chunk_folder and not os.path.isdir(self.chunk_folder):
+            return False
+        return os.path.isfile(self.movement_file) and os.path.getsize(self.movement_file) >= state["offsets"][-1]
+
+    def open(self, state=None):
+        self._conversation = open(self.movement_file + ".conversation.tmp", "w+", encoding="utf-8")
+        if state is None:
+            if self.chunk_folder:
+                shutil.rmtree(self.chunk_folder, ignore_errors=True)
+                os.makedirs(self.chunk_folder)
+            return
+        self._load_maze(state["maze_path"])
+        self.result, self.frame0, self.description = state["result"], state["frame0"], state["description"]
+        self.next_frame = state["next_frame"]
+        self.last_state = {n: tuple(s) for n, s in state["last_state"].items()}
+        self.agents = {n: i for i, n in enumerate(state["agents"])}
+        self.strings = StringTable(state["strings"])
+        self._segments_num, self._conversation_num = state["segments_num"], state["conversation_num"]
+        self.chunks = state["chunks"]
+        if state["chunk"]:
+            chunk = state["chunk"]
+            self._chunk = dict(
+                chunk,
+                agents={n: i for i, n in enumerate(chunk["agents"])},
+                strings=StringTable(chunk["strings"]),
+            )
+
+        # 前回の対話を一時ファイルに戻し、区間の末尾以降を切り捨てて追記を再開する
+        segments_end, conversation_start, conversation_end = state["offsets"]
+        with open(self.movement_file, "rb") as f:
+            f.seek(conversation_start)
+            self._conversation.write(f.read(conversation_end - conversation_start).decode("utf-8"))
+        self._file = open(self.movement_file, "r+", encoding="utf-8")
+        self._file.seek(segments_end)
+        self._file.truncate()
+
+    def state(self):
+        chunk = None
+        if self._chunk:
+            chunk = dict(self._chunk, agents=list(self._chunk["agents"]), strings=self._chunk["strings"].strings)
+        return {
+            "maze_path": self.maze_path,
+            "chunk_steps": self.chunk_steps,
+            "frames_per_step": frames_per_step,
+            "result": self.result,
+            "frame0": self.frame0,
+            "description": self.description,
+            "next_frame": self.next_frame,
+            "last_state": self.last_state,
+            "agents": list(self.agents.keys()),
+            "strings": self.strings.strings,
+            "segments_num": self._segments_num,
+            "conversation_num": self._conversation_num,
+            "offsets": self._offsets,
+            "chunks": self.chunks,
+            "chunk": chunk,
+        }
+
+    def _load_maze(self, maze_path):
+        self.maze_path = maze_path
+        self.maze = Maze(load_maze_config(os.path.join(static_root, maze_path)), None)
+
+    def _open(self, checkpoint):
+        # 加载地图数据，用于计算Agent移动路径（生成した町の場合はその地図）
+        self._load_maze(checkpoint.get("maze", {}).get("path", "assets/village/maze.json"))
+
+        # 保存回放的起始时间（フレームはステップ1から数えるため、最初のチェックポイントがそれより後ならその分戻す）
+        t = datetime.strptime(checkpoint["time"], "%Y%m%d-%H:%M")
+        t -= timedelta(minutes=checkpoint["stride"] * (checkpoint["step"] - 1))
+        self.result = {
+            "start_datetime": t.isoformat(),  # 起始时间
+            "stride": checkpoint["stride"],  # 每个step对应的分钟数（必须与生成时的参数一致）
+            "sec_per_step": checkpoint["stride"],  # 回放时每一帧对应的秒数
+        }
+
+        # 插入第0帧（以第一个存档中的Agent为准）
+        persona_init_pos, head = dict(), {"description": dict()}
+        for agent_name, agent_data in checkpoint["agents"].items():
+            insert_frame0(persona_init_pos, head, agent_name, agent_data.get("config_path"))
+        self.frame0, self.description = head["0"], head["description"]
+        self._write_head(persona_init_pos, head["description"])
+        for agent_name, frame0 in head["0"].items():
+            self._write_segment(agent_name, 0, frame0["location"], frame0["description"], [frame0["movement"]])
+
+    def _write_head(self, persona_init_pos, description):
+        self._file = open(self.movement_file, "w", encoding="utf-8")
+        self._file.write("{\n")
+        self._file.write(f'"format":{MOVEMENT_FORMAT},\n')
+        for key, value in self.result.items():
+            self._file.write(f'"{key}":{_dumps(value)},\n')
+        self._file.write(f'"frames_per_step":{frames_per_step},\n')
+        # 每个Agent的初始位置
+        self._file.write(f'"persona_init_pos":{_dumps(persona_init_pos)},\n')
+        self._file.write(f'"description":{_dumps(description)},\n')
+        self._file.write('"segments":[')
+
+    def _write_segment(self, agent_name, frame, location, action, path):
+        if agent_name not in self.agents:
+            self.agents[agent_name] = len(self.agents)
+        moves = encode_path(path)
+        segment = [self.agents[agent_name], frame, self.strings.intern(location), self.strings.intern(action)]
+        segment.extend(moves)
+        prefix = "," if self._segments_num else ""
+        self._file.write(f"{prefix}\n{_dumps(segment)}")
+        self._segments_num += 1
+        if self.chunk_folder and frame > 0:
+            chunk = self._chunk_at(frame)
+            chunk["agents"].setdefault(agent_name, len(chunk["agents"]))
+            segment = [
+                chunk["agents"][agent_name],
+                frame,
+                chunk["strings"].intern(location),
+                chunk["strings"].intern(action),
+            ]
+            segment.extend(moves)
+            chunk["segments"].append(segment)
+        # 第0フレームの状態（寝ています）は比較に使わず、次のステップは必ず記録する
+        self.last_state[agent_name] = (list(path[-1]), location, action if frame > 0 else None)
+
+    def _agent_segment(self, agent_name, agent_data, frame, persons_in_conversation):
+        source_coord, location = self.last_state[agent_name][:2]
+        target_coord = agent_data["coord"]
+        new_location = get_location(agent_data["action"]["event"]["address"])
+        recorded = agent_data.get("path")
+        if new_location is None:
+            path = [source_coord]
+        else:
+            location = new_location
+            if recorded and list(recorded[:2]) == list(source_coord):
+                # シミュレーション中に記録された経路（start.py --record-path）をそのまま使う
+                path = decode_path(*recorded)
+            elif list(source_coord) == list(target_coord):
+                path = [source_coord]
+            else:
+                path = self.maze.find_path(source_coord, target_coord)
+
+        # 到着後の行動（移動中のフレームは「{location}へ向かう」として復元される）
+        had_conversation = any(agent_name in persons for persons in persons_in_conversation)
+        action = get_action(agent_data["action"]["event"], had_conversation)
+        path, action = clip_path(path, location, action, frames_per_step)
+
+        # 状態が変わらない場合は記録しない（再生時に各ステップの最初のフレームへ直前の状態を補う）
+        state = (list(path[-1]), location, action)
+        if len(path) == 1 and state == self.last_state[agent_name]:
+            return
+        self._write_segment(agent_name, frame, location, action, path)
+
+    def feed(self, checkpoint, conversation):
+        if self._file is None:
+            self._open(checkpoint)
+        step = checkpoint["step"]
+        step_time = checkpoint["time"]
+        step_conversation, persons_in_conversation = get_step_conversation(conversation, step_time)
+
+        first = (step - 1) * frames_per_step + 1
+        for agent_name, agent_data in checkpoint["agents"].items():
+            self._agent_segment(agent_name, agent_data, first, persons_in_conversation)
+        self.next_frame = max(self.next_frame, first + frames_per_step)
+
+        # 対話のないステップは記録しない
+        if step_conversation:
+            prefix = "," if self._conversation_num else ""
+            self._conversation.write(f"{prefix}\n{_dumps(step_time)}:{_dumps(step_conversation)}")
+            self._conversation_num += 1
+            if self.chunk_folder:
+                self._chunk_at(first)["conversation"][step_time] = step_conversation
+
+    def _chunk_at(self, frame):
+        """The chunk holding the frame, the previous chunks are written when it starts"""
+
+        index = (frame - 1) // (self.chunk_steps * frames_per_step)
+        while self._chunk is None or self._chunk["index"] < index:
+            next_index = self._chunk["index"] + 1 if self._chunk else 0
+            if self._chunk:
+                self.chunks.append(self._write_chunk())
+            self._chunk = {
+                "index": next_index,
+                "keyframe": self._keyframe(),
+                "agents": dict(),
+                "strings": StringTable(),
+                "segments": [],
+                "conversation": dict(),
+            }
+        return self._chunk
+
+    def _keyframe(self):
+        """The full state of the agents before the chunk, from where it can be played alone"""
+
+        return {
+            agent_name: {"location": location, "movement": coord, "action": action}
+            for agent_name, (coord, location, action) in self.last_state.items()
+            # 第0フレームの状態は再生時に補わない
+            if action is not None
+        }
+
+    def _write_chunk(self):
+        chunk, size = self._chunk, self.chunk_steps * frames_per_step
+        data = {
+            "index": chunk["index"],
+            "start": chunk["index"] * size + 1,
+            "end": (chunk["index"] + 1) * size,
+            "keyframe": chunk["keyframe"],
+            "agents": list(chunk["agents"].keys()),
+            "strings": chunk["strings"].strings,
+            "segments": chunk["segments"],
+            "conversation": chunk["conversation"],
+        }
+        file_name = "chunk-{:05d}.json".format(chunk["index"])
+        with open(os.path.join(self.chunk_folder, file_name), "w", encoding="utf-8") as f:
+            f.write(_dumps(data))
+        return file_name
+
+    def _write_chunk_index(self):
+        # 末尾の変化のないステップも含め、全フレームがいずれかのチャンクに収まるようにする
+        if self.next_frame > 1:
+            self._chunk_at(self.next_frame - 1)
+        # 最後のチャンクは追記中のため、書き出しても一覧（状態）には加えない
+        chunks = self.chunks + [self._write_chunk()] if self._chunk else self.chunks
+        index = dict(
+            self.result,
+            format=MOVEMENT_FORMAT,
+            frames_per_step=frames_per_step,
+            chunk_steps=self.chunk_steps,
+            frames=self.next_frame - 1,
+            persona_init_pos={n: f["movement"] for n, f in self.frame0.items()},
+            description=self.description,
+            frame0=self.frame0,
+            # チャンクiはフレーム i*chunk_frames+1 から始まり、先頭にキーフレームを持つ
+            chunk_frames=self.chunk_steps * frames_per_step,
+            chunks=chunks,
+        )
+        with open(os.path.join(self.chunk_folder, file_chunk_index), "w", encoding="utf-8") as f:
+            f.write(_dumps(index))
+
+    def close(self):
+        if self._file is None:
+            self._write_head(dict(), dict())
+        # 区間と対話の位置を記録しておき、次回はここから追記する
+        segments_end = self._file.tell()
+        self._file.write("\n],\n")
+        self._file.write(f'"frames":{self.next_frame - 1},\n')
+        self._file.write(f'"agents":{_dumps(list(self.agents.keys()))},\n')
+        self._file.write(f'"strings":{_dumps(self.strings.strings)},\n')
+        self._file.write('"conversation":{')
+        conversation_start = self._file.tell()
+        self._conversation.seek(0)
+        for line in self._conversation:
+            self._file.write(line)
+        conversation_end = self._file.tell()
+        self._file.write("\n}\n}\n")
+        self._file.close()
+        self._offsets = [segments_end, conversation_start, conversation_end]
+        self._conversation.close()
+        os.remove(self._conversation.name)
+        if self.chunk_folder:
+            self._write_chunk_index()
+        return dict(self.result, frames=self.next_frame - 1)
+
+
+def extract_description(agents):
+    """The settings of the agents of the checkpoint (the config_path of each agent, e.g. a generated town)"""
+
+    markdown_content = "# 基本キャラクター設定\n\n"
+    for agent_name, agent_data in agents.items():
+        config_path = agent_data.get("config_path") or f"assets/village/agents/{agent_name}/agent.json"
+        json_path = os.path.join(static_root, config_path)
+        with open(json_path, "r", encoding="utf-8") as f:
             json_data = json.load(f)
-            step = json_data["step"]
-            agents = json_data["agents"]
-
-            # 保存回放的起始时间
-            if len(result["start_datetime"]) < 1:
-                t = datetime.strptime(json_data["time"], "%Y%m%d-%H:%M")
-                result["start_datetime"] = t.isoformat()
-
-            # 遍历单个存档文件中的所有Agent
-            for agent_name, agent_data in agents.items():
-                # 插入第0帧
-                if step == 1:
-                    insert_frame0(persona_init_pos, all_movement, agent_name)
-
-                source_coord = last_location.get(agent_name, all_movement["0"][agent_name])["movement"]
-                target_coord = agent_data["coord"]
-                location = get_location(agent_data["action"]["event"]["address"])
-                if location is None:
-                    location = last_location.get(agent_name, all_movement["0"][agent_name])["location"]
-                    path = [source_coord]
-                else:
-                    path = maze.find_path(source_coord, target_coord)
-
-                had_conversation = False
-                step_conversation = ""
-                persons_in_conversation = []
-                step_time = json_data["time"]
-                if step_time in conversation.keys():
-                    for chats in conversation[step_time]:
-                        for persons, chat in chats.items():
-                            persons_in_conversation.append(persons.split(" @ ")[0].split(" -> "))
-                            step_conversation += f"\n場所：{persons.split(' @ ')[1]}\n\n"
-                            for c in chat:
-                                agent = c[0]
-                                text = c[1]
-                                step_conversation += f"{agent}：{text}\n"
-
-                for i in range(frames_per_step):
-                    moving = len(path) > 1
-                    if len(path) > 0:
-                        movement = list(path[0])
-                        path = path[1:]
-                        if agent_name not in last_location.keys():
-                            last_location[agent_name] = dict()
-                        last_location[agent_name]["movement"] = movement
-                        last_location[agent_name]["location"] = location
-                    else:
-                        movement = None
-
-                    if moving:
-                        action = f"{location}へ向かう"
-                    elif movement is not None:
-                        action = agent_data["action"]["event"]["describe"]
-                        if len(action) < 1:
-                            action = f'{agent_data["action"]["event"]["predicate"]}{agent_data["action"]["event"]["object"]}'
-
-                        # 判断该存档文件中当前Agent是否有新的对话（用于设置图标）
-                        for persons in persons_in_conversation:
-                            if agent_name in persons:
-                                had_conversation = True
-                                break
-
-                        # 针对睡觉和对话设置图标
-                        if "寝る" in action or "睡眠" in action:
-                            action = "😴 " + action
-                        elif had_conversation:
-                            action = "💬 " + action
-
-                    step_key = "%d" % ((step-1) * frames_per_step + 1 + i)
-                    if step_key not in all_movement.keys():
-                        all_movement[step_key] = dict()
-
-                    if movement is not None:
-                        all_movement[step_key][agent_name] = {
-                            "location": location,
-                            "movement": movement,
-                            "action": action,
-                        }
-                all_movement["conversation"][step_time] = step_conversation
-
-    # 保存数据
-    with open(movement_file, "w", encoding="utf-8") as f:
-        f.write(json.dumps(result, indent=2, ensure_ascii=False))
-
-    return result
-
-
-# 生成Markdown文档
-def generate_report(checkpoints_folder, compressed_folder, compressed_file):
-    last_state = dict()
-
-    conversation_file = "conversation.json"
-    conversation = {}
-    if os.path.exists(os.path.join(checkpoints_folder, conversation_file)):
-        with open(os.path.join(checkpoints_folder, conversation_file), "r", encoding="utf-8") as f:
-            conversation = json.load(f)
-
-    def extract_description():
-        markdown_content = "# 基本キャラクター設定\n\n"
-        for agent_name in personas:
-            json_path = f"frontend/static/assets/village/agents/{agent_name}/agent.json"
-            with open(json_path, "r", encoding="utf-8") as f:
-                json_data = json.load(f)
-                markdown_content += f"## {agent_name}\n\n"
-                markdown_content += f"年齢：{json_data['scratch']['age']}歳  \n"
-                markdown_content += f"先天的：{json_data['scratch']['innate']}  \n"
-                markdown_content += f"後天的：{json_data['scratch']['learned']}  \n"
-                markdown_content += f"生活習慣：{json_data['scratch']['lifestyle']}  \n"
-                markdown_content += f"現在の状態：{json_data['currently']}\n\n"
-        return markdown_content
-
-    def extract_action(json_data):
-        markdown_content = ""
-        agents = json_data["agents"]
-        for agent_name, agent_data in agents.items():
-            if agent_name not in last_state.keys():
-                last_state[agent_name] = {"currently": "", "location": "", "action": ""}
+            markdown_content += f"## {agent_name}\n\n"
+            markdown_content += f"年齢：{json_data['scratch']['age']}歳  \n"
+            markdown_content += f"先天的：{json_data['scratch']['innate']}  \n"
+            markdown_content += f"後天的：{json_data['scratch']['learned']}  \n"
+            markdown_content += f"生活習慣：{json_data['scratch']['lifestyle']}  \n"
+            markdown_content += f"現在の状態：{json_data['currently']}\n\n"
+    return markdown_content
+
+
+def extract_action(json_data, conversation, last_state):
+    markdown_content = ""
+    agents = json_data["agents"]
+    for agent_name, agent_data in agents.items():
+        if agent_name not in last_state.keys():
+            last_state[agent_name] = {"currently": "", "location": "", "action": ""}
+
+        location = "、".join(agent_data["action"]["event"]["address"])
+        action = agent_data["action"]["event"]["describe"]
+
+        if location == last_state[agent_name]["location"] and action == last_state[agent_name]["action"]:
+            continue
 
-            location = "、".join(agent_data["action"]["event"]["address"])
-            action = agent_data["action"]["event"]["describe"]
+        last_state[agent_name]["location"] = location
+        last_state[agent_name]["action"] = action
 
-            if location == last_state[agent_name]["location"] and action == last_state[agent_name]["action"]:
-                continue
+        if len(markdown_content) < 1:
+            markdown_content = f"# {json_data['time']}\n\n"
+            markdown_content += "## 活動記録：\n\n"
 
-            last_state[agent_name]["location"] = location
-            last_state[agent_name]["action"] = action
+        markdown_content += f"### {agent_name}\n"
 
-            if len(markdown_content) < 1:
-                markdown_content = f"# {json_data['time']}\n\n"
-                markdown_content += "## 活動記録：\n\n"
+        if len(action) < 1:
+            action = "寝る"
 
-            markdown_content += f"### {agent_name}\n"
+        markdown_content += f"位置：{location}  \n"
+        markdown_content += f"活動：{action}  \n"
 
-            if len(action) < 1:
-                action = "寝る"
+        markdown_content += f"\n"
 
-            markdown_content += f"位置：{location}  \n"
-            markdown_content += f"活動：{action}  \n"
+    if json_data['time'] not in conversation:
+        return markdown_content
 
-            markdown_content += f"\n"
+    markdown_content += "## 対話記録：\n\n"
+    for chats in conversation[json_data['time']]:
+        for agents, chat in chats.items():
+            markdown_content += f"### {agents}\n\n"
+            for item in chat:
+                markdown_content += f"`{item[0]}`\n> {item[1]}\n\n"
+    return markdown_content
+
+
+class ReportSink:
+    """Write the Markdown report (simulation.md) checkpoint by checkpoint"""
+
+    name = "report"
+
+    def __init__(self, report_file):
+        self.report_file = report_file
+        self.last_state = dict()
+        self._file = None
+        self._size = 0
+        # キャラクター設定は最初のチェックポイントのエージェントから書く
+        self._head = False
+
+    def can_resume(self, state):
+        return bool(state) and os.path.isfile(self.report_file) and os.path.getsize(self.report_file) >= state["size"]
+
+    def open(self, state=None):
+        if state is None:
+            self._file = open(self.report_file, "w", encoding="utf-8")
+            self._head = True
+            return
+        self.last_state = state["last_state"]
+        self._head = state.get("head", False)
+        self._file = open(self.report_file, "r+", encoding="utf-8")
+        self._file.seek(state["size"])
+        self._file.truncate()
+
+    def state(self):
+        return {"size": self._size, "last_state": self.last_state, "head": self._head}
+
+    def feed(self, checkpoint, conversation):
+        if self._head:
+            self._file.write(extract_description(checkpoint["agents"]))
+            self._head = False
+        self._file.write(extract_action(checkpoint, conversation, self.last_state) + "\n\n")
+
+    def close(self):
+        self._size = self._file.tell()
+        self._file.close()
+        return self.report_file
+
+
+def load_compress_state(state_file):
+    if not state_file or not os.path.isfile(state_file):
+        return None
+    with open(state_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# 依次读取所有存档文件（每个文件只读取一次），同时写入所有输出
+def compress(checkpoints_folder, sinks, state_file=None):
+    """Feed the checkpoints to the sinks.
+
+    With state_file, the last processed checkpoint and the state of the sinks
+    are saved there, and the next call only feeds the checkpoints after it.
+    The outputs are rebuilt from scratch if a sink can't be resumed.
+    """
+
+    state = load_compress_state(state_file)
+    if state and not all(sink.can_resume(state["sinks"].get(sink.name)) for sink in sinks):
+        state = None
+    for sink in sinks:
+        sink.open(state["sinks"][sink.name] if state else None)
+
+    conversation = load_conversation(checkpoints_folder)
+    last_checkpoint = state["checkpoint"] if state else None
+    for file_name, checkpoint in iter_checkpoints(checkpoints_folder, after=last_checkpoint):
+        for sink in sinks:
+            sink.feed(checkpoint, conversation)
+        last_checkpoint = file_name
+    results = [sink.close() for sink in sinks]
+
+    if state_file:
+        state = {"checkpoint": last_checkpoint, "sinks": {sink.name: sink.state() for sink in sinks}}
+        utils.write_atomic(state_file, _dumps(state))
+    return results
 
-        if json_data['time'] not in conversation.keys():
-            return markdown_content
 
-        markdown_content += "## 対話記録：\n\n"
-        for chats in conversation[json_data['time']]:
-            for agents, chat in chats.items():
-                markdown_content += f"### {agents}\n\n"
-                for item in chat:
-                    markdown_content += f"`{item[0]}`\n> {item[1]}\n\n"
-        return markdown_content
+# 从所有存档文件中提取数据（用于回放）
+def generate_movement(checkpoints_folder, compressed_folder, compressed_file):
+    movement_file = os.path.join(compressed_folder, compressed_file)
+    return compress(checkpoints_folder, [MovementSink(movement_file)])[0]
 
-    all_markdown_content = extract_description()
-    files = sorted(os.listdir(checkpoints_folder))
-    for file_name in files:
-        if (not file_name.endswith(".json")) or (file_name == conversation_file):
-            continue
 
-        file_path = os.path.join(checkpoints_folder, file_name)
-        with open(file_path, "r", encoding="utf-8") as f:
-            json_data = json.load(f)
-            content = extract_action(json_data)
-            all_markdown_content += content + "\n\n"
-    with open(f"{compressed_folder}/{compressed_file}", "w", encoding="utf-8") as compressed_file:
-        compressed_file.write(all_markdown_content)
+# 生成Markdown文档
+def generate_report(checkpoints_folder, compressed_folder, compressed_file):
+    report_file = os.path.join(compressed_folder, compressed_file)
+    return compress(checkpoints_folder, [ReportSink(report_file)])[0]
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--name", type=str, default="", help="the name of the simulation")
-args = parser.parse_args()
+parser.add_argument("--chunk-steps", type=int, default=chunk_steps, help="Steps in each chunk of the replay data")
+parser.add_argument("--full", action="store_true", help="Compress all the checkpoints again instead of only the new ones")
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
+
     name = args.name
     if len(name) < 1:
         name = input("Please enter a simulation name: ")
@@ -286,6 +516,19 @@ if __name__ == "__main__":
     checkpoints_folder = f"results/checkpoints/{name}"
     compressed_folder = f"results/compressed/{name}"
     os.makedirs(compressed_folder, exist_ok=True)
-
-    generate_report(checkpoints_folder, compressed_folder, file_markdown)
-    generate_movement(checkpoints_folder, compressed_folder, file_movement)
+    state_file = os.path.join(compressed_folder, file_compress_state)
+    if args.full and os.path.exists(state_file):
+        os.remove(state_file)
+
+    compress(
+        checkpoints_folder,
+        [
+            ReportSink(os.path.join(compressed_folder, file_markdown)),
+            MovementSink(
+                os.path.join(compressed_folder, file_movement),
+                os.path.join(compressed_folder, folder_chunks),
+                args.chunk_steps,
+            ),
+        ],
+        state_file,
+    )
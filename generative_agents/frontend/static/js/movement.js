@@ -0,0 +1,157 @@
+// Decode the compact replay data (movement.json format 2, see modules/movement.py)
+// into frames: {"description", "conversation", "0": {name: {location, movement, action}}, "1": ...}
+// The data in the previous format (all frames) is returned as is.
+function decodeMovement(data) {
+	if (data["format"] !== 2) return data;
+
+	let all_movement = {"description": data["description"], "conversation": data["conversation"]};
+	decodeSegments(all_movement, data, 0, data["frames"], data["frames_per_step"], {});
+	return all_movement;
+}
+
+// Decode the segments of data (the whole movement.json or one chunk of it) into
+// the frames first..end of all_movement. last is the state of each agent before
+// the first frame, the state after the last frame is returned.
+function decodeSegments(all_movement, data, first, end, frames_per_step, last) {
+	const deltas = {"U": [0, -1], "D": [0, 1], "L": [-1, 0], "R": [1, 0]};
+	for (let frame = first; frame <= end; frame++) {
+		all_movement[frame] = {};
+	}
+
+	for (const [agent, start, loc, act, x0, y0, moves] of data["segments"]) {
+		const name = data["agents"][agent];
+		const location = data["strings"][loc];
+		let x = x0, y = y0;
+		for (let i = 0; i <= moves.length; i++) {
+			if (i > 0) {
+				x += deltas[moves[i - 1]][0];
+				y += deltas[moves[i - 1]][1];
+			}
+			if (start + i > end) break;
+			let entry = {"location": location, "movement": [x, y]};
+			if (start == 0) {
+				entry["description"] = data["strings"][act];
+			} else {
+				// Walking frames go to the location, the last frame shows the action
+				entry["action"] = i < moves.length ? location + "へ向かう" : data["strings"][act];
+			}
+			all_movement[start + i][name] = entry;
+		}
+	}
+
+	// Unchanged states are not recorded, fill the first frame of each step with the last state
+	last = Object.assign({}, last);
+	for (let frame = Math.max(first, 1); frame <= end; frame++) {
+		if ((frame - 1) % frames_per_step == 0) {
+			for (const name in last) {
+				if (!(name in all_movement[frame])) all_movement[frame][name] = last[name];
+			}
+		}
+		for (const name in all_movement[frame]) last[name] = all_movement[frame][name];
+	}
+	return last;
+}
+
+// Load the chunks of the replay data (movement/chunk-*.json) from replay.py on demand.
+// Frames are decoded into all_movement when their chunk arrives, the next chunk is
+// prefetched ahead of the playhead and the chunks behind it are dropped. Each chunk
+// starts from its keyframe (the state of all the agents), so any chunk decodes alone.
+class MovementLoader {
+	constructor(name, meta, all_movement) {
+		this.url = "movement/" + encodeURIComponent(name) + "/";
+		this.meta = meta;
+		this.all_movement = all_movement;
+		this.chunk_frames = meta["chunk_frames"];
+		this.requests = {};  // chunk index -> Promise of the decoded chunk
+	}
+
+	chunkOf(frame) {
+		return Math.floor((Math.max(frame, 1) - 1) / this.chunk_frames);
+	}
+
+	// Promise resolved when the frame can be played
+	ensure(frame) {
+		return this.load(this.chunkOf(frame));
+	}
+
+	load(index) {
+		if (index < 0 || index >= this.meta["chunks"].length) return Promise.resolve();
+		if (!(index in this.requests)) {
+			this.requests[index] = fetch(this.url + index)
+				.then(response => response.json())
+				.then(chunk => {
+					let first = index * this.chunk_frames + 1;
+					let end = Math.min(first + this.chunk_frames - 1, this.meta["frames"]);
+					decodeSegments(this.all_movement, chunk, first, end, this.meta["frames_per_step"], chunk["keyframe"]);
+					Object.assign(this.all_movement["conversation"], chunk["conversation"]);
+				})
+				.catch(error => {
+					// Retry on the next request
+					delete this.requests[index];
+					console.error("Failed to load the chunk " + index, error);
+				});
+		}
+		return this.requests[index];
+	}
+
+	// Called for each played frame
+	advance(frame) {
+		let index = this.chunkOf(frame);
+		let offset = (frame - 1) % this.chunk_frames;
+		if (offset >= this.chunk_frames / 2) this.load(index + 1);
+		for (const loaded in this.requests) {
+			if (loaded < index - 1 || loaded > index + 1) this.evict(parseInt(loaded));
+		}
+	}
+
+	evict(index) {
+		let first = index * this.chunk_frames + 1;
+		for (let frame = first; frame < first + this.chunk_frames; frame++) {
+			delete this.all_movement[frame];
+		}
+		delete this.requests[index];
+	}
+}
+
+// Frames of a running simulation streamed by replay.py /live (server-sent events,
+// see modules/live.py). Each event is one step in the shape of a chunk, decoded
+// from its keyframe, so steps skipped by the server for a slow viewer are jumped over.
+class LiveMovement {
+	constructor(url, all_movement, frames_per_step, onframes) {
+		this.live = true;
+		this.all_movement = all_movement;
+		this.frames_per_step = frames_per_step;
+		this.frames = 0;
+		this.source = new EventSource(url);
+		this.source.onmessage = message => {
+			const event = JSON.parse(message.data);
+			decodeSegments(this.all_movement, event, event["start"], event["end"], frames_per_step, event["keyframe"]);
+			Object.assign(this.all_movement["description"], event["description"]);
+			Object.assign(this.all_movement["conversation"], event["conversation"]);
+			this.frames = Math.max(this.frames, event["end"]);
+			onframes(this.frames);
+		};
+	}
+
+	ensure(frame) {
+		return Promise.resolve();
+	}
+
+	// The frame to play instead of a missing one (the first frame received after it)
+	next(frame) {
+		if (frame in this.all_movement || frame > this.frames) return frame;
+		for (let f = frame + 1; f <= this.frames; f++) {
+			if (f in this.all_movement) return f;
+		}
+		return frame;
+	}
+
+	// Drop the steps played a while ago
+	advance(frame) {
+		if ((frame - 1) % this.frames_per_step != 0) return;
+		const keep = frame - 10 * this.frames_per_step;
+		for (const key in this.all_movement) {
+			if (!isNaN(parseInt(key)) && parseInt(key) < keep) delete this.all_movement[key];
+		}
+	}
+}
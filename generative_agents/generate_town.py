@@ -0,0 +1,33 @@
+import argparse
+
+from modules.town import TownGenerator, save_town
+
+
+parser = argparse.ArgumentParser(description="generate a synthetic town for scaling tests")
+parser.add_argument("--name", type=str, default="", help="The assets name, saved to frontend/static/assets/<name>")
+parser.add_argument("--agents", type=int, default=100, help="Number of the agents")
+parser.add_argument("--residents", type=int, default=4, help="Number of the agents living in one house")
+parser.add_argument("--public", type=int, default=0, help="Number of the public sectors (default: max(8, agents/10))")
+parser.add_argument("--known", type=int, default=8, help="Number of the public sectors known by each agent")
+parser.add_argument("--width", type=int, default=0, help="Width of the maze in tiles (default: fit the sectors)")
+parser.add_argument("--height", type=int, default=0, help="Height of the maze in tiles (default: fit the sectors)")
+parser.add_argument("--seed", type=int, default=0, help="The random seed")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    name = args.name or f"town-{args.agents}"
+
+    generator = TownGenerator(
+        args.agents,
+        residents=args.residents,
+        public_num=args.public,
+        known_sectors=args.known,
+        width=args.width,
+        height=args.height,
+        seed=args.seed,
+    )
+    maze, agents = generator.generate()
+    assets_root = save_town(maze, agents, "frontend/static", name)
+    print(f"✅ {generator.width}x{generator.height} の町（{len(agents)}人）を frontend/static/{assets_root} に生成しました")
+    print(f"   python start.py --name <simulation-name> --assets {name} --agents {len(agents)}")
@@ -89,17 +89,16 @@ class Agent:
         if not self._llm:
             self._llm = create_llm_model(self.think_config["llm"], self.logger)
 
-    def completion(self, func_hint, *args, **kwargs):
+    def _build_prompt(self, func_hint, *args, **kwargs):
         assert hasattr(
             self.scratch, "prompt_" + func_hint
         ), "Can not find func prompt_{} from scratch".format(func_hint)
         func = getattr(self.scratch, "prompt_" + func_hint)
-        prompt = func(*args, **kwargs)
+        return func(*args, **kwargs)
+
+    def _log_completion(self, func_hint, prompt, output, responses=None):
         title, msg = "{}.{}".format(self.name, func_hint), {}
-        if self.llm_available():
-            self.logger.info("{} -> {}".format(self.name, func_hint))
-            output = self._llm.completion(**prompt, caller=func_hint)
-            responses = self._llm.meta_responses
+        if responses is not None:
             msg = {"<PROMPT>": "\n" + prompt["prompt"] + "\n"}
             msg.update(
                 {
@@ -107,12 +106,41 @@ class Agent:
                     for idx, r in enumerate(responses)
                 }
             )
-        else:
-            output = prompt.get("failsafe")
         msg["<OUTPUT>"] = "\n" + str(output) + "\n"
         self.logger.debug(utils.block_msg(title, msg))
+
+    @utils.profile_span("llm")
+    def completion(self, func_hint, *args, **kwargs):
+        prompt = self._build_prompt(func_hint, *args, **kwargs)
+        if self.llm_available():
+            self.logger.info("{} -> {}".format(self.name, func_hint))
+            output = self._llm.completion(**prompt, caller=func_hint)
+            self._log_completion(func_hint, prompt, output, self._llm.meta_responses)
+        else:
+            output = prompt.get("failsafe")
+            self._log_completion(func_hint, prompt, output)
         return output
 
+    @utils.profile_span("llm")
+    def completion_batch(self, requests):
+        """Run [(func_hint, args)] requests concurrently, outputs keep the order"""
+
+        prompts = [self._build_prompt(hint, *args) for hint, args in requests]
+        if not self.llm_available():
+            outputs = [p.get("failsafe") for p in prompts]
+            for (hint, _), p, output in zip(requests, prompts, outputs):
+                self._log_completion(hint, p, output)
+            return outputs
+        self.logger.info(
+            "{} -> {}".format(self.name, ", ".join(hint for hint, _ in requests))
+        )
+        results = self._llm.completion_batch(
+            [dict(p, caller=hint) for (hint, _), p in zip(requests, prompts)]
+        )
+        for (hint, _), p, (output, responses) in zip(requests, prompts, results):
+            self._log_completion(hint, p, output, responses)
+        return [output for output, _ in results]
+
     def think(self, status, agents):
         events = self.move(status["coord"], status.get("path"))
         plan, _ = self.make_schedule()
@@ -157,6 +185,7 @@ class Agent:
         }
         return self.plan
 
+    @utils.profile_span("move")
     def move(self, coord, path=None):
         events = {}
 
@@ -187,6 +216,7 @@ class Agent:
 
         return events
 
+    @utils.profile_span("make_schedule")
     def make_schedule(self):
         if not self.schedule.scheduled():
             self.logger.info("{} is making schedule...".format(self.name))
@@ -277,6 +307,7 @@ class Agent:
                 "schedule_revise", self.action, self.schedule
             )
 
+    @utils.profile_span("percept")
     def percept(self):
         scope = self.maze.get_scope(self.coord, self.percept_config)
         # add spatial memory
@@ -294,28 +325,38 @@ class Agent:
                     events[event] = dist
         events = list(sorted(events.keys(), key=lambda k: events[k]))
         # get concepts
-        self.concepts, valid_num = [], 0
+        recent_nodes = (
+            self.associate.retrieve_events() + self.associate.retrieve_chats()
+        )
+        recent_nodes = set(n.describe for n in recent_nodes)
+        self.concepts, new_events = [], []
         for idx, event in enumerate(events[: self.percept_config["att_bandwidth"]]):
-            recent_nodes = (
-                self.associate.retrieve_events() + self.associate.retrieve_chats()
-            )
-            recent_nodes = set(n.describe for n in recent_nodes)
-            if event.get_describe() not in recent_nodes:
-                if event.object == "idle" or event.object == "空いている":
-                    node = Concept.from_event(
-                        "idle_" + str(idx), "event", event, poignancy=1
-                    )
-                else:
-                    valid_num += 1
-                    node_type = "chat" if event.fit(self.name, "会話") else "event"
-                    node = self._add_concept(node_type, event)
-                    self.status["poignancy"] += node.poignancy
-                self.concepts.append(node)
+            if event.get_describe() in recent_nodes:
+                continue
+            recent_nodes.add(event.get_describe())
+            if event.object == "idle" or event.object == "空いている":
+                node = Concept.from_event(
+                    "idle_" + str(idx), "event", event, poignancy=1
+                )
+            else:
+                node_type = "chat" if event.fit(self.name, "会話") else "event"
+                node = (node_type, event)
+                new_events.append(node)
+            self.concepts.append(node)
+        # 新しいイベントの重要度はまとめて評価する
+        poignancies = self._evaluate_poignancy(new_events)
+        for idx, node in enumerate(self.concepts):
+            if isinstance(node, tuple):
+                node = self._add_concept(*node, poignancy=poignancies[node])
+                self.status["poignancy"] += node.poignancy
+                self.concepts[idx] = node
+        valid_num = len(new_events)
         self.concepts = [c for c in self.concepts if c.event.subject != self.name]
         self.logger.info(
             "{} percept {}/{} concepts".format(self.name, valid_num, len(self.concepts))
         )
 
+    @utils.profile_span("make_plan")
     def make_plan(self, agents):
         if self._reaction(agents):
             return
@@ -341,6 +382,7 @@ class Agent:
         )
         return event
 
+    @utils.profile_span("reflect")
     def reflect(self):
         def _add_thought(thought, evidence=None):
             # event = self.completion(
@@ -392,6 +434,7 @@ class Agent:
         self.status["poignancy"] = 0
         self.chats = []
 
+    @utils.profile_span("find_path")
     def find_path(self, agents):
         address = self.get_event().address
         if self.path:
@@ -638,6 +681,22 @@ class Agent:
         )
         self.revise_schedule(event, start, duration)
 
+    def _evaluate_poignancy(self, typed_events):
+        """Evaluate poignancy of [(e_type, event)], returns {(e_type, event): poignancy}"""
+
+        poignancies, requests = {}, []
+        for e_type, event in typed_events:
+            if event.fit(None, "is", "idle") or event.fit(None, "現在", "空いている"):
+                poignancies[(e_type, event)] = 1
+            elif e_type == "chat":
+                requests.append(((e_type, event), ("poignancy_chat", (event,))))
+            else:
+                requests.append(((e_type, event), ("poignancy_event", (event,))))
+        if requests:
+            outputs = self.completion_batch([r for _, r in requests])
+            poignancies.update({k: o for (k, _), o in zip(requests, outputs)})
+        return poignancies
+
     def _add_concept(
         self,
         e_type,
@@ -645,15 +704,17 @@ class Agent:
         create=None,
         expire=None,
         filling=None,
+        poignancy=None,
     ):
-        if event.fit(None, "is", "idle"):
-            poignancy = 1
-        elif event.fit(None, "現在", "空いている"):
-            poignancy = 1
-        elif e_type == "chat":
-            poignancy = self.completion("poignancy_chat", event)
-        else:
-            poignancy = self.completion("poignancy_event", event)
+        if poignancy is None:
+            if event.fit(None, "is", "idle"):
+                poignancy = 1
+            elif event.fit(None, "現在", "空いている"):
+                poignancy = 1
+            elif e_type == "chat":
+                poignancy = self.completion("poignancy_chat", event)
+            else:
+                poignancy = self.completion("poignancy_event", event)
         self.logger.debug("{} add associate {}".format(self.name, event))
         return self.associate.add_node(
             e_type,
@@ -679,6 +740,33 @@ class Agent:
             return False
         return True
 
+    def is_dormant(self):
+        """Asleep in an unfinished action with today's schedule made, think changes nothing"""
+
+        if self.is_awake() or self.action.finished():
+            return False
+        return self.schedule.scheduled()
+
+    def wake_time(self):
+        """The time to think again: the action ends or the day changes"""
+
+        return min(self.action.end, utils.get_timer().daily_time(24 * 60))
+
+    def next_event_time(self):
+        """The earliest time think may change the agent: action end, plan boundary or day change"""
+
+        timer = utils.get_timer()
+        if self.is_dormant():
+            return self.wake_time()
+        if self.action.finished() or self.get_event().address[0] in ("<persona>", "<waiting>"):
+            # 行動の決定や会話の最中は次のステップで考える
+            return timer.get_date()
+        times = [self.action.end, timer.daily_time(24 * 60)]
+        if self.schedule.daily_schedule:
+            _, de_plan = self.schedule.current_plan()
+            times.append(timer.daily_time(de_plan["start"] + de_plan["duration"]))
+        return min(times)
+
     def llm_available(self):
         if not self._llm:
             return False
@@ -0,0 +1,132 @@
+"""generative_agents.checkpoint"""
+
+import os
+import json
+
+from modules.storage.snapshot import load_manifest, file_checksum, load_pointer, set_pointer, verify_pointer
+from modules.storage.sqlite import open_store
+from modules.storage.archive import ArchiveReader
+from modules.conversation import open_conversation, log_file
+
+conversation_file = "conversation.json"  # 旧形式（現在はconversation.jsonlに追記する）
+
+
+def list_checkpoints(checkpoints_folder, after=None, completed=False):
+    """Paths of the checkpoints (simulate-*.json) in the order of the simulation
+
+    after: only the checkpoints after this file name.
+    completed: stop at the checkpoint of the manifest when there is one, the later
+        checkpoints are still being written (the conversation is saved after them).
+    """
+
+    file_names = [
+        file_name
+        for file_name in sorted(os.listdir(checkpoints_folder))
+        if file_name.endswith(".json") and file_name != conversation_file
+    ]
+    if completed:
+        manifest = load_manifest(os.path.join(checkpoints_folder, "storage"))
+        if manifest and manifest["checkpoint"] in file_names:
+            file_names = [f for f in file_names if f <= manifest["checkpoint"]]
+    if after:
+        file_names = [f for f in file_names if f > after]
+    return [os.path.join(checkpoints_folder, file_name) for file_name in file_names]
+
+
+def load_checkpoint(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_checkpoints(checkpoints_folder, after=None):
+    """Yield (file name, checkpoint) one by one, so that only one of them is held in memory
+
+    The checkpoints are read from the store of the simulation (simulation.db) when
+    it has one, otherwise from the completed JSON checkpoints and their archives.
+    """
+
+    store = open_store(checkpoints_folder)
+    if store:
+        yield from store.checkpoints(after)
+        return
+    paths = {os.path.basename(p): p for p in list_checkpoints(checkpoints_folder, after=after, completed=True)}
+    # --keep-everyで圧縮されたチェックポイントは、アーカイブから完全なチェックポイントに差分を当てて読む
+    archive = ArchiveReader(checkpoints_folder)
+    archived = [n for n in archive.names() if n > (after or "") and n not in paths]
+    for name in sorted(list(paths) + archived):
+        if name in paths:
+            yield name, load_checkpoint(paths[name])
+        else:
+            yield name, archive.load(name)
+
+
+def verify_step(checkpoints_folder, record):
+    """The problems of the step recorded in the manifest, empty if its checkpoint, snapshots and conversations are all intact"""
+
+    problems = []
+    path = os.path.join(checkpoints_folder, record["checkpoint"])
+    if not os.path.isfile(path):
+        problems.append("{} is missing".format(path))
+    elif record.get("checksum") and file_checksum(path) != record["checksum"]:
+        problems.append("{} doesn't match its checksum".format(path))
+    storage_root = os.path.join(checkpoints_folder, "storage")
+    for folder, pointer in record.get("snapshots", {}).items():
+        problems.extend(verify_pointer(os.path.join(storage_root, folder), pointer))
+    conversation_path = os.path.join(checkpoints_folder, log_file)
+    size = record.get("conversation")
+    if size and (not os.path.isfile(conversation_path) or os.path.getsize(conversation_path) < size):
+        problems.append("{} is shorter than {} bytes".format(conversation_path, size))
+    return problems
+
+
+def restore_step(checkpoints_folder, record):
+    """Bring the snapshots and the conversation log back to the step recorded in the manifest"""
+
+    storage_root = os.path.join(checkpoints_folder, "storage")
+    for folder, pointer in record.get("snapshots", {}).items():
+        path = os.path.join(storage_root, folder)
+        if load_pointer(path)["generation"] != pointer["generation"]:
+            set_pointer(path, pointer)
+    # 中断したステップで書きかけた対話を切り捨てる
+    conversation_path = os.path.join(checkpoints_folder, log_file)
+    size = record.get("conversation")
+    if size is not None and os.path.isfile(conversation_path) and os.path.getsize(conversation_path) > size:
+        os.truncate(conversation_path, size)
+
+
+def load_latest_checkpoint(checkpoints_folder, restore=False):
+    """The last consistent checkpoint of the simulation, None if there is none
+
+    The steps of the manifest are verified with their checksums, the latest intact one
+    is loaded. restore: also bring the memory and the conversations back to that step (resume).
+    """
+
+    store = open_store(checkpoints_folder)
+    if store:
+        return store.load_step()
+    manifest = load_manifest(os.path.join(checkpoints_folder, "storage"))
+    records = [manifest, manifest.get("previous")] if manifest else []
+    for record in filter(None, records):
+        problems = verify_step(checkpoints_folder, record)
+        if problems:
+            print("⚠️  Step {} ({}) is not intact: {}".format(record["step"], record["checkpoint"], "; ".join(problems)))
+            continue
+        if restore:
+            restore_step(checkpoints_folder, record)
+        return load_checkpoint(os.path.join(checkpoints_folder, record["checkpoint"]))
+    # マニフェストがない（旧形式）か整合するステップがない場合は、読み込める最新のチェックポイント
+    for path in reversed(list_checkpoints(checkpoints_folder)):
+        try:
+            return load_checkpoint(path)
+        except ValueError:
+            print("⚠️  {} is broken, skipped".format(path))
+    return None
+
+
+def load_conversation(checkpoints_folder):
+    """The conversations (simulation.db, conversation.jsonl, or conversation.json of older runs), read as a dict by time"""
+
+    store = open_store(checkpoints_folder)
+    if store:
+        return store.conversation
+    return open_conversation(checkpoints_folder)
@@ -0,0 +1,29 @@
+"""generative_agents.constants
+
+Lightweight constants shared by the entry points (start/compress/replay),
+this module must not import anything heavy.
+"""
+
+personas = [
+    "あいか", "けんじ", "まりあ", "たくみ",  # 学生
+    "みどり", "ひろし", "えいじ",  # 家庭：教授、薬店主人、学生
+    "さくら", "ともき",  # 家庭：家庭主婦、市場主人
+    "かれん", "たまき",  # ルームメイト：供給店主人、児童書作家
+    "あつし", "いずみ",  # 酒場の店主、カフェの店主
+    "やまだ", "じゅんこ",  # 家庭：退役軍人、水彩画家
+    "ふくだ", "はるか", "りょうた", "れいな",  # 共同生活：コメディアン、作家、画家、写真家
+    "あきこ", "かずや", "じょうじ", "りゅうじ", "ゆりこ", "あきら",  # アニメーター、詩人、数学者、ソフトウェアエンジニア、税務弁護士、哲学者
+]
+
+file_markdown = "simulation.md"
+file_movement = "movement.json"
+
+frames_per_step = 60  # 每个step包含的帧数
+
+# 再生データのチャンク（replay.pyが必要な区間だけ配信する）
+folder_chunks = "movement"
+file_chunk_index = "index.json"
+chunk_steps = 30  # 1チャンクあたりのステップ数
+
+# compress.pyの処理済みの位置（次回は新しいチェックポイントだけを処理する）
+file_compress_state = "compress_state.json"
@@ -0,0 +1,187 @@
+"""generative_agents.conversation
+
+Append-only log of the conversations (conversation.jsonl), one chat per line:
+
+    {"time": "20240213-09:20", "step": 2, "persons": ["あいか", "けんじ"],
+     "location": "the Ville，...", "chats": [["あいか", "..."], ...]}
+
+SimulateServer appends the chats of each step instead of rewriting the whole
+conversation.json. The lines are indexed by time, step and person when the log
+is opened, and read back by offset. The log also reads like the dict of
+conversation.json ({time: [{"A -> B @ location": chats}]}), so compress.py
+uses either of them.
+"""
+
+import os
+import json
+import bisect
+
+from modules import utils
+
+log_file = "conversation.jsonl"
+legacy_file = "conversation.json"
+
+
+def chat_key(record):
+    return "{} -> {} @ {}".format(record["persons"][0], record["persons"][1], record["location"])
+
+
+class ConversationLog:
+    def __init__(self, path):
+        self.path = path
+        self._load_index()
+
+    def _load_index(self):
+        self._times = []  # sorted times, each with the offsets of its chats
+        self._by_time = {}
+        self._by_step = {}
+        self._by_person = {}
+        self._end = 0
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 中断で書きかけになった最後の行は読まない（resumeで切り捨てる）
+                    break
+                if line.strip():
+                    self._index(json.loads(line), offset)
+                offset += len(line)
+        self._end = offset
+
+    def _index(self, record, offset):
+        time = record["time"]
+        if time not in self._by_time:
+            bisect.insort(self._times, time)
+            self._by_time[time] = []
+        self._by_time[time].append(offset)
+        self._by_step.setdefault(record.get("step"), []).append(offset)
+        for person in record["persons"]:
+            self._by_person.setdefault(person, []).append(offset)
+
+    def _read(self, offsets):
+        records = []
+        # 新しいシミュレーションでは最初の対話までログがない
+        if not offsets or not os.path.isfile(self.path):
+            return records
+        with open(self.path, "rb") as f:
+            for offset in sorted(offsets):
+                f.seek(offset)
+                records.append(json.loads(f.readline()))
+        return records
+
+    def append(self, time, step, chats):
+        """Append the chats of a step, chats: [{"A -> B @ location": [[name, text], ...]}, ...]"""
+
+        records = []
+        for chat in chats:
+            for key, texts in chat.items():
+                persons, location = key.split(" @ ", 1)
+                records.append(
+                    {"time": time, "step": step, "persons": persons.split(" -> "), "location": location, "chats": texts}
+                )
+        if not records:
+            return 0
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            for record in records:
+                data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(data)
+                self._index(record, offset)
+                offset += len(data)
+        self._end = offset
+        return len(records)
+
+    def size(self):
+        """The size of the complete lines of the log in bytes (recorded in the manifest)"""
+
+        return self._end
+
+    def truncate(self, time):
+        """Drop the chats from the time on (e.g. the steps lost when resuming from a checkpoint)"""
+
+        torn = os.path.isfile(self.path) and os.path.getsize(self.path) > self._end
+        if not torn and (not self._times or self._times[-1] < time):
+            return
+        kept = [r for r in self.records() if r["time"] < time]
+        utils.write_atomic(self.path, "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in kept))
+        self._load_index()
+
+    def records(self, start=None, end=None):
+        """The chats between start and end (inclusive, %Y%m%d-%H:%M)"""
+
+        low = bisect.bisect_left(self._times, start) if start else 0
+        high = bisect.bisect_right(self._times, end) if end else len(self._times)
+        return self._read([o for t in self._times[low:high] for o in self._by_time[t]])
+
+    def at(self, time):
+        return self._read(self._by_time.get(time, []))
+
+    def at_step(self, step):
+        return self._read(self._by_step.get(step, []))
+
+    def of(self, person, start=None, end=None):
+        """The chats of the person between start and end"""
+
+        records = self._read(self._by_person.get(person, []))
+        return [r for r in records if (not start or r["time"] >= start) and (not end or r["time"] <= end)]
+
+    def between(self, person, other, start=None, end=None):
+        """The chats between the two persons, in either direction"""
+
+        offsets = set(self._by_person.get(person, [])) & set(self._by_person.get(other, []))
+        records = self._read(offsets)
+        return [r for r in records if (not start or r["time"] >= start) and (not end or r["time"] <= end)]
+
+    def to_dict(self):
+        """All the chats in the format of conversation.json"""
+
+        conversation = {}
+        for record in self.records():
+            conversation.setdefault(record["time"], []).append({chat_key(record): record["chats"]})
+        return conversation
+
+    # 以下はconversation.jsonのdictとして読むためのもの
+    def __contains__(self, time):
+        return time in self._by_time
+
+    def __getitem__(self, time):
+        if time not in self._by_time:
+            raise KeyError(time)
+        return self.get(time)
+
+    def get(self, time, default=None):
+        if time not in self._by_time:
+            return default
+        return [{chat_key(r): r["chats"]} for r in self.at(time)]
+
+    def keys(self):
+        return list(self._times)
+
+    def __len__(self):
+        return len(self._times)
+
+
+def migrate_conversation(checkpoints_folder):
+    """Move the chats of conversation.json (older runs) to the log, returns the log"""
+
+    conversation = ConversationLog(os.path.join(checkpoints_folder, log_file))
+    legacy_path = os.path.join(checkpoints_folder, legacy_file)
+    if not len(conversation) and os.path.isfile(legacy_path):
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        for time in sorted(legacy):
+            conversation.append(time, None, legacy[time])
+    return conversation
+
+
+def open_conversation(checkpoints_folder):
+    """The conversations of a simulation: the log, or the dict of conversation.json for older runs"""
+
+    path = os.path.join(checkpoints_folder, log_file)
+    legacy_path = os.path.join(checkpoints_folder, legacy_file)
+    if not os.path.isfile(path) and os.path.isfile(legacy_path):
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return ConversationLog(path)
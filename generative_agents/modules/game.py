@@ -5,7 +5,7 @@ import copy
 
 from modules.utils import GenerativeAgentsMap, GenerativeAgentsKey
 from modules import utils
-from .maze import Maze
+from .maze import Maze, load_maze_config
 from .agent import Agent
 
 
@@ -17,7 +17,10 @@ class Game:
         self.static_root = static_root
         self.record_iterval = config.get("record_iterval", 30)
         self.logger = logger or utils.IOLogger()
-        self.maze = Maze(self.load_static(config["maze"]["path"]), self.logger)
+        self.maze = Maze(
+            load_maze_config(os.path.join(self.static_root, config["maze"]["path"])),
+            self.logger,
+        )
         self.conversation = conversation
         self.agents = {}
         if "agent_base" in config:
@@ -42,6 +45,12 @@ class Game:
     def agent_think(self, name, status):
         agent = self.get_agent(name)
         plan = agent.think(status, self.agents)
+        with utils.get_profiler().span("summary"):
+            info = self._summary(agent)
+        return {"plan": plan, "info": info}
+
+    def _summary(self, agent):
+        name = agent.name
         info = {
             "currently": agent.scratch.currently,
             "associate": agent.associate.abstract(),
@@ -67,7 +76,7 @@ class Game:
             name, utils.get_timer().get_date("%Y%m%d-%H:%M:%S")
         )
         self.logger.info("\n{}\n{}\n".format(utils.split_line(title), agent))
-        return {"plan": plan, "info": info}
+        return info
 
     def load_static(self, path):
         return utils.load_dict(os.path.join(self.static_root, path))
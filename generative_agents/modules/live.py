@@ -0,0 +1,144 @@
+"""generative_agents.live
+
+Publish the simulation step by step to the live viewer (replay.py /live).
+Each step is one event, in the same shape as a chunk of the replay data
+(see modules/movement.py), with a keyframe holding the state of all the
+agents before the step, so a viewer can start from any event.
+
+Every subscriber has a bounded queue and the simulation never waits for the
+viewers: when a queue is full the oldest step is dropped and its
+conversations are carried by the next one (the keyframes keep the positions
+right), so a slow viewer skips steps instead of slowing down the run.
+"""
+
+import threading
+import collections
+
+from modules.movement import StringTable, encode_path, get_location, get_action, get_step_conversation, clip_path
+
+
+class Subscription:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.coalesced = 0
+        self._events = collections.deque()
+        self._condition = threading.Condition()
+
+    def put(self, event):
+        with self._condition:
+            if len(self._events) >= self.maxsize:
+                dropped = self._events.popleft()
+                following = self._events[0] if self._events else event
+                following["conversation"] = dict(dropped["conversation"], **following["conversation"])
+                self.coalesced += 1
+            self._events.append(event)
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """The next event, or None if there is none within timeout"""
+
+        with self._condition:
+            if not self._events:
+                self._condition.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+
+class LiveBus:
+    """In-process pub/sub of the simulation steps"""
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.meta = {}
+        self.latest = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self.maxsize)
+        with self._lock:
+            self._subscribers.add(subscription)
+            # 途中から見始めても最新のステップから再生できるようにする
+            if self.latest is not None:
+                subscription.put(dict(self.latest))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event):
+        with self._lock:
+            self.latest = event
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(dict(event))
+
+    def subscribers(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+class LivePublisher:
+    """Turn the steps of SimulateServer into events of the LiveBus"""
+
+    def __init__(self, bus, frames_per_step, start_datetime, stride, agents):
+        self.bus = bus
+        self.frames_per_step = frames_per_step
+        # 各Agentの直前の状態（次のイベントのキーフレーム）
+        self.state = {name: {"location": "", "movement": list(coord), "action": ""} for name, coord in agents.items()}
+        bus.meta = {
+            "start_datetime": start_datetime,
+            "stride": stride,
+            "sec_per_step": stride,
+            "frames_per_step": frames_per_step,
+            "persona_init_pos": {name: list(coord) for name, coord in agents.items()},
+        }
+
+    def publish(self, step, time, agents, paths, conversation):
+        """Publish a step.
+
+        Parameters
+        ----------
+        step: int
+            The step number of the checkpoint.
+        time: str
+            The time of the step (%Y%m%d-%H:%M).
+        agents: dict
+            The agents of the checkpoint (with "action" and "currently").
+        paths: dict
+            The path walked by each agent in the step, from its previous coordinate.
+        conversation: dict
+            The conversations of the simulation.
+        """
+
+        first = (step - 1) * self.frames_per_step + 1
+        step_conversation, persons_in_conversation = get_step_conversation(conversation, time)
+        names, strings, segments = [], StringTable(), []
+        keyframe = {name: dict(state) for name, state in self.state.items() if state["action"]}
+        for name, agent_data in agents.items():
+            location = get_location(agent_data["action"]["event"]["address"])
+            had_conversation = any(name in persons for persons in persons_in_conversation)
+            action = get_action(agent_data["action"]["event"], had_conversation)
+            path = paths.get(name) or [self.state[name]["movement"]]
+            path, action = clip_path(path, location, action, self.frames_per_step)
+            try:
+                moves = encode_path(path)
+            except ValueError:
+                moves = encode_path(path[-1:])
+            names.append(name)
+            segments.append([len(names) - 1, first, strings.intern(location), strings.intern(action)] + list(moves))
+            self.state[name] = {"location": location, "movement": list(path[-1]), "action": action}
+        event = {
+            "step": step,
+            "time": time,
+            "start": first,
+            "end": first + self.frames_per_step - 1,
+            "keyframe": keyframe,
+            "agents": names,
+            "strings": strings.strings,
+            "segments": segments,
+            "description": {name: {"currently": a.get("currently", "")} for name, a in agents.items()},
+            "conversation": {time: step_conversation} if step_conversation else {},
+        }
+        self.bus.publish(event)
+        return event
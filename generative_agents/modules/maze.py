@@ -1,11 +1,15 @@
 """generative_agents.maze"""
 
+import os
 import random
 from itertools import product
 
 from modules import utils
 from modules.memory.event import Event
 
+# 解析済みのmaze.json（プロセス内の全シミュレーションで共有、変更しないこと）
+_maze_configs = {}
+
 
 class Tile:
     def __init__(
@@ -120,8 +124,9 @@ class Maze:
             for y in range(self.maze_height)
         ]
         for tile in config["tiles"]:
-            x, y = tile.pop("coord")
-            self.tiles[y][x] = Tile((x, y), config["world"], address_keys, **tile)
+            x, y = tile["coord"]
+            kwargs = {k: v for k, v in tile.items() if k != "coord"}
+            self.tiles[y][x] = Tile((x, y), config["world"], address_keys, **kwargs)
 
         # define address
         self.address_tiles = dict()
@@ -132,6 +137,7 @@ class Maze:
 
         self.logger = logger
 
+    @utils.profile_span("bfs")
     def find_path(self, src_coord, dst_coord):
         map = [[0 for _ in range(self.maze_width)] for _ in range(self.maze_height)]
         frontier, visited = [src_coord], set()
@@ -206,3 +212,12 @@ class Maze:
         if addr in self.address_tiles:
             return self.address_tiles[addr]
         return random.choice(self.address_tiles.values())
+
+
+def load_maze_config(path):
+    """Load the maze config once per process, the config is shared by all the mazes"""
+
+    path = os.path.abspath(path)
+    if path not in _maze_configs:
+        _maze_configs[path] = utils.load_dict(path)
+    return _maze_configs[path]
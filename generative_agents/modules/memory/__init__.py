@@ -1,7 +1,15 @@
 """generative_agents.memory"""
 
 from .action import *
-from .associate import *
 from .event import *
 from .schedule import *
 from .spatial import *
+
+
+def __getattr__(name):
+    # associateはllama_indexに依存するため、使うときに読み込む（compress/replayの起動を軽くする）
+    if name in ("Concept", "AssociateRetriever", "Associate"):
+        from . import associate
+
+        return getattr(associate, name)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
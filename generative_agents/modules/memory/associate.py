@@ -199,6 +199,7 @@ class Associate:
     def find_concept(self, node_id):
         return self.to_concept(self._index.find_node(node_id))
 
+    @utils.profile_span("retrieve")
     def _retrieve_nodes(self, node_type, text=None):
         if text:
             filters = MetadataFilters(
@@ -221,6 +222,7 @@ class Associate:
         text = ("会話 " + name) if name else None
         return self._retrieve_nodes("chat", text)
 
+    @utils.profile_span("retrieve")
     def retrieve_focus(self, focus, retrieve_max=30, reduce_all=True):
         def _create_retriever(*args, **kwargs):
             self._retrieve_config["retrieve_max"] = retrieve_max
@@ -253,6 +255,7 @@ class Associate:
             "thoughts": self.retrieve_thoughts(node.describe),
         }
 
+    @utils.profile_span("save_index")
     def to_dict(self):
         self._index.save()
         return {"memory": self.memory}
@@ -1,3 +1,5 @@
 """generative_agents.model"""
 
 from .llm_model import *
+from .scheduler import *
+from .metrics import *
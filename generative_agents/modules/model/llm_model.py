@@ -2,17 +2,34 @@
 
 import time
 import re
+import json
+import random
+import itertools
+import threading
 import requests
 
+from modules.utils import GenerativeAgentsMap, GenerativeAgentsKey
+from .scheduler import get_llm_scheduler
+from .metrics import get_llm_metrics
+
+# 実行中のリクエストの統計（バックエンドが記録し、LLMModelが集計する）
+_request_stats = threading.local()
+
 
 class LLMModel:
     def __init__(self, config, logger=None):
-        self._api_key = config["api_key"]
-        self._base_url = config["base_url"]
-        self._model = config["model"]
+        self._api_key = config.get("api_key", "")
+        self._base_url = config.get("base_url", "")
+        self._model = config.get("model", config["provider"])
         self._meta_responses = []
         self._summary = {"total": [0, 0, 0]}
         self.logger = logger
+        # 短い回答で足りる呼び出し元ごとの生成トークン上限、およびストリーミングの有効化
+        self._max_tokens = config.get("max_tokens", {})
+        self._stream = config.get("stream", True)
+        self._scheduler = get_llm_scheduler(config)
+        self._metrics = get_llm_metrics()
+        self._lock = threading.Lock()
 
         self._handle = self.setup(config)
         self._enabled = True
@@ -22,23 +39,69 @@ class LLMModel:
             "setup is not support for " + str(self.__class__)
         )
 
-    def completion(
+    def completion(self, prompt, caller="llm_normal", **kwargs):
+        response, self._meta_responses = self._run_completion(
+            prompt, caller=caller, **kwargs
+        )
+        return response
+
+    def completion_batch(self, prompts):
+        """Complete the prompts concurrently through the shared scheduler.
+
+        Parameters
+        ----------
+        prompts: list<dict>
+            The kwargs of completion for each request, "caller" included.
+
+        Returns
+        -------
+        results: list<tuple>
+            The (output, meta_responses) for each request, in the same order.
+        """
+
+        futures = []
+        for prompt in prompts:
+            caller = prompt.get("caller", "llm_normal")
+
+            def _run(prompt=prompt):
+                return self._run_completion(**prompt)
+
+            key = (self._model, prompt["prompt"])
+            futures.append(self._scheduler.submit(caller, key, _run))
+        return [f.result() for f in futures]
+
+    def _run_completion(
         self,
         prompt,
         retry=10,
         callback=None,
         failsafe=None,
         caller="llm_normal",
+        stream=None,
         **kwargs
     ):
-        response, self._meta_responses = None, []
-        self._summary.setdefault(caller, [0, 0, 0])
+        response, meta_responses = None, []
+        with self._lock:
+            self._summary.setdefault(caller, [0, 0, 0])
+        if caller in self._max_tokens:
+            kwargs["max_tokens"] = self._max_tokens[caller]
+        # streamは確定した1行から回答だけを読み取る厳密なパーサー（推論の行ではNoneを返す）
+        stream = stream if callable(stream) and self._stream and callback is not None else None
+        attempts, sleep = 0, 0
         for _ in range(retry):
+            attempts += 1
             try:
-                meta_response = self._completion(prompt, **kwargs).strip()
-                self._meta_responses.append(meta_response)
-                self._summary["total"][0] += 1
-                self._summary[caller][0] += 1
+                _request_stats.__dict__.clear()
+                begin = time.time()
+                meta_response, response = self._request(
+                    prompt, callback, caller, stream, **kwargs
+                )
+                self._observe_request(caller, prompt, meta_response, begin)
+                meta_responses.append(meta_response)
+                self._count(caller, 0)
+                if response is not None:
+                    # ストリーミング中に回答を確定済み
+                    break
                 if callback:
                     response = callback(meta_response)
                 else:
@@ -51,9 +114,9 @@ class LLMModel:
                     error_detail += f"❌ LLM出力パーシングエラー発生！\n"
                     error_detail += f"   呼び出し元: {caller}\n"
                     error_detail += f"   エラー: {error_msg}\n"
-                    if self._meta_responses:
+                    if meta_responses:
                         error_detail += f"   LLM出力（先頭200文字）:\n"
-                        error_detail += f"   {self._meta_responses[-1][:200]}...\n"
+                        error_detail += f"   {meta_responses[-1][:200]}...\n"
                     error_detail += f"{'='*60}\n"
                     
                     if self.logger:
@@ -68,20 +131,100 @@ class LLMModel:
                         print(f"LLMModel.completion() caused an error: {e}")
                 
                 time.sleep(5)
+                sleep += 5
                 response = None
                 continue
             if response is not None:
                 break
-        pos = 2 if response is None else 1
-        self._summary["total"][pos] += 1
-        self._summary[caller][pos] += 1
-        return response or failsafe
+        self._count(caller, 2 if response is None else 1)
+        self._metrics.observe_completion(caller, response is not None, attempts - 1, sleep)
+        return response or failsafe, meta_responses
+
+    def _observe_request(self, caller, prompt, meta_response, begin):
+        end = time.time()
+        stats = _request_stats.__dict__
+        self._metrics.observe_request(
+            caller,
+            end - begin,
+            stats.get("first_token", end) - begin,
+            stats.get("prompt_tokens") or estimate_tokens(prompt),
+            stats.get("completion_tokens") or estimate_tokens(meta_response),
+        )
+
+    def _request(self, prompt, callback, caller, stream=None, **kwargs):
+        """Send one request, returns (meta_response, response parsed while streaming)"""
+
+        if stream:
+            return self._stream_completion(prompt, stream, **kwargs)
+        return self._completion(prompt, **kwargs).strip(), None
+
+    def _count(self, caller, pos):
+        with self._lock:
+            self._summary["total"][pos] += 1
+            self._summary[caller][pos] += 1
 
     def _completion(self, prompt, **kwargs):
         raise NotImplementedError(
             "_completion is not support for " + str(self.__class__)
         )
 
+    def _stream_chunks(self, prompt, **kwargs):
+        """Yield text deltas of the completion, fallback to the full completion"""
+
+        yield self._completion(prompt, **kwargs)
+
+    def _stream_completion(self, prompt, parse, **kwargs):
+        """Parse the lines while they arrive and stop once one of them holds the answer.
+
+        parse is strict: it returns None for the lines of reasoning, and the
+        full text is left to the callback when no line holds the answer. The
+        last line is also parsed before its newline arrives (partial=True), so
+        that a one-line answer stops the stream too.
+
+        Returns
+        -------
+        meta_response: str
+            The (maybe truncated) text received from the model.
+        response:
+            The output of parse, None if no line holds the answer.
+        """
+
+        def _parse(line, partial=False):
+            if not line.strip():
+                return None
+            try:
+                return parse(line.strip(), partial=partial)
+            except Exception:  # pylint: disable=broad-except
+                return None
+
+        chunks, text, received = self._stream_chunks(prompt, **kwargs), "", 0
+        try:
+            for chunk in chunks:
+                if chunk and not received:
+                    _request_stats.first_token = time.time()
+                # ストリーミングでは1チャンクがおおよそ1トークンに相当する
+                received += 1 if chunk else 0
+                _request_stats.completion_tokens = received
+                text += chunk or ""
+                if "\n" in (chunk or ""):
+                    # 確定した行で判定し、途中の数字や名前を誤って採用しないようにする
+                    finished = strip_think(text[: text.rfind("\n")])
+                    for line in finished.split("\n"):
+                        response = _parse(line)
+                        if response is not None:
+                            return finished.strip(), response
+                if text.rfind("<think>") > text.rfind("</think>"):
+                    # 推論の途中
+                    continue
+                # 改行のない最後の行（1行だけの回答）
+                tail = text[text.rfind("\n") + 1 :].split("</think>")[-1]
+                response = _parse(tail, partial=True)
+                if response is not None:
+                    return strip_think(text).strip(), response
+        finally:
+            chunks.close()
+        return strip_think(text).strip(), None
+
     def is_available(self):
         return self._enabled  # and self._summary["total"][2] <= 10
 
@@ -105,21 +248,42 @@ class OpenAILLMModel(LLMModel):
 
         return OpenAI(api_key=self._api_key, base_url=self._base_url)
 
-    def _completion(self, prompt, temperature=0.5):
+    def _completion(self, prompt, temperature=0.5, max_tokens=None):
         messages = [{"role": "user", "content": prompt}]
+        kwargs = {"max_tokens": max_tokens} if max_tokens else {}
         response = self._handle.chat.completions.create(
-            model=self._model, messages=messages, temperature=temperature
+            model=self._model, messages=messages, temperature=temperature, **kwargs
         )
+        if response.usage:
+            _request_stats.prompt_tokens = response.usage.prompt_tokens
+            _request_stats.completion_tokens = response.usage.completion_tokens
         if len(response.choices) > 0:
             return response.choices[0].message.content
         return ""
 
+    def _stream_chunks(self, prompt, temperature=0.5, max_tokens=None):
+        messages = [{"role": "user", "content": prompt}]
+        kwargs = {"max_tokens": max_tokens} if max_tokens else {}
+        response = self._handle.chat.completions.create(
+            model=self._model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            **kwargs
+        )
+        try:
+            for chunk in response:
+                if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            response.close()
+
 
 class OllamaLLMModel(LLMModel):
     def setup(self, config):
         return None
 
-    def ollama_chat(self, messages, temperature):
+    def ollama_chat(self, messages, temperature, max_tokens=None, stream=False):
         headers = {
             "Content-Type": "application/json"
         }
@@ -127,29 +291,319 @@ class OllamaLLMModel(LLMModel):
             "model": self._model,
             "messages": messages,
             "temperature": temperature,
-            "stream": False,
+            "stream": stream,
         }
+        if max_tokens:
+            params["max_tokens"] = max_tokens
 
         response = requests.post(
             url=f"{self._base_url}/chat/completions",
             headers=headers,
             json=params,
-            stream=False
+            stream=stream
         )
+        if stream:
+            return response
         return response.json()
 
-    def _completion(self, prompt, temperature=0.5):
+    def _prepare_prompt(self, prompt):
         if "qwen3" in self._model and "\n/nothink" not in prompt:
             # 针对Qwen3模型禁用think，提高推理速度
             prompt += "\n/nothink"
-        messages = [{"role": "user", "content": prompt}]
-        response = self.ollama_chat(messages=messages, temperature=temperature)
+        return prompt
+
+    def _completion(self, prompt, temperature=0.5, max_tokens=None):
+        messages = [{"role": "user", "content": self._prepare_prompt(prompt)}]
+        response = self.ollama_chat(
+            messages=messages, temperature=temperature, max_tokens=max_tokens
+        )
+        if response and response.get("usage"):
+            _request_stats.prompt_tokens = response["usage"].get("prompt_tokens")
+            _request_stats.completion_tokens = response["usage"].get("completion_tokens")
         if response and len(response["choices"]) > 0:
             ret = response["choices"][0]["message"]["content"]
             # 从输出结果中过滤掉<think>标签内的文字，以免影响后续逻辑
-            return re.sub(r"<think>.*</think>", "", ret, flags=re.DOTALL)
+            return strip_think(ret)
         return ""
 
+    def _stream_chunks(self, prompt, temperature=0.5, max_tokens=None):
+        messages = [{"role": "user", "content": self._prepare_prompt(prompt)}]
+        response = self.ollama_chat(
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        # 途中で接続を閉じると、Ollama側の生成も打ち切られる
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("choices"):
+                    yield chunk["choices"][0].get("delta", {}).get("content") or ""
+        finally:
+            response.close()
+
+
+class StubLLMModel(LLMModel):
+    """Offline model for benchmarks, answers with canned responses in the format of each caller.
+
+    The answers are deterministic for the same (seed, caller, prompt), "latency"
+    (seconds, or a dict of caller -> seconds with "default") is slept before
+    each answer to emulate the backend, "responses" overrides the answers by caller.
+    """
+
+    ACTIVITIES = ["読書をする", "仕事をする", "散歩をする", "食事をとる", "休憩する"]
+    # この時刻に就寝し、翌日まで眠る（--skip-dormantなどで眠っているエージェントを扱えるように）
+    BEDTIME = 22
+    UTTERANCES = ["こんにちは、最近どう？", "いい天気だね。", "そうなんだ、面白いね。", "またね。"]
+
+    def setup(self, config):
+        self._seed = config.get("seed", 0)
+        self._latency = config.get("latency", 0)
+        self._responses = config.get("responses", {})
+        self._chat_rate = config.get("chat_rate", 0.2)
+        return None
+
+    def _request(self, prompt, callback, caller, stream=None, **kwargs):
+        latency = self._latency
+        if isinstance(latency, dict):
+            latency = latency.get(caller, latency.get("default", 0))
+        if latency > 0:
+            time.sleep(latency)
+        return self.answer(prompt, caller), None
+
+    def answer(self, prompt, caller):
+        if caller in self._responses:
+            return self._responses[caller]
+        rnd = random.Random("{}:{}:{}".format(self._seed, caller, prompt))
+        handler = getattr(self, "_answer_" + caller, None)
+        if handler:
+            return handler(prompt, rnd)
+        return "特に変わったことはない"
+
+    def _answer_poignancy_event(self, prompt, rnd):
+        return "評価：{}".format(rnd.randint(1, 9))
+
+    _answer_poignancy_chat = _answer_poignancy_event
+
+    def _answer_wake_up(self, prompt, rnd):
+        return "{}:00".format(rnd.randint(6, 8))
+
+    def _answer_schedule_init(self, prompt, rnd):
+        activities = ["起床し朝の日課を行う"] + rnd.sample(self.ACTIVITIES, 4)
+        return "\n".join("{}. {}".format(i + 1, a) for i, a in enumerate(activities))
+
+    def _answer_schedule_daily(self, prompt, rnd):
+        hours = re.findall(r"\[(\d{1,2}):00\] <活動>", prompt)
+        lines = [
+            "[{}:00] {}".format(h, rnd.choice(self.ACTIVITIES)) for h in hours if int(h) < self.BEDTIME
+        ]
+        if any(int(h) >= self.BEDTIME for h in hours):
+            # 就寝の計画は日付が変わるまで続く
+            lines.append("[{}:00] 就寝する".format(self.BEDTIME))
+        return "\n".join(lines)
+
+    def _answer_schedule_decompose(self, prompt, rnd):
+        increment, start, end = re.findall(
+            r"(\d+)分刻みで、(\d{1,2}:\d{2})から(\d{1,2}:\d{2})まで", prompt
+        )[-1]
+        agent = re.findall(r"までの(.+?)の全てのサブタスク", prompt)[-1]
+        duration = _minutes(end) - _minutes(start)
+        if duration <= 0:
+            duration += 24 * 60
+        num = max(1, min(5, duration // int(increment)))
+        size = min(duration // num, 60)
+        lines, left = [], duration
+        for i in range(num):
+            left -= size
+            lines.append(
+                "{}) {}:{} 予定（所要時間：{}、残り：{}）".format(
+                    i + 1, agent, rnd.choice(self.ACTIVITIES), size, left
+                )
+            )
+        return "\n".join(lines)
+
+    def _answer_schedule_revise(self, prompt, rnd):
+        block = prompt.split("修正後のタイムスケジュール：")[-1]
+        plans = re.findall(r"\[(\d{1,2}:\d{2}) 至 (\d{1,2}:\d{2})\] (.*)", block)
+        end = re.findall(r"(\d{1,2}:\d{2})までに終了させる", prompt)[-1]
+        lines = ["[{}-{}] {}".format(*p) for p in plans]
+        last = plans[-1][1] if plans else end
+        if _minutes(last) < _minutes(end):
+            lines.append("[{}-{}] {}".format(last, end, rnd.choice(self.ACTIVITIES)))
+        return "\n".join(lines)
+
+    def _answer_determine_sector(self, prompt, rnd):
+        options = re.findall(r"[:：]\s*\[(.*?)\]", prompt)[-1].split(", ")
+        return rnd.choice(options)
+
+    _answer_determine_arena = _answer_determine_sector
+    _answer_determine_object = _answer_determine_sector
+
+    def _answer_describe_emoji(self, prompt, rnd):
+        return rnd.choice(["😊", "📖", "🚶", "🍚", "💤"])
+
+    def _answer_describe_event(self, prompt, rnd):
+        action = re.findall(r"入力：(.*)", prompt)[-1].strip("。")
+        match = re.match(r"(.+?)[はが](.+)", action)
+        subject, predicate = match.groups() if match else (action, action)
+        return "(<{}>, <する>, <{}>)".format(subject, predicate)
+
+    def _answer_describe_object(self, prompt, rnd):
+        obj = re.findall(r"<([^<>]+)>の状態を説明する", prompt)[-1]
+        return "<{}>: {}".format(obj, rnd.choice(["使用中", "空いている"]))
+
+    def _answer_decide_chat(self, prompt, rnd):
+        return "はい" if rnd.random() < self._chat_rate else "いいえ"
+
+    def _answer_decide_chat_terminate(self, prompt, rnd):
+        return "はい" if rnd.random() < 0.3 else "いいえ"
+
+    def _answer_decide_wait(self, prompt, rnd):
+        return "回答：" + rnd.choice(["A", "B"])
+
+    def _answer_generate_chat(self, prompt, rnd):
+        agent = re.findall(r'"([^"]+)": <', prompt)[-1]
+        return json.dumps({agent: rnd.choice(self.UTTERANCES)}, ensure_ascii=False)
+
+    def _answer_generate_chat_check_repeat(self, prompt, rnd):
+        return "いいえ"
+
+    def _answer_reflect_focus(self, prompt, rnd):
+        return "\n".join(
+            "{}. {}".format(i + 1, q)
+            for i, q in enumerate(["今日は何をしたか？", "誰と話したか？", "明日は何をすべきか？"])
+        )
+
+    def _answer_reflect_insights(self, prompt, rnd):
+        return "いつも通りの一日を過ごしている;0,1\n周りの人と良い関係を築いている;1,2"
+
+    def _answer_retrieve_plan(self, prompt, rnd):
+        return "\n".join(
+            "{}. {}".format(i + 1, a) for i, a in enumerate(rnd.sample(self.ACTIVITIES, 3))
+        )
+
+    def _answer_retrieve_currently(self, prompt, rnd):
+        return "状態: いつも通りに過ごしている"
+
+    def _answer_summarize_chats(self, prompt, rnd):
+        return "日常についての会話"
+
+
+class LLMBackend:
+    """A model endpoint shared by all routers, tracks the load and the health"""
+
+    _sequence = itertools.count(1)
+
+    def __init__(self, model):
+        self.model = model
+        self.inflight = 0
+        self.down_until = 0
+        # 最後に選ばれた順番（負荷が同じときは最も長く使われていないものを選ぶ）
+        self.last_used = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.inflight += 1
+            self.last_used = next(LLMBackend._sequence)
+        return self.model
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._lock:
+            self.inflight -= 1
+
+    def mark_down(self, seconds):
+        self.down_until = time.time() + seconds
+
+    @property
+    def available(self):
+        return time.time() >= self.down_until
+
+    @property
+    def name(self):
+        return "{}@{}".format(self.model._model, self.model._base_url)
+
+
+def get_llm_backend(backend_config, logger=None):
+    """Get the backend shared by all routers with the same endpoint"""
+
+    models = GenerativeAgentsMap.setdefault(GenerativeAgentsKey.MODELS, {})
+    key = "backend:{}:{}:{}".format(
+        backend_config["provider"], backend_config["base_url"], backend_config["model"]
+    )
+    if key not in models:
+        models[key] = LLMBackend(create_llm_model(backend_config, logger))
+    return models[key]
+
+
+class RouterLLMModel(LLMModel):
+    """Route the requests to model tiers by caller.
+
+    Requests are balanced to the least loaded backend of the tier (the least
+    recently used one on a tie, so sequential requests go round-robin), a failed
+    backend is skipped for retry_after seconds and the request fails over to
+    the other backends (and finally to the default tier).
+    """
+
+    def setup(self, config):
+        self._tiers = {
+            tier: [get_llm_backend(b, self.logger) for b in backends]
+            for tier, backends in config["tiers"].items()
+        }
+        self._routes = config.get("routes", {})
+        self._default_tier = config.get("default_tier", list(self._tiers.keys())[0])
+        # 経路表の誤記はリクエストのたびに再試行されるので、ここで弾く
+        unknown = {
+            "{} -> {}".format(caller, tier)
+            for caller, tier in dict(self._routes, default_tier=self._default_tier).items()
+            if tier not in self._tiers
+        }
+        if unknown:
+            raise ValueError(
+                "Unknown tiers in the routes: {}, the tiers are {}".format(
+                    ", ".join(sorted(unknown)), list(self._tiers.keys())
+                )
+            )
+        empty = [tier for tier, backends in self._tiers.items() if not backends]
+        if empty:
+            raise ValueError("Tiers without backends: {}".format(empty))
+        self._retry_after = config.get("retry_after", 30)
+        return None
+
+    def _candidates(self, caller):
+        tier = self._routes.get(caller, self._default_tier)
+        tiers = [tier] if tier == self._default_tier else [tier, self._default_tier]
+        backends = [b for t in tiers for b in self._tiers[t]]
+        # 利用可能なものを負荷の低い順に、停止中のものは最後の手段として試す
+        available = sorted(
+            [b for b in backends if b.available], key=lambda b: (b.inflight, b.last_used)
+        )
+        return available + [b for b in backends if not b.available]
+
+    def _request(self, prompt, callback, caller, stream=None, **kwargs):
+        errors = []
+        for backend in self._candidates(caller):
+            with backend as model:
+                try:
+                    return model._request(prompt, callback, caller, stream, **kwargs)
+                except Exception as e:  # pylint: disable=broad-except
+                    backend.mark_down(self._retry_after)
+                    errors.append("{}: {}".format(backend.name, e))
+        raise Exception("All backends failed for {}: {}".format(caller, "; ".join(errors)))
+
+    def get_summary(self):
+        summary = super().get_summary()
+        summary["model"] = {
+            tier: [b.name for b in backends] for tier, backends in self._tiers.items()
+        }
+        return summary
+
 
 def create_llm_model(llm_config, logger=None):
     """Create llm model with optional logger"""
@@ -159,6 +613,10 @@ def create_llm_model(llm_config, logger=None):
 
     elif llm_config["provider"] == "openai":
         return OpenAILLMModel(llm_config, logger)
+    elif llm_config["provider"] == "router":
+        return RouterLLMModel(llm_config, logger)
+    elif llm_config["provider"] == "stub":
+        return StubLLMModel(llm_config, logger)
     else:
         raise NotImplementedError(
             "llm provider {} is not supported".format(llm_config["provider"])
@@ -166,6 +624,27 @@ def create_llm_model(llm_config, logger=None):
     return None
 
 
+def _minutes(stamp):
+    hour, minute = stamp.split(":")
+    return int(hour) * 60 + int(minute)
+
+
+def estimate_tokens(text):
+    """Rough token count for backends without usage: 4 ascii chars or 1 other char per token"""
+
+    ascii_num = sum(1 for c in text if ord(c) < 128)
+    return ascii_num // 4 + (len(text) - ascii_num) + 1
+
+
+def strip_think(text):
+    """Remove the <think> block, drop everything if the block is not closed yet"""
+
+    text = re.sub(r"<think>.*</think>", "", text, flags=re.DOTALL)
+    if "<think>" in text:
+        return text[: text.find("<think>")]
+    return text
+
+
 def parse_llm_output(response, patterns, mode="match_last", ignore_empty=False):
     if isinstance(patterns, str):
         patterns = [patterns]
@@ -0,0 +1,219 @@
+"""generative_agents.model.metrics"""
+
+import io
+import csv
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from modules.utils import GenerativeAgentsMap, GenerativeAgentsKey, write_atomic
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count, self.sum, self.max = 0, 0, 0
+
+    def observe(self, value):
+        idx = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                idx = i
+                break
+        self.counts[idx] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate the quantile by the upper bound of the bucket"""
+
+        if not self.count:
+            return 0
+        rank, total = q * self.count, 0
+        for bound, cnt in zip(self.buckets, self.counts):
+            total += cnt
+            if total >= rank:
+                return round(min(bound, self.max), 4)
+        return round(self.max, 4)
+
+    def load(self, data):
+        """Restore the histogram from to_dict"""
+
+        self.counts = [data["buckets"].get(str(b), 0) for b in self.buckets + ["+Inf"]]
+        self.count, self.sum, self.max = data["count"], data["sum"], data["max"]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "mean": round(self.sum / self.count, 4) if self.count else 0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 4),
+            "buckets": {
+                str(b): c for b, c in zip(self.buckets + ["+Inf"], self.counts)
+            },
+        }
+
+
+class LLMMetrics:
+    """Per-caller latency and token histograms of the llm requests"""
+
+    SECONDS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    TOKENS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+    COUNTS = (0, 1, 2, 3, 5, 10)
+    METRICS = {
+        "latency_seconds": SECONDS,
+        "time_to_first_token_seconds": SECONDS,
+        "prompt_tokens": TOKENS,
+        "completion_tokens": TOKENS,
+        "retries": COUNTS,
+        "sleep_seconds": SECONDS,
+    }
+
+    def __init__(self):
+        self._callers = {}
+        self._lock = threading.Lock()
+
+    def _caller(self, caller):
+        if caller not in self._callers:
+            self._callers[caller] = {
+                "requests": {"success": 0, "failure": 0},
+                "histograms": {k: Histogram(b) for k, b in self.METRICS.items()},
+            }
+        return self._callers[caller]
+
+    def observe_request(self, caller, latency, ttft, prompt_tokens, completion_tokens):
+        """Record one request sent to the model"""
+
+        with self._lock:
+            histograms = self._caller(caller)["histograms"]
+            histograms["latency_seconds"].observe(latency)
+            histograms["time_to_first_token_seconds"].observe(ttft)
+            histograms["prompt_tokens"].observe(prompt_tokens)
+            histograms["completion_tokens"].observe(completion_tokens)
+
+    def observe_completion(self, caller, success, retries, sleep):
+        """Record one completion, which may contain several requests"""
+
+        with self._lock:
+            info = self._caller(caller)
+            info["requests"]["success" if success else "failure"] += 1
+            info["histograms"]["retries"].observe(retries)
+            info["histograms"]["sleep_seconds"].observe(sleep)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                caller: {
+                    "requests": dict(info["requests"]),
+                    "histograms": {
+                        k: h.to_dict() for k, h in info["histograms"].items()
+                    },
+                }
+                for caller, info in self._callers.items()
+            }
+
+    def load(self, path):
+        """Continue the metrics saved in path.json (e.g. on resume)"""
+
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            metrics = json.load(f)
+        with self._lock:
+            for caller, info in metrics.items():
+                record = self._caller(caller)
+                record["requests"].update(info["requests"])
+                for name, data in info["histograms"].items():
+                    if name in record["histograms"]:
+                        record["histograms"][name].load(data)
+
+    def to_csv(self):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(
+            ["caller", "metric", "count", "sum", "mean", "p50", "p90", "p99", "max"]
+        )
+        for caller, info in self.to_dict().items():
+            for name, h in info["histograms"].items():
+                writer.writerow(
+                    [caller, name]
+                    + [h[k] for k in ["count", "sum", "mean", "p50", "p90", "p99", "max"]]
+                )
+        return output.getvalue()
+
+    def to_prometheus(self):
+        lines = [
+            "# TYPE llm_requests_total counter",
+        ]
+        metrics = self.to_dict()
+        for caller, info in metrics.items():
+            for status, cnt in info["requests"].items():
+                lines.append(
+                    'llm_requests_total{{caller="{}",status="{}"}} {}'.format(
+                        caller, status, cnt
+                    )
+                )
+        for name in self.METRICS:
+            lines.append("# TYPE llm_{} histogram".format(name))
+            for caller, info in metrics.items():
+                h, total = info["histograms"][name], 0
+                for bound, cnt in h["buckets"].items():
+                    total += cnt
+                    lines.append(
+                        'llm_{}_bucket{{caller="{}",le="{}"}} {}'.format(
+                            name, caller, bound, total
+                        )
+                    )
+                lines.append('llm_{}_sum{{caller="{}"}} {}'.format(name, caller, h["sum"]))
+                lines.append(
+                    'llm_{}_count{{caller="{}"}} {}'.format(name, caller, h["count"])
+                )
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        """Save the metrics as path.json and path.csv, replacing the previous ones
+
+        The metrics are cumulative, so the latest files hold the whole simulation.
+        """
+
+        write_atomic(path + ".json", json.dumps(self.to_dict(), indent=2, ensure_ascii=False))
+        write_atomic(path + ".csv", self.to_csv().encode("utf-8"), mode="wb")
+
+
+def get_llm_metrics():
+    """Get the metrics shared by all models of the simulation"""
+
+    if not GenerativeAgentsMap.contains(GenerativeAgentsKey.METRICS):
+        GenerativeAgentsMap.set(GenerativeAgentsKey.METRICS, LLMMetrics())
+    return GenerativeAgentsMap.get(GenerativeAgentsKey.METRICS)
+
+
+def serve_metrics(metrics, port, host="127.0.0.1"):
+    """Serve the metrics in prometheus text format on http://host:port/metrics
+
+    Only the local machine can connect by default, pass host="0.0.0.0" to let a
+    remote prometheus scrape them.
+    """
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
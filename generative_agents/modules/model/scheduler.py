@@ -0,0 +1,88 @@
+"""generative_agents.model.scheduler"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from modules.utils import GenerativeAgentsMap, GenerativeAgentsKey, bind_context
+
+
+class LLMScheduler:
+    """Collect same-caller requests within a short window and dispatch them together.
+
+    The requests are sent as parallel requests (up to num_parallel), identical
+    requests in one window are coalesced and share the result.
+
+    Only concurrent submitters fill a batch: the requests of one agent sent with
+    completion_batch (e.g. the poignancy of all the events it perceived), or the
+    simulations of sweep.py sharing the endpoint. The agents of one simulation
+    think one after another, so their requests are not coalesced with each
+    other. With num_parallel=1 every request is dispatched at once, without
+    waiting for the window.
+    """
+
+    def __init__(self, num_parallel=1, window=0.05):
+        self.num_parallel = max(num_parallel, 1)
+        self.window = window
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.num_parallel, thread_name_prefix="llm"
+        )
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def submit(self, caller, key, func):
+        """Submit func to the batch of caller, returns a Future of its result"""
+
+        with self._lock:
+            pending = self._pending.get(caller)
+            if pending is None:
+                pending = self._pending[caller] = {"requests": {}, "timer": None}
+            batch = pending["requests"]
+            if key not in batch:
+                # ワーカースレッドでも呼び出し元のシミュレーション（timer等）を参照する
+                batch[key] = (bind_context(func), Future())
+            future = batch[key][1]
+            if len(batch) >= self.num_parallel:
+                # 並列数に達したら窓を待たずに送信し、この窓のタイマーは止める
+                self._pop(caller)
+            elif pending["timer"] is None:
+                pending["timer"] = threading.Timer(self.window, self._flush, args=(caller, pending))
+                pending["timer"].daemon = True
+                pending["timer"].start()
+        return future
+
+    def _flush(self, caller, pending):
+        with self._lock:
+            # 既に送信済みの窓のタイマーが、次の窓を早く送らないようにする
+            if self._pending.get(caller) is pending:
+                self._pop(caller)
+
+    def _pop(self, caller):
+        pending = self._pending.pop(caller)
+        if pending["timer"] is not None:
+            pending["timer"].cancel()
+        self._dispatch(pending["requests"])
+
+    def _dispatch(self, batch):
+        for func, future in batch.values():
+            self._executor.submit(self._run, func, future)
+
+    def _run(self, func, future):
+        try:
+            future.set_result(func())
+        except Exception as e:  # pylint: disable=broad-except
+            future.set_exception(e)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def get_llm_scheduler(llm_config):
+    """Get the scheduler shared by all models with the same endpoint"""
+
+    models = GenerativeAgentsMap.setdefault(GenerativeAgentsKey.MODELS, {})
+    key = "scheduler:{}:{}".format(llm_config.get("base_url"), llm_config.get("model"))
+    if key not in models:
+        models[key] = LLMScheduler(
+            llm_config.get("num_parallel", 1), llm_config.get("batch_window", 0.05)
+        )
+    return models[key]
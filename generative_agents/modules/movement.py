@@ -0,0 +1,138 @@
+"""generative_agents.movement
+
+Compact replay data (movement.json, format 2). Instead of one entry per agent
+for each frame, the movement of an agent in a step is one segment:
+
+    [agent, start_frame, location, action, x, y, moves]
+
+where agent indexes "agents", location/action index the "strings" table, and
+moves ("U"/"D"/"L"/"R" per frame) walk the path from (x, y). Segments that
+don't change the state of the agent are not recorded. The frontend decodes
+the segments back into frames (frontend/static/js/movement.js).
+
+compress.py also splits the segments into chunks of a fixed number of steps
+(movement/chunk-*.json, each with its own agents and strings) listed in
+movement/index.json, so that replay.py serves only the part being played.
+Each chunk starts with a keyframe holding the state of all the agents, so
+any frame is restored from the keyframe and the segments of one chunk.
+"""
+
+MOVEMENT_FORMAT = 2
+
+_moves = {(0, -1): "U", (0, 1): "D", (-1, 0): "L", (1, 0): "R"}
+_deltas = {m: d for d, m in _moves.items()}
+
+
+def encode_path(path):
+    """[[x, y], ...] -> (x, y, moves), the path should go tile by tile (Maze.find_path)"""
+
+    moves = []
+    for (x0, y0), (x1, y1) in zip(path, path[1:]):
+        move = _moves.get((x1 - x0, y1 - y0))
+        if move is None:
+            raise ValueError("path should move one tile per frame: {} -> {}".format((x0, y0), (x1, y1)))
+        moves.append(move)
+    return path[0][0], path[0][1], "".join(moves)
+
+
+def decode_path(x, y, moves):
+    path = [[x, y]]
+    for move in moves:
+        dx, dy = _deltas[move]
+        x, y = x + dx, y + dy
+        path.append([x, y])
+    return path
+
+
+class StringTable:
+    """Intern the location and action strings, each one is stored once"""
+
+    def __init__(self, strings=None):
+        self.strings = list(strings or [])
+        self._index = {string: i for i, string in enumerate(self.strings)}
+
+    def intern(self, string):
+        if string not in self._index:
+            self._index[string] = len(self.strings)
+            self.strings.append(string)
+        return self._index[string]
+
+
+# 将address转换为字符串
+def get_location(address):
+    # 仅为兼容原版
+    # if address[0] == "<waiting>" or address[0] == "<persona>":
+    #     return None
+
+    # 不需要显示address第一级（"the Ville"）
+    location = "、".join(address[1:])
+
+    return location
+
+
+def get_action(event, had_conversation=False):
+    """The action shown after the agent arrived, from the event of its action"""
+
+    action = event["describe"]
+    if len(action) < 1:
+        action = f'{event["predicate"]}{event["object"]}'
+
+    # 针对睡觉和对话设置图标（判断当前Agent是否有新的对话）
+    if "寝る" in action or "睡眠" in action:
+        action = "😴 " + action
+    elif had_conversation:
+        action = "💬 " + action
+    return action
+
+
+def clip_path(path, location, action, frames_per_step):
+    """1ステップで進めるのはframes_per_stepタイルまで（到着していなければ次のステップで続きを進む）"""
+
+    if len(path) > frames_per_step:
+        return path[:frames_per_step], f"{location}へ向かう"
+    return path, action
+
+
+# 将单个存档中的对话整理为回放用的文本，以及参与对话的Agent
+def get_step_conversation(conversation, step_time):
+    step_conversation = ""
+    persons_in_conversation = []
+    for chats in conversation.get(step_time, []):
+        for persons, chat in chats.items():
+            persons_in_conversation.append(persons.split(" @ ")[0].split(" -> "))
+            step_conversation += f"\n場所：{persons.split(' @ ')[1]}\n\n"
+            for c in chat:
+                agent = c[0]
+                text = c[1]
+                step_conversation += f"{agent}：{text}\n"
+    return step_conversation, persons_in_conversation
+
+
+def positions_at(movement, frame, positions=None):
+    """Coordinate of each agent at the frame, from the compact replay data or a chunk of it
+
+    positions: the coordinates before the first segment, persona_init_pos by default.
+    """
+
+    positions = dict(positions if positions is not None else movement["persona_init_pos"])
+    for agent, start, _, _, x, y, moves in movement["segments"]:
+        # 区間はフレーム順に記録されている
+        if start > frame:
+            break
+        path = decode_path(x, y, moves)
+        positions[movement["agents"][agent]] = path[min(frame - start, len(path) - 1)]
+    return positions
+
+
+def seek_chunk(chunk_index, frame):
+    """Index of the chunk holding the frame"""
+
+    return min((max(frame, 1) - 1) // chunk_index["chunk_frames"], len(chunk_index["chunks"]) - 1)
+
+
+def chunk_positions_at(chunk, frame, persona_init_pos):
+    """Coordinate of each agent at a frame of the chunk, from its keyframe and segments"""
+
+    positions = dict(persona_init_pos)
+    positions.update({name: state["movement"] for name, state in chunk["keyframe"].items()})
+    return positions_at(chunk, frame, positions)
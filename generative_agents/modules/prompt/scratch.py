@@ -1,5 +1,6 @@
 """generative_agents.prompt.scratch"""
 
+import os
 import random
 import datetime
 import re
@@ -9,6 +10,63 @@ from modules import utils
 from modules.memory import Event
 from modules.model import parse_llm_output
 
+# プロンプトテンプレートのキャッシュ（プロセス内で共有）
+_templates = {}
+
+
+def preload_templates(template_path="data/prompts"):
+    """Load all the templates into the cache, e.g. before forking the workers"""
+
+    for file_name in sorted(os.listdir(template_path)):
+        path = f"{template_path}/{file_name}"
+        if file_name.endswith(".txt") and path not in _templates:
+            with open(path, "r", encoding="utf-8") as file:
+                _templates[path] = Template(file.read())
+    return len(_templates)
+
+
+# ストリーミング用の厳密なパーサー：1行が回答そのもののときだけ値を返す。
+# 推論の行ではNoneを返し、回答の行がなければ全文を通常のcallbackで解析する。
+# partial：まだ改行が来ていない最後の行（続きで答えが変わり得る場合はNoneを返す）
+def stream_yes_no(line, partial=False):
+    match = re.fullmatch(r"(?:答え|回答|答案)?[:：]?\s*(はい|いいえ|Yes|No|yes|no)[。.!！]?", line)
+    if match is None or (partial and match.group(1) not in ("はい", "いいえ")):
+        # 英語は続きがあり得る（No -> Not）ので行が確定するまで待つ
+        return None
+    return match.group(1) in ("はい", "Yes", "yes")
+
+
+def stream_choice(line, partial=False):
+    match = re.search(r"<選択肢([AB])>", line)
+    return None if match is None else match.group(1) == "A"
+
+
+def stream_score(line, partial=False):
+    if partial:
+        # 評価：1 の後に数字が続くかもしれない
+        return None
+    match = re.search(r"評価[:： ]+(\d{1,2})", line)
+    return None if match is None else int(match.group(1))
+
+
+def stream_labeled(label, candidates):
+    """The candidate alone or after the label (e.g. 行くべき場所：...), None for other lines
+
+    The prompts end with the label, so the model usually answers with the bare
+    name. An unfinished line is taken only if no other candidate starts with it.
+    """
+
+    def _parse(line, partial=False):
+        match = re.search(label + r"[:：]\s*(.+)$", line)
+        value = (match.group(1) if match else line).strip().rstrip("。")
+        if value not in candidates:
+            return None
+        if partial and any(c != value and c.startswith(value) for c in candidates):
+            return None
+        return value
+
+    return _parse
+
 
 class Scratch:
     def __init__(self, name, currently, config):
@@ -18,11 +76,12 @@ class Scratch:
         self.template_path = "data/prompts"
 
     def build_prompt(self, template, data):
-        with open(f"{self.template_path}/{template}.txt", "r", encoding="utf-8") as file:
-            file_content = file.read()
+        path = f"{self.template_path}/{template}.txt"
+        if path not in _templates:
+            with open(path, "r", encoding="utf-8") as file:
+                _templates[path] = Template(file.read())
 
-        template = Template(file_content)
-        filled_content = template.substitute(data)
+        filled_content = _templates[path].substitute(data)
 
         return filled_content
 
@@ -62,6 +121,7 @@ class Scratch:
             "prompt": prompt,
             "callback": _callback,
             "failsafe": random.choice(list(range(10))) + 1,
+            "stream": stream_score,
         }
 
     def prompt_poignancy_chat(self, event):
@@ -85,6 +145,7 @@ class Scratch:
             "prompt": prompt,
             "callback": _callback,
             "failsafe": random.choice(list(range(10))) + 1,
+            "stream": stream_score,
         }
 
     def prompt_wake_up(self):
@@ -410,7 +471,12 @@ class Scratch:
                     return s
             return failsafe
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe}
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": failsafe,
+            "stream": stream_labeled("行くべき場所", sectors),
+        }
 
     def prompt_determine_arena(self, describes, spatial, address):
         prompt = self.build_prompt(
@@ -440,7 +506,12 @@ class Scratch:
             arena = parse_llm_output(response, patterns)
             return arena if arena in arenas else failsafe
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe}
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": failsafe,
+            "stream": stream_labeled("行くべき場所", arenas),
+        }
 
     def prompt_determine_object(self, describes, spatial, address):
         objects = spatial.get_leaves(address)
@@ -468,7 +539,12 @@ class Scratch:
             obj = parse_llm_output(response, patterns)
             return obj if obj in objects else failsafe
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe}
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": failsafe,
+            "stream": stream_labeled("オブジェクト", objects),
+        }
 
     def prompt_describe_emoji(self, describe):
         prompt = self.build_prompt(
@@ -672,7 +748,7 @@ class Scratch:
                 return False
             return True
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": False}
+        return {"prompt": prompt, "callback": _callback, "failsafe": False, "stream": stream_yes_no}
 
     def prompt_decide_chat_terminate(self, agent, other, chats):
         conversation = "\n".join(["{}: {}".format(n, u) for n, u in chats])
@@ -694,7 +770,7 @@ class Scratch:
                 return False
             return True
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": False}
+        return {"prompt": prompt, "callback": _callback, "failsafe": False, "stream": stream_yes_no}
 
     def prompt_decide_wait(self, agent, other, focus):
         example1 = self.build_prompt(
@@ -767,9 +843,13 @@ class Scratch:
         )
 
         def _callback(response):
+            # 推論の中の「A」ではなく、最後に選んだ選択肢を使う
+            choices = re.findall(r"<選択肢([AB])>", response)
+            if choices:
+                return choices[-1] == "A"
             return "A" in response
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": False}
+        return {"prompt": prompt, "callback": _callback, "failsafe": False, "stream": stream_choice}
 
     def prompt_summarize_relation(self, agent, other_name):
         nodes = agent.associate.retrieve_focus([other_name], 50)
@@ -869,7 +949,7 @@ class Scratch:
                 return False
             return True
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": False}
+        return {"prompt": prompt, "callback": _callback, "failsafe": False, "stream": stream_yes_no}
 
     def prompt_summarize_chats(self, chats):
         conversation = "\n".join(["{}: {}".format(n, u) for n, u in chats])
@@ -0,0 +1,215 @@
+"""generative_agents.storage.archive
+
+Retention of the JSON checkpoints (start.py --keep-every N). Every Nth checkpoint
+is kept as a full simulate-<time>.json, the ones between them are compacted into
+the archive of the full checkpoint before them:
+
+    archive/simulate-<time>.jsonl.gz    one line per compacted checkpoint:
+                                        {"checkpoint": file name, "delta": [[path, op, value], ...]}
+
+Each delta is the change from the full checkpoint ("set" a value, "del" a key,
+"ext" a list with new items, e.g. the memory ids of an agent), so any compacted
+checkpoint is restored from the full one and its line. The archive is compressed
+with gzip, zstd (pip install zstandard) or not at all, and rewritten atomically.
+The last checkpoints (those of the manifest) are always kept in full for resume.
+"""
+
+import os
+import json
+import gzip
+
+from modules import utils
+
+archive_folder = "archive"
+_extensions = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+
+def _compressor(codec):
+    if codec == "gzip":
+        return gzip.compress
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress
+    return lambda data: data
+
+
+def _decompress(path, data):
+    if path.endswith(".gz"):
+        return gzip.decompress(data)
+    if path.endswith(".zst"):
+        import zstandard
+
+        return zstandard.ZstdDecompressor().stream_reader(data, read_across_frames=True).read()
+    return data
+
+
+def make_delta(old, new, path=None):
+    """The changes from old to new as [[path, op, value], ...]"""
+
+    path = path or []
+    if isinstance(old, dict) and isinstance(new, dict):
+        # キーの順序が変わる場合は丸ごと置き換える（復元した辞書の順序をそろえる）
+        order = [k for k in old if k in new] + [k for k in new if k not in old]
+        if list(new) != order:
+            return [[path, "set", new]]
+        delta = [[path + [k], "del"] for k in old if k not in new]
+        for key, value in new.items():
+            if key not in old:
+                delta.append([path + [key], "set", value])
+            elif old[key] != value:
+                delta.extend(make_delta(old[key], value, path + [key]))
+        return delta
+    if isinstance(old, list) and isinstance(new, list) and len(new) > len(old) and new[: len(old)] == old:
+        return [[path, "ext", new[len(old):]]]
+    return [[path, "set", new]]
+
+
+def apply_delta(data, delta):
+    """Apply the changes of make_delta to data (modified in place), returns the result"""
+
+    for change in delta:
+        path, op = change[0], change[1]
+        if not path:
+            data = change[2]
+            continue
+        parent = data
+        for key in path[:-1]:
+            parent = parent[key]
+        if op == "del":
+            del parent[path[-1]]
+        elif op == "ext":
+            parent[path[-1]].extend(change[2])
+        else:
+            parent[path[-1]] = change[2]
+    return data
+
+
+def list_archives(checkpoints_folder):
+    """{file name of the full checkpoint: path of its archive}"""
+
+    folder = os.path.join(checkpoints_folder, archive_folder)
+    if not os.path.isdir(folder):
+        return {}
+    archives = {}
+    for file_name in sorted(os.listdir(folder)):
+        base, _, ext = file_name.partition(".jsonl")
+        if ext in _extensions.values():
+            archives[base + ".json"] = os.path.join(folder, file_name)
+    return archives
+
+
+def read_archive(path):
+    """The lines of an archive, [{"checkpoint", "delta"}, ...]"""
+
+    with open(path, "rb") as f:
+        data = _decompress(path, f.read())
+    return [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+
+
+class ArchiveReader:
+    """Read the compacted checkpoints, the full checkpoint of the current archive is kept as text"""
+
+    def __init__(self, checkpoints_folder):
+        self.checkpoints_folder = checkpoints_folder
+        self._bases = {}  # file name -> file name of its full checkpoint
+        self._archives = list_archives(checkpoints_folder)
+        self._current = None
+        self._base_text = None
+        self._deltas = {}
+
+    def names(self):
+        """The file names of the compacted checkpoints"""
+
+        for base, path in self._archives.items():
+            for entry in read_archive(path):
+                self._bases[entry["checkpoint"]] = base
+        return sorted(self._bases)
+
+    def load(self, name):
+        base = self._bases[name]
+        if base != self._current:
+            with open(os.path.join(self.checkpoints_folder, base), "r", encoding="utf-8") as f:
+                self._base_text = f.read()
+            self._deltas = {e["checkpoint"]: e["delta"] for e in read_archive(self._archives[base])}
+            self._current = base
+        return apply_delta(json.loads(self._base_text), self._deltas[name])
+
+
+class CheckpointRetention:
+    """Keep every Nth checkpoint in full and compact the others into the archives"""
+
+    def __init__(self, checkpoints_folder, keep_every, codec="gzip", keep_last=2):
+        if codec == "zstd":
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                print("zstandard is not installed, compress the archives with gzip (pip install zstandard)")
+                codec = "gzip"
+        self.checkpoints_folder = checkpoints_folder
+        self.keep_every = keep_every
+        self.codec = codec
+        self.keep_last = keep_last
+        self._compress = _compressor(codec)
+        self._kept = set()
+        # 書き込み中の（最新の完全なチェックポイントの）アーカイブ
+        self._base = None
+        self._base_data = None
+        self._entries = []
+
+    def _archive_stem(self, base):
+        return os.path.join(self.checkpoints_folder, archive_folder, base[: -len(".json")] + ".jsonl")
+
+    def _open(self, base):
+        if base == self._base:
+            return
+        self._base = base
+        self._base_data = utils.load_dict(os.path.join(self.checkpoints_folder, base))
+        path = list_archives(self.checkpoints_folder).get(base)
+        self._entries = read_archive(path) if path else []
+
+    def compact(self, file_names):
+        """Compact the checkpoints, file_names: the full checkpoints in order (list_checkpoints)
+
+        Returns the file names of the compacted checkpoints.
+        """
+
+        if self.keep_every <= 1:
+            return []
+        names = [os.path.basename(n) for n in file_names]
+        compacted = []
+        for name in names[: max(len(names) - self.keep_last, 0)]:
+            if name in self._kept:
+                continue
+            # 直前の完全なチェックポイント（それ以前のものは圧縮済みか保持されている）
+            remaining = [n for n in names if n not in compacted]
+            index = remaining.index(name)
+            if index == 0:
+                self._kept.add(name)
+                continue
+            self._open(remaining[index - 1])
+            if len(self._entries) >= self.keep_every - 1:
+                self._kept.add(name)
+                continue
+            self._archive(name)
+            compacted.append(name)
+        return compacted
+
+    def _archive(self, name):
+        path = os.path.join(self.checkpoints_folder, name)
+        if any(e["checkpoint"] == name for e in self._entries):
+            # 前回はアーカイブに書いた後、元のファイルを消す前に中断した
+            os.remove(path)
+            return
+        delta = make_delta(self._base_data, utils.load_dict(path))
+        self._entries.append({"checkpoint": name, "delta": delta})
+        os.makedirs(os.path.join(self.checkpoints_folder, archive_folder), exist_ok=True)
+        data = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in self._entries)
+        stem = self._archive_stem(self._base)
+        utils.write_atomic(stem + _extensions[self.codec], self._compress(data.encode("utf-8")), mode="wb")
+        # 別の形式で書かれていた同じアーカイブを消す
+        for codec, ext in _extensions.items():
+            if codec != self.codec and os.path.isfile(stem + ext):
+                os.remove(stem + ext)
+        # アーカイブに書けてから元のファイルを消す（中断しても失われない）
+        os.remove(path)
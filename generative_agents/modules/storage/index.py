@@ -1,46 +1,111 @@
 """generative_agents.storage.index"""
 
 import os
+import json
 import time
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+import math
+import hashlib
+from typing import List
 from llama_index.core.indices.vector_store.retrievers import VectorIndexRetriever
 from llama_index.core.schema import TextNode
 from llama_index import core as index_core
-from llama_index.embeddings.ollama import OllamaEmbedding
-from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core import Settings
+from llama_index.core.embeddings import BaseEmbedding
 
 from modules import utils
+from .snapshot import has_snapshot, load_snapshot, save_snapshot
+from .sqlite import get_store
+
+
+class HashingEmbedding(BaseEmbedding):
+    """Deterministic offline embedding, hashes the character n-grams into a fixed size vector"""
+
+    dim: int = 256
+    ngram: int = 2
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for n in range(1, self.ngram + 1):
+            for i in range(len(text) - n + 1):
+                digest = hashlib.md5(text[i : i + n].encode("utf-8")).digest()
+                idx = int.from_bytes(digest[:4], "little") % self.dim
+                vector[idx] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+
+# 埋め込みモデルのキャッシュ（同じ設定の全エージェント・シミュレーションで共有）
+_embed_models = {}
+
+
+def create_embed_model(embedding_config):
+    """Create the embedding model, or reuse the one created with the same config"""
+
+    key = json.dumps(embedding_config, sort_keys=True)
+    if key not in _embed_models:
+        _embed_models[key] = _create_embed_model(embedding_config)
+    return _embed_models[key]
+
+
+def _create_embed_model(embedding_config):
+    # 各プロバイダ（torch/transformers、openaiなど）は選択されたときだけ読み込む
+    if embedding_config["provider"] == "hugging_face":
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+        embed_model = HuggingFaceEmbedding(model_name=embedding_config["model"])
+    elif embedding_config["provider"] == "ollama":
+        from llama_index.embeddings.ollama import OllamaEmbedding
+
+        embed_model = OllamaEmbedding(
+            model_name=embedding_config["model"],
+            base_url=embedding_config["base_url"],
+            ollama_additional_kwargs={"mirostat": 0},
+        )
+    elif embedding_config["provider"] == "openai":
+        from llama_index.embeddings.openai import OpenAIEmbedding
+
+        embed_model = OpenAIEmbedding(
+            model_name=embedding_config["model"],
+            api_base=embedding_config["base_url"],
+            api_key=embedding_config["api_key"],
+        )
+    elif embedding_config["provider"] == "stub":
+        embed_model = HashingEmbedding(
+            model_name="stub", dim=embedding_config.get("dim", 256)
+        )
+    else:
+        raise NotImplementedError(
+            "embedding provider {} is not supported".format(embedding_config["provider"])
+        )
+    return embed_model
 
 
 class LlamaIndex:
     def __init__(self, embedding_config, path=None):
         self._config = {"max_nodes": 0}
-        if embedding_config["provider"] == "hugging_face":
-            embed_model = HuggingFaceEmbedding(model_name=embedding_config["model"])
-        elif embedding_config["provider"] == "ollama":
-            embed_model = OllamaEmbedding(
-                model_name=embedding_config["model"],
-                base_url=embedding_config["base_url"],
-                ollama_additional_kwargs={"mirostat": 0},
-            )
-        elif embedding_config["provider"] == "openai":
-            embed_model = OpenAIEmbedding(
-                model_name=embedding_config["model"],
-                api_base=embedding_config["base_url"],
-                api_key=embedding_config["api_key"],
-            )
-        else:
-            raise NotImplementedError(
-                "embedding provider {} is not supported".format(embedding_config["provider"])
-            )
-
+        embed_model = create_embed_model(embedding_config)
         Settings.embed_model = embed_model
         Settings.node_parser = SentenceSplitter(chunk_size=512, chunk_overlap=64)
         Settings.num_output = 1024
         Settings.context_window = 4096
-        if path and os.path.exists(path):
+        # start.py --store sqliteではシミュレーションのデータベースに保存する
+        self._store = get_store()
+        if self._store and path and self._store.has_memory(self._store.memory_key(path)):
+            self._index = self._build_index(*self._store.load_memory(self._store.memory_key(path)))
+        elif has_snapshot(path):
+            self._index = self._build_index(*load_snapshot(path))
+        elif path and os.path.exists(path):
+            # 旧形式（llama_indexのJSONストレージ）のチェックポイント
             self._index = index_core.load_index_from_storage(
                 index_core.StorageContext.from_defaults(persist_dir=path),
                 show_progress=True,
@@ -50,6 +115,23 @@ class LlamaIndex:
             self._index = index_core.VectorStoreIndex([], show_progress=True)
         self._path = path
 
+    def _build_index(self, nodes, vectors, config):
+        """Rebuild the index from the saved nodes, the saved embeddings are reused as is"""
+
+        self._config = config
+        text_nodes = [
+            TextNode(
+                text=node["text"],
+                id_=node["id"],
+                metadata=node["metadata"],
+                excluded_llm_metadata_keys=node["exclude_llm_keys"],
+                excluded_embed_metadata_keys=node["exclude_embedding_keys"],
+                embedding=vector,
+            )
+            for node, vector in zip(nodes, vectors)
+        ]
+        return index_core.VectorStoreIndex(text_nodes)
+
     def add_node(
         self,
         text,
@@ -153,8 +235,23 @@ class LlamaIndex:
 
     def save(self, path=None):
         path = path or self._path
-        self._index.storage_context.persist(path)
-        utils.save_dict(self._config, os.path.join(path, "index_config.json"))
+        nodes, vectors = [], []
+        for node_id, node in self._index.docstore.docs.items():
+            nodes.append(
+                {
+                    "id": node_id,
+                    "text": node.text,
+                    "metadata": node.metadata,
+                    "exclude_llm_keys": node.excluded_llm_metadata_keys,
+                    "exclude_embedding_keys": node.excluded_embed_metadata_keys,
+                }
+            )
+        if self._store:
+            self._store.save_memory(self._store.memory_key(path), nodes, self._index.vector_store.get, self._config)
+            return
+        for node in nodes:
+            vectors.append(self._index.vector_store.get(node["id"]))
+        save_snapshot(path, nodes, vectors, self._config)
 
     @property
     def nodes_num(self):
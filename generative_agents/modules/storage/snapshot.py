@@ -0,0 +1,217 @@
+"""generative_agents.storage.snapshot
+
+The memory of an agent is saved as generations, each one a state blob
+(snapshot-<generation>.json) and a float32 vector file (snapshot-<generation>.f32),
+and snapshot.json points at the current generation with the checksums of its files.
+The two previous generations are kept, so that while a step is being saved the
+generations of both steps recorded in the manifest are still on disk.
+
+storage/manifest.json records, for the latest step and the one before it, the
+checkpoint and the generation of every snapshot with their checksums, and the
+size of the conversation log. Resume takes the latest step whose files all match.
+"""
+
+import os
+import json
+import array
+import hashlib
+
+from modules import utils
+
+SNAPSHOT_STATE = "snapshot.json"
+SNAPSHOT_GENERATION = "snapshot-{}.json"
+SNAPSHOT_VECTORS = "snapshot-{}.f32"
+MANIFEST = "manifest.json"
+SNAPSHOT_VERSION = 2
+# 保存中の世代に加えて、マニフェストの2ステップ（最新と一つ前）の世代を残す
+KEEP_GENERATIONS = 3
+
+
+def checksum(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_snapshot(path, nodes, vectors, config):
+    """Save the nodes of an index as a new generation of the snapshot.
+
+    Parameters
+    ----------
+    path: str
+        The folder of the snapshot.
+    nodes: list<dict>
+        The nodes as {"id", "text", "metadata", "exclude_llm_keys", "exclude_embedding_keys"}.
+    vectors: list<list<float>>
+        The embedding of each node, in the same order.
+    config: dict
+        The config of the index (e.g. max_nodes).
+    """
+
+    os.makedirs(path, exist_ok=True)
+    previous = load_pointer(path) if has_snapshot(path) else None
+    generation = previous["generation"] + 1 if previous else 0
+    dim = len(vectors[0]) if vectors else 0
+    buffer = array.array("f")
+    for vector in vectors:
+        assert len(vector) == dim, "All the vectors of a snapshot should have {} dims".format(dim)
+        buffer.extend(vector)
+    state = {
+        "version": SNAPSHOT_VERSION,
+        "generation": generation,
+        "vectors": SNAPSHOT_VECTORS.format(generation),
+        "dim": dim,
+        "count": len(nodes),
+        "config": config,
+        "nodes": nodes,
+    }
+    state_file = SNAPSHOT_GENERATION.format(generation)
+    vectors_data = buffer.tobytes()
+    state_data = json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    # 新しい世代のファイルを書いてからポインタを置き換えるので、中断しても状態とベクトルの組は常に整合する
+    utils.write_atomic(os.path.join(path, state["vectors"]), vectors_data, mode="wb")
+    utils.write_atomic(os.path.join(path, state_file), state_data, mode="wb")
+    pointer = {
+        "version": SNAPSHOT_VERSION,
+        "generation": generation,
+        "files": {state_file: checksum(state_data), state["vectors"]: checksum(vectors_data)},
+    }
+    utils.write_atomic(os.path.join(path, SNAPSHOT_STATE), json.dumps(pointer, indent=2))
+    _remove_generations(path, generation - KEEP_GENERATIONS)
+    return pointer
+
+
+def _remove_generations(path, last):
+    """Remove the files of the generations up to last"""
+
+    for file_name in os.listdir(path):
+        name, ext = os.path.splitext(file_name)
+        if not name.startswith("snapshot-") or ext not in (".json", ".f32"):
+            continue
+        generation = name[len("snapshot-"):]
+        if generation.isdigit() and int(generation) <= last:
+            os.remove(os.path.join(path, file_name))
+
+
+def has_snapshot(path):
+    return bool(path) and os.path.isfile(os.path.join(path, SNAPSHOT_STATE))
+
+
+def load_pointer(path):
+    """The content of snapshot.json: the current generation and the checksums of its files"""
+
+    with open(os.path.join(path, SNAPSHOT_STATE), "r", encoding="utf-8") as f:
+        pointer = json.load(f)
+    if pointer["version"] == 1:
+        # 旧形式：snapshot.jsonが状態そのもの
+        pointer = {"version": 1, "generation": pointer["generation"], "files": {}}
+    return pointer
+
+
+def set_pointer(path, pointer):
+    """Point snapshot.json at another generation (e.g. the one of a consistent step)"""
+
+    utils.write_atomic(os.path.join(path, SNAPSHOT_STATE), json.dumps(pointer, indent=2))
+
+
+def verify_pointer(path, pointer):
+    """The problems of the files of a generation, empty if all of them match their checksums"""
+
+    problems = []
+    for file_name, expected in pointer["files"].items():
+        file_path = os.path.join(path, file_name)
+        if not os.path.isfile(file_path):
+            problems.append("{} is missing".format(file_path))
+        elif file_checksum(file_path) != expected:
+            problems.append("{} doesn't match its checksum".format(file_path))
+    return problems
+
+
+def _load_state(path):
+    with open(os.path.join(path, SNAPSHOT_STATE), "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state["version"] == 1:
+        return state
+    assert state["version"] == SNAPSHOT_VERSION, "Unexpected snapshot version " + str(state["version"])
+    with open(os.path.join(path, SNAPSHOT_GENERATION.format(state["generation"])), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_snapshot(path):
+    """Load the snapshot saved by save_snapshot, returns (nodes, vectors, config).
+
+    The vector file is read in one call as float32, no text is parsed. The vectors
+    are returned as lists for the in-memory VectorStoreIndex of llama_index, which
+    holds every embedding anyway, so resume still reads the whole memory.
+    """
+
+    state = _load_state(path)
+    dim, count = state["dim"], state["count"]
+    vectors = []
+    if count and dim:
+        buffer = array.array("f")
+        with open(os.path.join(path, state["vectors"]), "rb") as f:
+            try:
+                buffer.fromfile(f, dim * count)
+            except EOFError:
+                raise ValueError(
+                    "Snapshot {} is truncated: {} floats for {} vectors of {}".format(
+                        path, len(buffer), count, dim
+                    )
+                )
+        values = buffer.tolist()
+        vectors = [values[i * dim : (i + 1) * dim] for i in range(count)]
+    return state["nodes"], vectors, state["config"]
+
+
+def list_snapshots(storage_root):
+    """The snapshots under storage_root, {folder relative to storage_root: pointer}"""
+
+    snapshots = {}
+    for root, _, file_names in os.walk(storage_root):
+        if SNAPSHOT_STATE in file_names:
+            snapshots[os.path.relpath(root, storage_root).replace(os.sep, "/")] = load_pointer(root)
+    return snapshots
+
+
+def save_manifest(storage_root, checkpoint, step, time, checkpoint_checksum=None, conversation_size=None):
+    """Point the manifest at the latest consistent checkpoint of the simulation
+
+    The record of the step holds the checksum of the checkpoint, the generation of
+    every snapshot and the size of the conversation log. The record of the previous
+    step is kept in "previous", its snapshots are still on disk (KEEP_GENERATIONS)
+    even after the snapshots of the next step are saved.
+    """
+
+    os.makedirs(storage_root, exist_ok=True)
+    manifest = {
+        "checkpoint": checkpoint,
+        "step": step,
+        "time": time,
+        "checksum": checkpoint_checksum,
+        "conversation": conversation_size,
+        "snapshots": list_snapshots(storage_root),
+    }
+    previous = load_manifest(storage_root)
+    if previous:
+        previous.pop("previous", None)
+        manifest["previous"] = previous
+    utils.write_atomic(
+        os.path.join(storage_root, MANIFEST),
+        json.dumps(manifest, indent=2, ensure_ascii=False),
+    )
+    return manifest
+
+
+def load_manifest(storage_root):
+    path = os.path.join(storage_root, MANIFEST)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
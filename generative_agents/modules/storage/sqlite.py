@@ -0,0 +1,367 @@
+"""generative_agents.storage.sqlite
+
+Single-file store of a simulation (results/checkpoints/<name>/simulation.db),
+used instead of the JSON checkpoints, conversation.jsonl and the snapshots of
+the memory with start.py --store sqlite:
+
+    steps           one row per step, the config of the checkpoint without the agents
+    agents          the state of each agent at each step (coord, action, schedule, ...)
+    memory          the nodes of the memory indexes, the embeddings as float32 BLOBs
+    memory_config   the config of each memory index (e.g. max_nodes)
+    conversations   one row per chat, indexed by time, step and person
+
+The database runs in WAL mode, so replay.py and compress.py read it while the
+simulation writes. All the writes of a step (the memory saved by Agent.to_dict,
+the checkpoint and the chats) are one transaction committed at the end of the
+step: after a crash the store is at the last complete step.
+"""
+
+import os
+import json
+import array
+import sqlite3
+
+from modules import utils
+from modules.conversation import chat_key
+
+store_file = "simulation.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS steps (
+    step INTEGER PRIMARY KEY,
+    time TEXT NOT NULL,
+    checkpoint TEXT NOT NULL,
+    config TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS steps_time ON steps (time);
+CREATE TABLE IF NOT EXISTS agents (
+    step INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    coord TEXT,
+    action TEXT,
+    schedule TEXT,
+    state TEXT NOT NULL,
+    PRIMARY KEY (step, name)
+);
+CREATE INDEX IF NOT EXISTS agents_name ON agents (name, step);
+CREATE TABLE IF NOT EXISTS memory (
+    memory TEXT NOT NULL,
+    node_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    vector BLOB,
+    PRIMARY KEY (memory, node_id)
+);
+CREATE TABLE IF NOT EXISTS memory_config (
+    memory TEXT PRIMARY KEY,
+    config TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time TEXT NOT NULL,
+    step INTEGER,
+    person TEXT NOT NULL,
+    other TEXT NOT NULL,
+    location TEXT NOT NULL,
+    chats TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_time ON conversations (time);
+CREATE INDEX IF NOT EXISTS conversations_step ON conversations (step);
+CREATE INDEX IF NOT EXISTS conversations_person ON conversations (person, time);
+CREATE INDEX IF NOT EXISTS conversations_other ON conversations (other, time);
+"""
+
+# agentsテーブルで個別の列に持つ項目（残りはstateにまとめる）
+_agent_columns = ("coord", "action", "schedule")
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _loads(data):
+    return None if data is None else json.loads(data)
+
+
+class ConversationTable:
+    """The conversations table, read and written like ConversationLog (modules/conversation.py)"""
+
+    _columns = "time, step, person, other, location, chats"
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def _records(self, where="", params=()):
+        rows = self._connection.execute(
+            "SELECT {} FROM conversations {} ORDER BY time, id".format(self._columns, where), params
+        )
+        return [
+            {"time": time, "step": step, "persons": [person, other], "location": location, "chats": json.loads(chats)}
+            for time, step, person, other, location, chats in rows
+        ]
+
+    def append(self, time, step, chats):
+        """Append the chats of a step, chats: [{"A -> B @ location": [[name, text], ...]}, ...]"""
+
+        rows = []
+        for chat in chats:
+            for key, texts in chat.items():
+                persons, location = key.split(" @ ", 1)
+                person, other = persons.split(" -> ")
+                rows.append((time, step, person, other, location, _dumps(texts)))
+        self._connection.executemany(
+            "INSERT INTO conversations ({}) VALUES (?, ?, ?, ?, ?, ?)".format(self._columns), rows
+        )
+        return len(rows)
+
+    def truncate(self, time):
+        """Drop the chats from the time on (e.g. the steps lost when resuming from a checkpoint)"""
+
+        self._connection.execute("DELETE FROM conversations WHERE time >= ?", (time,))
+
+    def records(self, start=None, end=None):
+        """The chats between start and end (inclusive, %Y%m%d-%H:%M)"""
+
+        return self._records("WHERE time >= ? AND time <= ?", (start or "", end or "￿"))
+
+    def at(self, time):
+        return self._records("WHERE time = ?", (time,))
+
+    def at_step(self, step):
+        return self._records("WHERE step = ?", (step,))
+
+    def of(self, person, start=None, end=None):
+        """The chats of the person between start and end"""
+
+        return self._records(
+            "WHERE (person = ? OR other = ?) AND time >= ? AND time <= ?",
+            (person, person, start or "", end or "￿"),
+        )
+
+    def between(self, person, other, start=None, end=None):
+        """The chats between the two persons, in either direction"""
+
+        return self._records(
+            "WHERE ((person = ? AND other = ?) OR (person = ? AND other = ?)) AND time >= ? AND time <= ?",
+            (person, other, other, person, start or "", end or "￿"),
+        )
+
+    def to_dict(self):
+        """All the chats in the format of conversation.json"""
+
+        conversation = {}
+        for record in self.records():
+            conversation.setdefault(record["time"], []).append({chat_key(record): record["chats"]})
+        return conversation
+
+    # 以下はconversation.jsonのdictとして読むためのもの
+    def __contains__(self, time):
+        return self._connection.execute("SELECT 1 FROM conversations WHERE time = ? LIMIT 1", (time,)).fetchone() is not None
+
+    def __getitem__(self, time):
+        if time not in self:
+            raise KeyError(time)
+        return self.get(time)
+
+    def get(self, time, default=None):
+        records = self.at(time)
+        if not records:
+            return default
+        return [{chat_key(r): r["chats"]} for r in records]
+
+    def keys(self):
+        return [row[0] for row in self._connection.execute("SELECT DISTINCT time FROM conversations ORDER BY time")]
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(DISTINCT time) FROM conversations").fetchone()[0]
+
+
+class SimulationStore:
+    def __init__(self, path, create=True):
+        self.path = path
+        # autocommit、ステップの書き込みはbegin()〜commit()で一つのトランザクションにする
+        self._connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        if create:
+            self._connection.executescript(SCHEMA)
+        self.conversation = ConversationTable(self._connection)
+        self._memory_ids = {}
+
+    def begin(self):
+        if not self._connection.in_transaction:
+            self._connection.execute("BEGIN")
+
+    def commit(self):
+        if self._connection.in_transaction:
+            self._connection.execute("COMMIT")
+
+    def rollback(self):
+        if self._connection.in_transaction:
+            self._connection.execute("ROLLBACK")
+        self._memory_ids = {}
+
+    def close(self):
+        self.rollback()
+        self._connection.close()
+
+    def save_step(self, step, time, checkpoint, config):
+        """Save the config of the step (a checkpoint of start.py), in the transaction of the step"""
+
+        self._connection.execute(
+            "INSERT OR REPLACE INTO steps (step, time, checkpoint, config) VALUES (?, ?, ?, ?)",
+            (step, time, checkpoint, _dumps({k: v for k, v in config.items() if k != "agents"})),
+        )
+        rows = []
+        for name, agent in config["agents"].items():
+            state = {k: v for k, v in agent.items() if k not in _agent_columns}
+            rows.append((step, name) + tuple(_dumps(agent[k]) if k in agent else None for k in _agent_columns) + (_dumps(state),))
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO agents (step, name, coord, action, schedule, state) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+
+    def _load_config(self, step, config):
+        config = json.loads(config)
+        config["agents"] = {}
+        rows = self._connection.execute(
+            "SELECT name, coord, action, schedule, state FROM agents WHERE step = ? ORDER BY rowid", (step,)
+        )
+        for name, *columns, state in rows:
+            agent = json.loads(state)
+            agent.update({k: _loads(v) for k, v in zip(_agent_columns, columns) if v is not None})
+            config["agents"][name] = agent
+        return config
+
+    def latest_step(self):
+        row = self._connection.execute("SELECT MAX(step) FROM steps").fetchone()
+        return row[0]
+
+    def load_step(self, step=None):
+        """The checkpoint of the step (the latest one by default), None if there is none"""
+
+        if step is None:
+            step = self.latest_step()
+        row = self._connection.execute("SELECT config FROM steps WHERE step = ?", (step,)).fetchone()
+        return self._load_config(step, row[0]) if row else None
+
+    def checkpoints(self, after=None):
+        """Yield (file name, checkpoint) of the steps after the checkpoint file name, one by one"""
+
+        rows = self._connection.execute(
+            "SELECT step, checkpoint FROM steps WHERE checkpoint > ? ORDER BY step", (after or "",)
+        ).fetchall()
+        for step, checkpoint in rows:
+            row = self._connection.execute("SELECT config FROM steps WHERE step = ?", (step,)).fetchone()
+            yield checkpoint, self._load_config(step, row[0])
+
+    def history(self, name, start=None, end=None):
+        """The coord, action and schedule of the agent at each step between start and end (%Y%m%d-%H:%M)"""
+
+        rows = self._connection.execute(
+            "SELECT steps.step, steps.time, coord, action, schedule FROM agents JOIN steps USING (step) "
+            "WHERE name = ? AND steps.time >= ? AND steps.time <= ? ORDER BY steps.step",
+            (name, start or "", end or "￿"),
+        )
+        return [
+            {"step": step, "time": time, "coord": _loads(coord), "action": _loads(action), "schedule": _loads(schedule)}
+            for step, time, coord, action, schedule in rows
+        ]
+
+    def memory_key(self, path):
+        """The key of a memory index, its path relative to the checkpoints folder (e.g. storage/あいか/associate)"""
+
+        return os.path.relpath(path, os.path.dirname(os.path.abspath(self.path))).replace(os.sep, "/")
+
+    def has_memory(self, key):
+        row = self._connection.execute("SELECT 1 FROM memory_config WHERE memory = ?", (key,)).fetchone()
+        return row is not None
+
+    def save_memory(self, key, nodes, get_vector, config):
+        """Save the nodes of a memory index.
+
+        Parameters
+        ----------
+        key: str
+            The key of the index (memory_key).
+        nodes: list<dict>
+            The nodes as {"id", "text", "metadata", "exclude_llm_keys", "exclude_embedding_keys"}.
+        get_vector: callable
+            The embedding of a node id, only called for the nodes that are not stored yet.
+        config: dict
+            The config of the index (e.g. max_nodes).
+        """
+
+        if key not in self._memory_ids:
+            self._memory_ids[key] = {
+                row[0] for row in self._connection.execute("SELECT node_id FROM memory WHERE memory = ?", (key,))
+            }
+        stored = self._memory_ids[key]
+        ids = {node["id"] for node in nodes}
+        began = not self._connection.in_transaction
+        self.begin()
+        try:
+            self._connection.executemany(
+                "DELETE FROM memory WHERE memory = ? AND node_id = ?", [(key, i) for i in stored - ids]
+            )
+            # 埋め込みは変わらないので、既存のノードはテキストとメタデータ（アクセス時刻など）だけ更新する
+            rows = []
+            for node in nodes:
+                metadata = {k: node[k] for k in ("metadata", "exclude_llm_keys", "exclude_embedding_keys")}
+                vector = None if node["id"] in stored else array.array("f", get_vector(node["id"])).tobytes()
+                rows.append((key, node["id"], node["text"], _dumps(metadata), vector))
+            self._connection.executemany(
+                "INSERT INTO memory (memory, node_id, text, metadata, vector) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (memory, node_id) DO UPDATE SET text = excluded.text, metadata = excluded.metadata",
+                rows,
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO memory_config (memory, config) VALUES (?, ?)", (key, _dumps(config))
+            )
+            if began:
+                self.commit()
+        except Exception:
+            if began:
+                self.rollback()
+            raise
+        self._memory_ids[key] = ids
+
+    def load_memory(self, key):
+        """Load the nodes saved by save_memory, returns (nodes, vectors, config) like load_snapshot"""
+
+        row = self._connection.execute("SELECT config FROM memory_config WHERE memory = ?", (key,)).fetchone()
+        if row is None:
+            return [], [], None
+        nodes, vectors = [], []
+        rows = self._connection.execute(
+            "SELECT node_id, text, metadata, vector FROM memory WHERE memory = ? ORDER BY rowid", (key,)
+        )
+        for node_id, text, metadata, vector in rows:
+            node = {"id": node_id, "text": text}
+            node.update(json.loads(metadata))
+            nodes.append(node)
+            vectors.append(array.array("f", vector).tolist())
+        self._memory_ids[key] = {node["id"] for node in nodes}
+        return nodes, vectors, json.loads(row[0])
+
+
+def has_store(checkpoints_folder):
+    return os.path.isfile(os.path.join(checkpoints_folder, store_file))
+
+
+def open_store(checkpoints_folder, create=False):
+    """The store of the simulation, None if it doesn't have one (and create is False)"""
+
+    if not create and not has_store(checkpoints_folder):
+        return None
+    return SimulationStore(os.path.join(checkpoints_folder, store_file), create=create)
+
+
+def set_store(store):
+    """Set the store of the current simulation, the memory indexes are saved to it"""
+
+    utils.GenerativeAgentsMap.set(utils.GenerativeAgentsKey.STORE, store)
+    return store
+
+
+def get_store():
+    return utils.GenerativeAgentsMap.get(utils.GenerativeAgentsKey.STORE)
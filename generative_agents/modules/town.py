@@ -0,0 +1,200 @@
+"""generative_agents.town"""
+
+import os
+import math
+import random
+
+from modules import utils
+
+# 公共施設の種類：{種類: {エリア: [オブジェクト]}}
+PUBLIC_SECTORS = {
+    "カフェ": {"カフェ": ["カフェの客席", "カフェカウンター", "調理エリア"]},
+    "図書館": {"閲覧室": ["図書館のテーブル", "図書館のソファ", "本棚"]},
+    "公園": {"公園": ["公園の庭", "公園のベンチ"]},
+    "市場": {"店": ["雑貨店の棚", "雑貨店カウンター"], "薬局": ["薬局の棚", "薬局カウンター"]},
+    "学校": {"教室": ["黒板", "教室の教壇", "教室の生徒の席"], "職員室": ["職員室の机"]},
+    "バー": {"バー": ["バーの客席", "バーカウンター", "マイク"]},
+    "事務所": {"オフィス": ["オフィスの机", "会議室のテーブル"]},
+    "ジム": {"トレーニング室": ["ランニングマシン", "ベンチプレス"]},
+}
+HOME_ARENAS = {
+    "リビング": ["リビングのソファ", "リビングのテーブル"],
+    "キッチン": ["冷蔵庫", "調理エリア"],
+    "浴室": ["シャワー", "浴室の洗面台", "トイレ"],
+}
+# 睡眠のアドレスはliving_area + ["ベッド"]になる（memory.Spatialを参照）
+ROOM_OBJECTS = ["ベッド", "机", "クローゼット"]
+
+JOBS = {
+    "カフェ": "カフェの店員",
+    "図書館": "司書",
+    "公園": "庭師",
+    "市場": "店主",
+    "学校": "教師",
+    "バー": "バーテンダー",
+    "事務所": "会社員",
+    "ジム": "トレーナー",
+}
+TRAITS = ["好奇心旺盛", "穏やか", "社交的", "几帳面", "独立心が強い", "楽観的", "慎重", "親切"]
+
+ARENA_WIDTH, BLOCK_HEIGHT, ROAD = 4, 8, 2
+
+
+class TownGenerator:
+    """Procedurally build a town (maze.json) and its residents (agent.json).
+
+    The town is a grid of rectangular sectors separated by roads. Each sector
+    is walled with a door on the bottom side, its arenas are vertical strips
+    inside the walls and every game object takes one tile of its arena, so all
+    the addresses are reachable by Maze.find_path.
+    """
+
+    def __init__(
+        self,
+        agents_num,
+        residents=4,
+        public_num=0,
+        known_sectors=8,
+        width=0,
+        height=0,
+        world="the Ville",
+        seed=0,
+    ):
+        self.agents_num = agents_num
+        self.residents = residents
+        self.public_num = public_num or max(len(PUBLIC_SECTORS), agents_num // 10)
+        self.known_sectors = known_sectors
+        self.world = world
+        self._rnd = random.Random(seed)
+
+        self.homes_num = math.ceil(agents_num / residents)
+        arenas_max = max(
+            [residents + len(HOME_ARENAS)] + [len(a) for a in PUBLIC_SECTORS.values()]
+        )
+        self.block_width = arenas_max * ARENA_WIDTH + 2
+        self.cell = (self.block_width + ROAD, BLOCK_HEIGHT + ROAD)
+        sectors_num = self.homes_num + self.public_num
+        if width and height:
+            self.cols = (width - ROAD - 1) // self.cell[0]
+            rows = (height - ROAD - 1) // self.cell[1]
+            if self.cols * rows < sectors_num:
+                raise ValueError(
+                    "maze {}x{} can not hold {} sectors, at most {}".format(
+                        width, height, sectors_num, self.cols * rows
+                    )
+                )
+        else:
+            self.cols = math.ceil(math.sqrt(sectors_num))
+            rows = math.ceil(sectors_num / self.cols)
+            width = ROAD + self.cols * self.cell[0] + 1
+            height = ROAD + rows * self.cell[1] + 1
+        self.width, self.height = width, height
+
+    def generate(self):
+        """Generate the town, returns (maze, {name: agent_config})"""
+
+        sectors = []
+        kinds = list(PUBLIC_SECTORS.keys())
+        for i in range(self.public_num):
+            kind = kinds[i % len(kinds)]
+            sectors.append(("{}{}".format(kind, i // len(kinds) + 1), kind, PUBLIC_SECTORS[kind]))
+        names = ["住民{:04d}".format(i + 1) for i in range(self.agents_num)]
+        homes = []
+        for i in range(self.homes_num):
+            members = names[i * self.residents : (i + 1) * self.residents]
+            arenas = {"{}の部屋".format(n): list(ROOM_OBJECTS) for n in members}
+            arenas.update(HOME_ARENAS)
+            homes.append(("住宅{}".format(i + 1), members, arenas))
+            sectors.append((homes[-1][0], None, arenas))
+
+        tiles, spots = {}, {}
+        for idx, (sector, _, arenas) in enumerate(sectors):
+            x0 = ROAD + (idx % self.cols) * self.cell[0]
+            y0 = ROAD + (idx // self.cols) * self.cell[1]
+            spots.update(self._build_sector(tiles, (x0, y0), sector, arenas))
+
+        maze = {
+            "world": self.world,
+            "tile_size": 32,
+            "size": [self.height, self.width],
+            "tile_address_keys": ["world", "sector", "arena", "game_object"],
+            "tiles": [dict(coord=list(c), **t) for c, t in sorted(tiles.items())],
+        }
+        public = [(s, k, a) for s, k, a in sectors if k]
+        agents = {}
+        for home, members, arenas in homes:
+            for name in members:
+                agents[name] = self._build_agent(
+                    name, home, arenas, public, spots[(home, "{}の部屋".format(name))]
+                )
+        return maze, agents
+
+    def _build_sector(self, tiles, origin, sector, arenas):
+        x0, y0 = origin
+        x1, y1 = x0 + self.block_width - 1, y0 + BLOCK_HEIGHT - 1
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                if x in (x0, x1) or y in (y0, y1):
+                    tiles[(x, y)] = {"address": [sector], "collision": True}
+                else:
+                    tiles[(x, y)] = {"address": [sector]}
+        tiles[((x0 + x1) // 2, y1)] = {"address": [sector]}
+
+        spots = {}
+        for i, (arena, objects) in enumerate(arenas.items()):
+            ax = x0 + 1 + i * ARENA_WIDTH
+            for x in range(ax, ax + ARENA_WIDTH):
+                for y in range(y0 + 1, y1):
+                    tiles[(x, y)] = {"address": [sector, arena]}
+            for j, obj in enumerate(objects):
+                tiles[(ax + 1 + j % 2 * 2, y0 + 1 + j // 2 * 2)] = {
+                    "address": [sector, arena, obj]
+                }
+            # 到着地点（オブジェクトのないタイル）
+            spots[(sector, arena)] = [ax, y1 - 1]
+        return spots
+
+    def _build_agent(self, name, home, arenas, public, coord):
+        rnd = self._rnd
+        known = rnd.sample(public, min(self.known_sectors, len(public)))
+        work_sector, work_kind, _ = known[0]
+        room = "{}の部屋".format(name)
+        tree = {
+            home: {a: list(o) for a, o in arenas.items() if a == room or a in HOME_ARENAS}
+        }
+        for sector, _, sector_arenas in known:
+            tree[sector] = {a: list(o) for a, o in sector_arenas.items()}
+        wake_up, sleep = rnd.randint(6, 8), rnd.randint(21, 23)
+        job = JOBS[work_kind]
+        return {
+            "name": name,
+            "portrait": "assets/village/agents/あいか/portrait.png",
+            "coord": coord,
+            "currently": "{}は{}で{}として働いている。".format(name, work_sector, job),
+            "scratch": {
+                "age": rnd.randint(20, 70),
+                "innate": "、".join(rnd.sample(TRAITS, 3)),
+                "learned": "{}は{}に住む{}です。".format(name, home, job),
+                "lifestyle": "{}は夜{}時頃に寝て、朝{}時頃に起きます。".format(
+                    name, sleep - 12, wake_up
+                ),
+                "daily_plan": "{}は午前9時から午後5時まで{}で働きます。".format(name, work_sector),
+            },
+            "spatial": {
+                "address": {"living_area": [self.world, home, room]},
+                "tree": {self.world: tree},
+            },
+        }
+
+
+def save_town(maze, agents, static_root, assets_name):
+    """Save the town to {static_root}/assets/{assets_name}, returns the assets root for get_config"""
+
+    assets_root = os.path.join("assets", assets_name)
+    folder = os.path.join(static_root, assets_root)
+    os.makedirs(folder, exist_ok=True)
+    utils.save_dict(maze, os.path.join(folder, "maze.json"), indent=None)
+    for name, agent in agents.items():
+        os.makedirs(os.path.join(folder, "agents", name), exist_ok=True)
+        utils.save_dict(agent, os.path.join(folder, "agents", name, "agent.json"))
+    return assets_root
@@ -3,4 +3,5 @@
 from .arguments import *
 from .log import *
 from .namespace import *
+from .profiler import *
 from .timer import *
@@ -55,8 +55,43 @@ def save_dict(dict_obj: Any, path: str, indent: int = 2) -> str:
         The output path.
     """
 
-    with open(path, "w") as f:
-        f.write(json.dumps(load_dict(dict_obj), indent=indent, ensure_ascii=False))
+    return write_atomic(path, json.dumps(load_dict(dict_obj), indent=indent, ensure_ascii=False))
+
+
+def write_atomic(path: str, data: Any, mode: str = "w") -> str:
+    """Write to a temporary file, fsync it and rename it over the path
+
+    Readers (and a resume after a crash) see the previous file or the new one, never a partial file.
+
+    Parameters
+    ----------
+    path: str
+        The output path.
+    data: str or bytes
+        The content of the file.
+    mode: str
+        The mode to open the file, "wb" for bytes.
+
+    Returns
+    -------
+    path: str
+        The output path.
+    """
+
+    tmp_path = path + ".tmp"
+    encoding = None if "b" in mode else "utf-8"
+    with open(tmp_path, mode, encoding=encoding) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    # 名前の変更もディスクに反映させる（ディレクトリを開けないWindowsでは省略）
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
     return path
 
 
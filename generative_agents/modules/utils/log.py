@@ -104,7 +104,8 @@ def create_file_logger(
         else:
             raise Exception("Unexcept verbose {}, should be debug| info| warn")
 
-    log_name = os.path.basename(path)
+    # 同じプロセス内の別シミュレーションとロガーを共有しないよう、フルパスで区別する
+    log_name = os.path.abspath(path)
     logger = logging.getLogger(log_name)
     logger.setLevel(level)
     if any(
@@ -1,21 +1,76 @@
 """generative_agents.utils.namespace"""
 
-from typing import Any, Optional
+from typing import Any, Callable, Optional
+import contextvars
 import copy
 
+_current_context = contextvars.ContextVar("generative_agents_context", default=None)
+
+
+class SimulationContext:
+    """Namespace of one simulation: the timer, the game, the models and the profiler.
+
+    While a context is active (see run), GenerativeAgentsMap reads and writes the
+    map of the context instead of the global map, so that several simulations
+    can run in the threads or asyncio tasks of one process. The models (llm
+    schedulers and backends) can be shared between contexts.
+    """
+
+    def __init__(self, name: str = "", models: Optional[dict] = None):
+        self.name = name
+        self.map = {}
+        if models is not None:
+            self.map[GenerativeAgentsKey.MODELS] = models
+
+    def run(self, func: Callable, *args, **kwargs):
+        """Run func with this context active, in a copy of the current contextvars"""
+
+        def _run():
+            _current_context.set(self)
+            return func(*args, **kwargs)
+
+        return contextvars.copy_context().run(_run)
+
+    def get(self, key: str, default: Optional[Any] = None):
+        return self.map.get(key, default)
+
+
+def get_context() -> Optional[SimulationContext]:
+    """Get the active simulation context, None when the global map is used"""
+
+    return _current_context.get()
+
+
+def bind_context(func: Callable) -> Callable:
+    """Bind func to the current contextvars, e.g. before submitting it to a thread"""
+
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
 
 class GenerativeAgentsMap:
-    """Global Namespace map for Land"""
+    """Global Namespace map for Land, resolved through the active SimulationContext"""
 
     MAP = {}
 
+    @classmethod
+    def current(cls) -> dict:
+        context = _current_context.get()
+        if context is None:
+            return cls.MAP
+        return context.map
+
     @classmethod
     def set(cls, key: str, value: Any):
-        cls.MAP[key] = value
+        cls.current()[key] = value
 
     @classmethod
     def get(cls, key: str, default: Optional[Any] = None):
-        return cls.MAP.get(key, default)
+        return cls.current().get(key, default)
+
+    @classmethod
+    def setdefault(cls, key: str, default: Any):
+        return cls.current().setdefault(key, default)
 
     @classmethod
     def clone(cls, key: str, default: Optional[Any] = None):
@@ -23,17 +78,19 @@ class GenerativeAgentsMap:
 
     @classmethod
     def delete(cls, key: str):
-        if key in cls.MAP:
-            return cls.MAP.pop(key)
-        return None
+        return cls.current().pop(key, None)
 
     @classmethod
     def contains(cls, key: str):
-        return key in cls.MAP
+        return key in cls.current()
 
     @classmethod
     def reset(cls):
-        cls.MAP = {}
+        context = _current_context.get()
+        if context is None:
+            cls.MAP = {}
+        else:
+            context.map = {}
 
 
 class GenerativeAgentsKey:
@@ -42,3 +99,6 @@ class GenerativeAgentsKey:
     GAME = "game"
     TIMER = "timer"
     MODELS = "models"
+    METRICS = "metrics"
+    PROFILER = "profiler"
+    STORE = "store"
@@ -0,0 +1,110 @@
+"""generative_agents.utils.profiler"""
+
+import os
+import time
+import functools
+import threading
+import contextlib
+
+from .namespace import GenerativeAgentsMap, GenerativeAgentsKey
+
+
+class Profiler:
+    """Accumulate the time of nested spans, keyed by the span path (e.g. think/percept/llm)"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._spans = {}
+
+    @contextlib.contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(name)
+        path = "/".join(stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                record = self._spans.setdefault(path, [0, 0])
+                record[0] += duration
+                record[1] += 1
+
+    def collect(self):
+        """Get the spans recorded since last collect"""
+
+        with self._lock:
+            spans, self._spans = self._spans, {}
+        return {
+            path: {"seconds": round(seconds, 6), "calls": calls}
+            for path, (seconds, calls) in sorted(spans.items())
+        }
+
+
+def profile_span(name):
+    """Decorator to record the function as a span of the global profiler"""
+
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            profiler = get_profiler()
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with profiler.span(name):
+                return func(*args, **kwargs)
+
+        return _wrapper
+
+    return _decorator
+
+
+def run_profiled(func, mode, output_folder):
+    """Run func under cProfile or pyinstrument, the result is saved in output_folder"""
+
+    os.makedirs(output_folder, exist_ok=True)
+    if mode == "cprofile":
+        import cProfile
+        import pstats
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return func()
+        finally:
+            profile.disable()
+            profile.dump_stats(os.path.join(output_folder, "cprofile.prof"))
+            with open(os.path.join(output_folder, "cprofile.txt"), "w") as f:
+                pstats.Stats(profile, stream=f).sort_stats("cumulative").print_stats(80)
+    if mode == "pyinstrument":
+        try:
+            from pyinstrument import Profiler as Instrument
+        except ImportError:
+            print("pyinstrument is not installed, run without it (pip install pyinstrument)")
+            return func()
+        profile = Instrument()
+        profile.start()
+        try:
+            return func()
+        finally:
+            profile.stop()
+            with open(os.path.join(output_folder, "pyinstrument.html"), "w") as f:
+                f.write(profile.output_html())
+    return func()
+
+
+def set_profiler(enabled=False):
+    GenerativeAgentsMap.set(GenerativeAgentsKey.PROFILER, Profiler(enabled=enabled))
+    return GenerativeAgentsMap.get(GenerativeAgentsKey.PROFILER)
+
+
+def get_profiler():
+    if not GenerativeAgentsMap.get(GenerativeAgentsKey.PROFILER):
+        set_profiler()
+    return GenerativeAgentsMap.get(GenerativeAgentsKey.PROFILER)
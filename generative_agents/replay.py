@@ -1,10 +1,11 @@
 import os
 import json
+import threading
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 
-from compress import frames_per_step, file_movement
-from start import personas
+from modules.constants import frames_per_step, file_movement, folder_chunks, file_chunk_index
+from modules.movement import MOVEMENT_FORMAT, positions_at, seek_chunk, chunk_positions_at
 
 app = Flask(
     __name__,
@@ -14,6 +15,40 @@ app = Flask(
 )
 
 
+def load_chunk_index(name):
+    index_file = f"results/compressed/{name}/{folder_chunks}/{file_chunk_index}"
+    if not os.path.exists(index_file):
+        return None
+    with open(index_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# 指定帧所在的チャンクだけを読み、キーフレームから各Agentの位置を求める
+def seek_positions(name, chunk_index, frame, persona_init_pos):
+    file_name = chunk_index["chunks"][seek_chunk(chunk_index, frame)]
+    with open(f"results/compressed/{name}/{folder_chunks}/{file_name}", "r", encoding="utf-8") as f:
+        return chunk_positions_at(json.load(f), frame, persona_init_pos)
+
+
+@app.route("/movement/<name>", methods=['GET'])
+def movement_index(name):
+    chunk_index = load_chunk_index(name)
+    if chunk_index is None:
+        return jsonify({"error": f"No chunked replay data for '{name}', run compress.py first."}), 404
+    return jsonify(chunk_index)
+
+
+@app.route("/movement/<name>/<int:chunk>", methods=['GET'])
+def movement_chunk(name, chunk):
+    chunk_index = load_chunk_index(name)
+    if chunk_index is None or chunk >= len(chunk_index["chunks"]):
+        # 範囲外は空のチャンクとして返す（再生側は再生終了と判断する）
+        empty = {"index": chunk, "agents": [], "strings": [], "segments": [], "conversation": {}}
+        return jsonify(empty)
+    chunk_folder = os.path.abspath(f"results/compressed/{name}/{folder_chunks}")
+    return send_from_directory(chunk_folder, chunk_index["chunks"][chunk], mimetype="application/json")
+
+
 @app.route("/", methods=['GET'])
 def index():
     name = request.args.get("name", "")          # 记录名称
@@ -26,12 +61,29 @@ def index():
     else:
         return f"Invalid name of the simulation: '{name}'"
 
+    # チャンクがあればページには先頭の状態だけを埋め込み、残りはブラウザが必要な区間ずつ取得する
+    chunk_index = load_chunk_index(name)
+    chunked = chunk_index is not None
     replay_file = f"{compressed_folder}/{file_movement}"
-    if not os.path.exists(replay_file):
+    if chunked:
+        params = {k: chunk_index.pop(k) for k in ["start_datetime", "stride", "sec_per_step", "persona_init_pos"]}
+        params["all_movement"] = {
+            "description": chunk_index.pop("description"),
+            "conversation": {},
+            "0": chunk_index.pop("frame0"),
+        }
+        params["movement_meta"] = chunk_index
+    elif not os.path.exists(replay_file):
         return f"The data file doesn‘t exist: '{replay_file}'<br />Run compress.py to generate the data first."
+    else:
+        with open(replay_file, "r", encoding="utf-8") as f:
+            params = json.load(f)
 
-    with open(replay_file, "r", encoding="utf-8") as f:
-        params = json.load(f)
+    compact = not chunked and params.get("format") == MOVEMENT_FORMAT
+    if compact:
+        # 圧縮形式はブラウザ側（static/js/movement.js）でフレームに展開する
+        keys = ["start_datetime", "stride", "sec_per_step", "persona_init_pos"]
+        params = dict({k: params[k] for k in keys}, all_movement=params)
 
     if step < 1:
         step = 1
@@ -41,14 +93,24 @@ def index():
         dt = t + timedelta(minutes=params["stride"]*(step-1))
         params["start_datetime"] = dt.isoformat()
         step = (step-1) * frames_per_step + 1
-        if step >= len(params["all_movement"]):
-            step = len(params["all_movement"])-1
+        if chunked:
+            step = min(step, chunk_index["frames"])
+            params["persona_init_pos"] = seek_positions(name, chunk_index, step, params["persona_init_pos"])
+        elif compact:
+            step = min(step, params["all_movement"]["frames"])
+            params["persona_init_pos"] = positions_at(params["all_movement"], step)
+        else:
+            if step >= len(params["all_movement"]):
+                step = len(params["all_movement"])-1
 
-        # 重新设置Agent的初始位置
-        for agent in params["persona_init_pos"].keys():
-            persona_init_pos = params["persona_init_pos"]
-            persona_step_pos = params["all_movement"][f"{step}"]
-            persona_init_pos[agent] = persona_step_pos[agent]["movement"]
+            # 重新设置Agent的初始位置（该帧没有记录的Agent使用之前最后记录的位置）
+            for agent in params["persona_init_pos"].keys():
+                persona_init_pos = params["persona_init_pos"]
+                for frame in range(step, -1, -1):
+                    persona_step_pos = params["all_movement"].get(f"{frame}", {})
+                    if agent in persona_step_pos:
+                        persona_init_pos[agent] = persona_step_pos[agent]["movement"]
+                        break
 
     if speed < 0:
         speed = 0
@@ -58,7 +120,10 @@ def index():
 
     return render_template(
         "index.html",
-        persona_names=personas,
+        # エージェントは圧縮データ（最初のチェックポイント）から取る（選択した人数や生成した町の場合）
+        persona_names=list(params["persona_init_pos"]),
+        name=name,
+        chunked=chunked,
         step=step,
         play_speed=speed,
         zoom=zoom,
@@ -66,5 +131,80 @@ def index():
     )
 
 
+@app.route("/live", methods=['GET'])
+def live():
+    bus = app.config.get("LIVE_BUS")
+    if bus is None:
+        return "No simulation is streaming, run start.py with --live &lt;port&gt;."
+    speed = min(max(int(request.args.get("speed", 2)), 0), 5)  # 回放速度（0~5）
+    zoom = float(request.args.get("zoom", 0.8))  # 画面缩放比例
+
+    # 最新のステップ（のキーフレーム）から再生を始める
+    meta, latest = bus.meta, bus.latest
+    persona_init_pos = dict(meta["persona_init_pos"])
+    description = {name: {"currently": ""} for name in persona_init_pos}
+    step, start_datetime = 1, meta["start_datetime"]
+    if latest is not None:
+        persona_init_pos.update({n: s["movement"] for n, s in latest["keyframe"].items()})
+        description.update(latest["description"])
+        step = latest["start"]
+        start_datetime = datetime.strptime(latest["time"], "%Y%m%d-%H:%M").isoformat()
+
+    return render_template(
+        "index.html",
+        persona_names=list(persona_init_pos),
+        live=True,
+        step=step,
+        play_speed=2 ** speed,
+        zoom=zoom,
+        start_datetime=start_datetime,
+        sec_per_step=meta["sec_per_step"],
+        frames_per_step=meta["frames_per_step"],
+        persona_init_pos=persona_init_pos,
+        all_movement={"description": description, "conversation": {}},
+    )
+
+
+@app.route("/live/stream", methods=['GET'])
+def live_stream():
+    """Server-sent events of the simulation steps, see modules/live.py"""
+
+    bus = app.config.get("LIVE_BUS")
+    if bus is None:
+        return jsonify({"error": "No simulation is streaming"}), 404
+    subscription = bus.subscribe()
+
+    def events():
+        try:
+            while True:
+                event = subscription.get(timeout=15)
+                if event is None:
+                    # 接続が切れていないかを確認するためのコメント
+                    yield ": keep-alive\n\n"
+                    continue
+                yield "data: " + json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n\n"
+        finally:
+            bus.unsubscribe(subscription)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(events(), mimetype="text/event-stream", headers=headers)
+
+
+def serve_live(bus, port, host="127.0.0.1"):
+    """Serve the live viewer of the bus on http://host:port/live, in a background thread
+
+    Only the local machine can connect by default, pass host="0.0.0.0" to expose it.
+    """
+
+    app.config["LIVE_BUS"] = bus
+    thread = threading.Thread(
+        target=app.run,
+        kwargs={"host": host, "port": port, "threaded": True, "use_reloader": False},
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
 if __name__ == "__main__":
     app.run(debug=True)
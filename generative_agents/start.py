@@ -2,27 +2,27 @@ import os
 import copy
 import json
 import argparse
+import math
 import datetime
+import time
 
 from dotenv import load_dotenv, find_dotenv
 
 from modules.game import create_game, get_game
+from modules.model import get_llm_metrics, serve_metrics
+from modules.storage.snapshot import save_manifest, checksum
+from modules.storage.sqlite import has_store, open_store, set_store
+from modules.checkpoint import list_checkpoints, load_latest_checkpoint
+from modules.storage.archive import CheckpointRetention
+from modules.conversation import migrate_conversation
+from modules.movement import encode_path
+from modules.live import LiveBus, LivePublisher
+from modules.constants import personas, frames_per_step
 from modules import utils
 
-personas = [
-    "あいか", "けんじ", "まりあ", "たくみ",  # 学生
-    "みどり", "ひろし", "えいじ",  # 家庭：教授、薬店主人、学生
-    "さくら", "ともき",  # 家庭：家庭主婦、市場主人
-    "かれん", "たまき",  # ルームメイト：供給店主人、児童書作家
-    "あつし", "いずみ",  # 酒場の店主、カフェの店主
-    "やまだ", "じゅんこ",  # 家庭：退役軍人、水彩画家
-    "ふくだ", "はるか", "りょうた", "れいな",  # 共同生活：コメディアン、作家、画家、写真家
-    "あきこ", "かずや", "じょうじ", "りゅうじ", "ゆりこ", "あきら",  # アニメーター、詩人、数学者、ソフトウェアエンジニア、税務弁護士、哲学者
-]
-
 
 class SimulateServer:
-    def __init__(self, name, static_root, checkpoints_folder, config, start_step=0, verbose="info", log_file="", resume=False):
+    def __init__(self, name, static_root, checkpoints_folder, config, start_step=0, verbose="info", log_file="", resume=False, skip_dormant=False, max_stride=0, record_path=False, live=None, store=None, keep_every=0, archive="gzip"):
         self.name = name
         self.static_root = static_root
         self.checkpoints_folder = checkpoints_folder
@@ -31,14 +31,33 @@ class SimulateServer:
         self.config = config
 
         os.makedirs(checkpoints_folder, exist_ok=True)
-
-        # 载入历史对话数据（用于断点恢复）
-        self.conversation_log = f"{checkpoints_folder}/conversation.json"
-        if os.path.exists(self.conversation_log):
-            with open(self.conversation_log, "r", encoding="utf-8") as f:
-                conversation = json.load(f)
+        self.metrics_folder = f"{checkpoints_folder}/metrics"
+        os.makedirs(self.metrics_folder, exist_ok=True)
+        self.profile_folder = f"{checkpoints_folder}/profile"
+        self.storage_root = f"{checkpoints_folder}/storage"
+
+        # --store sqlite：チェックポイント・記憶・対話をsimulation.dbに1ステップ1トランザクションで保存する
+        self.store = None
+        if store == "sqlite" or (resume and has_store(checkpoints_folder)):
+            self.store = set_store(open_store(checkpoints_folder, create=True))
+
+        # --keep-every：N個ごとのチェックポイントだけを完全な形で残し、間のものは差分としてアーカイブに圧縮する
+        self.retention = None
+        if keep_every > 1 and not self.store:
+            self.retention = CheckpointRetention(checkpoints_folder, keep_every, archive)
+
+        # LLM統計はシミュレーション全体の累積値なので、再開時は前回の値から続ける
+        if resume:
+            self.load_metrics()
+
+        # 载入历史对话数据（用于断点恢复），再開したチェックポイントより後の対話は破棄する
+        if self.store:
+            self.conversation_log = self.store.conversation
         else:
-            conversation = {}
+            self.conversation_log = migrate_conversation(checkpoints_folder)
+        if resume:
+            self.conversation_log.truncate(config["time"]["start"])
+        conversation = self.conversation_log.to_dict()
 
         if len(log_file) > 0:
             # resumeの場合は追記モード、新規の場合は新規作成
@@ -69,24 +88,82 @@ class SimulateServer:
             a.think_config["interval"] for a in self.game.agents.values()
         )
         self.start_step = start_step
+        self.skip_dormant = skip_dormant
+        self.max_stride = max_stride
+        self.record_path = record_path
+        # ライブ配信（replay.pyの/live）：各ステップをLiveBusに送る
+        self.live = None
+        if live is not None:
+            self.live = LivePublisher(
+                live,
+                frames_per_step,
+                utils.get_timer().get_date().isoformat(),
+                config["stride"],
+                {n: s["coord"] for n, s in self.agent_status.items()},
+            )
+
+    def active_agents(self):
+        """眠っていて行動が終わっていないエージェントはステップから外す"""
+        if not self.skip_dormant:
+            return list(self.agent_status.keys())
+        return [n for n in self.agent_status if not self.game.get_agent(n).is_dormant()]
+
+    def steps_to_wake(self, stride):
+        """全員が眠っているとき、最初に誰かが起きるまでのステップ数"""
+        now = utils.get_timer().get_date()
+        wake = min(self.game.get_agent(n).wake_time() for n in self.agent_status)
+        return max(math.ceil((wake - now).total_seconds() / 60 / stride), 1)
+
+    def steps_to_next_event(self, stride):
+        """次に誰かの状態が変わり得る時刻までのステップ数（1〜max_stride/strideに制限）"""
+        now = utils.get_timer().get_date()
+        event = min(self.game.get_agent(n).next_event_time() for n in self.agent_status)
+        steps = math.ceil((event - now).total_seconds() / 60 / stride)
+        return min(max(steps, 1), max(self.max_stride // stride, 1))
 
     def simulate(self, step, stride=0):
         timer = utils.get_timer()
-        for i in range(self.start_step, self.start_step + step):
-            title = "Simulate Step[{}/{}, time: {}]".format(i+1, self.start_step + step, timer.get_date())
+        profiler = utils.get_profiler()
+        i, end = self.start_step, self.start_step + step
+        while i < end:
+            step_begin = time.perf_counter()
+            active = self.active_agents()
+            if not active and stride > 0:
+                # 全員が眠っている間は、最初に起きる時刻までまとめて進める（チェックポイントは作らない）
+                skip = min(self.steps_to_wake(stride), end - i)
+                self.logger.info("\nAll agents are dormant, skip {} steps from {}".format(skip, timer.get_date()))
+                timer.forward(stride * skip)
+                i += skip
+                continue
+            if self.store:
+                # Agent.to_dictでの記憶の保存からチェックポイント・対話までを一つのトランザクションにする
+                self.store.begin()
+            title = "Simulate Step[{}/{}, time: {}]".format(i+1, end, timer.get_date())
             self.logger.info("\n" + utils.split_line(title, "="))
-            for name, status in self.agent_status.items():
-                plan = self.game.agent_think(name, status)["plan"]
+            if self.record_path:
+                # 前のステップの経路を残さない（眠っていて考えなかったAgentには経路がない）
+                for agent_config in self.config["agents"].values():
+                    agent_config.pop("path", None)
+            walked = {}
+            for name in active:
+                status = self.agent_status[name]
+                source_coord = status["coord"]
+                with profiler.span("think"):
+                    plan = self.game.agent_think(name, status)["plan"]
                 agent = self.game.get_agent(name)
                 if name not in self.config["agents"]:
                     self.config["agents"][name] = {}
-                self.config["agents"][name].update(agent.to_dict())
+                with profiler.span("to_dict"):
+                    self.config["agents"][name].update(agent.to_dict())
                 if plan.get("path"):
                     status["coord"], status["path"] = plan["path"][-1], []
                 self.config["agents"][name].update(
                     # {"coord": status["coord"], "path": plan["path"]}
                     {"coord": status["coord"]}
                 )
+                if self.record_path:
+                    self.record_agent_path(name, source_coord, plan.get("path") or [])
+                walked[name] = [list(source_coord)] + [list(c) for c in plan.get("path") or []]
 
             sim_time = timer.get_date("%Y%m%d-%H:%M")
             self.config.update(
@@ -96,14 +173,91 @@ class SimulateServer:
                 }
             )
             # 保存Agent活动数据
-            with open(f"{self.checkpoints_folder}/simulate-{sim_time.replace(':', '')}.json", "w", encoding="utf-8") as f:
-                f.write(json.dumps(self.config, indent=2, ensure_ascii=False))
+            checkpoint = f"simulate-{sim_time.replace(':', '')}.json"
+            with profiler.span("checkpoint"):
+                if self.store:
+                    self.store.save_step(i + 1, sim_time, checkpoint, self.config)
+                else:
+                    # 一時ファイルに書いてから置き換えるので、中断しても書きかけのチェックポイントは残らない
+                    data = json.dumps(self.config, indent=2, ensure_ascii=False).encode("utf-8")
+                    utils.write_atomic(f"{self.checkpoints_folder}/{checkpoint}", data, mode="wb")
             # 保存对话数据
-            with open(f"{self.checkpoints_folder}/conversation.json", "w", encoding="utf-8") as f:
-                f.write(json.dumps(self.game.conversation, indent=2, ensure_ascii=False))
-
+            with profiler.span("conversation"):
+                self.conversation_log.append(sim_time, i + 1, self.game.conversation.get(sim_time, []))
+            if self.store:
+                with profiler.span("commit"):
+                    self.store.commit()
+            else:
+                # 記憶のスナップショット・チェックポイント・会話がすべて揃ってから、チェックサムとともにマニフェストを更新する
+                save_manifest(self.storage_root, checkpoint, i + 1, sim_time, checksum(data), self.conversation_log.size())
+            if self.retention:
+                with profiler.span("compact"):
+                    self.retention.compact(list_checkpoints(self.checkpoints_folder))
+            if self.live:
+                with profiler.span("live"):
+                    self.live.publish(i + 1, sim_time, self.config["agents"], walked, self.game.conversation)
+            # LLM呼び出しの統計（遅延・トークン数など）を保存
+            with profiler.span("metrics"):
+                get_llm_metrics().save(f"{self.metrics_folder}/llm-latest")
+            if profiler.enabled:
+                self.save_profile(i + 1, sim_time, time.perf_counter() - step_begin, profiler.collect())
+
+            # 可変ストライドでは次のイベントまでまとめて進める（ステップ数は常にstride単位、指定したステップ数を超えない）
+            skip = 1
+            if stride > 0 and self.max_stride > stride:
+                skip = min(self.steps_to_next_event(stride), end - i)
+            i += skip
             if stride > 0:
-                timer.forward(stride)
+                timer.forward(stride * skip)
+
+    def load_metrics(self):
+        """前回のLLM統計を読み込む（以前の形式のllm-<時刻>.jsonは最新のもの）"""
+
+        legacy = sorted(
+            f[: -len(".json")] for f in os.listdir(self.metrics_folder)
+            if f.startswith("llm-") and f.endswith(".json") and f != "llm-latest.json"
+        )
+        if os.path.isfile(f"{self.metrics_folder}/llm-latest.json"):
+            get_llm_metrics().load(f"{self.metrics_folder}/llm-latest")
+        elif legacy:
+            get_llm_metrics().load(f"{self.metrics_folder}/{legacy[-1]}")
+        if self.retention and legacy:
+            # 累積値はllm-latestに引き継がれるため、ステップごとに書かれていた以前のファイルは残さない
+            get_llm_metrics().save(f"{self.metrics_folder}/llm-latest")
+            for stem in legacy:
+                for ext in (".json", ".csv"):
+                    if os.path.isfile(f"{self.metrics_folder}/{stem}{ext}"):
+                        os.remove(f"{self.metrics_folder}/{stem}{ext}")
+
+    def record_agent_path(self, name, source_coord, path):
+        """このステップで実際に歩いた経路を[x, y, "UDLR..."]としてチェックポイントに残す（compress.pyが使う）"""
+
+        try:
+            self.config["agents"][name]["path"] = encode_path([list(source_coord)] + [list(c) for c in path])
+        except ValueError:
+            # 1マスずつの経路でなければ記録しない（compress.pyが経路を探索する）
+            self.logger.debug("The path of {} is not recorded: {}".format(name, path))
+
+    def save_profile(self, step, sim_time, duration, spans):
+        """1ステップ分の処理時間の内訳をprofile/steps.jsonlに追記"""
+
+        os.makedirs(self.profile_folder, exist_ok=True)
+        # llm以外（迷路探索・記憶検索・保存・ログなど）の時間を分けて見られるようにする
+        llm_seconds = sum(
+            s["seconds"] for p, s in spans.items()
+            if p.endswith("/llm") and "/llm/" not in p
+        )
+        record = {
+            "step": step,
+            "time": sim_time,
+            "agents": len(self.agent_status),
+            "seconds": round(duration, 6),
+            "llm_seconds": round(llm_seconds, 6),
+            "other_seconds": round(duration - llm_seconds, 6),
+            "spans": spans,
+        }
+        with open(f"{self.profile_folder}/steps.jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
 
     def load_static(self, path):
         return utils.load_dict(os.path.join(self.static_root, path))
@@ -111,20 +265,11 @@ class SimulateServer:
 
 # 从存档数据中载入配置，用于断点恢复
 def get_config_from_log(checkpoints_folder):
-    files = sorted(os.listdir(checkpoints_folder))
-
-    json_files = list()
-    for file_name in files:
-        if file_name.endswith(".json") and file_name != "conversation.json":
-            json_files.append(os.path.join(checkpoints_folder, file_name))
-
-    if len(json_files) < 1:
+    config = load_latest_checkpoint(checkpoints_folder, restore=True)
+    if config is None:
         return None
 
-    with open(json_files[-1], "r", encoding="utf-8") as f:
-        config = json.load(f)
-
-    assets_root = os.path.join("assets", "village")
+    assets_root = config.get("assets_root", os.path.join("assets", "village"))
 
     start_time = datetime.datetime.strptime(config["time"], "%Y%m%d-%H:%M")
     start_time += datetime.timedelta(minutes=config["stride"])
@@ -137,15 +282,16 @@ def get_config_from_log(checkpoints_folder):
 
 
 # 为新游戏创建配置
-def get_config(start_time="20240213-09:30", stride=15, agents=None):
+def get_config(start_time="20240213-09:30", stride=15, agents=None, assets_root=None):
     with open("data/config.json", "r", encoding="utf-8") as f:
         json_data = json.load(f)
         agent_config = json_data["agent"]
 
-    assets_root = os.path.join("assets", "village")
+    assets_root = assets_root or os.path.join("assets", "village")
     config = {
         "stride": stride,
         "time": {"start": start_time},
+        "assets_root": assets_root,
         "maze": {"path": os.path.join(assets_root, "maze.json")},
         "agent_base": agent_config,
         "agents": {},
@@ -159,6 +305,16 @@ def get_config(start_time="20240213-09:30", stride=15, agents=None):
     return config
 
 
+def list_personas(assets_root, static_root="frontend/static"):
+    """assets_rootにあるエージェントの一覧（villageは既定の順序）"""
+    if assets_root == os.path.join("assets", "village"):
+        return personas
+    agents_root = os.path.join(static_root, assets_root, "agents")
+    return sorted(
+        n for n in os.listdir(agents_root) if os.path.isdir(os.path.join(agents_root, n))
+    )
+
+
 def select_agents(agents_arg, all_personas):
     """コマンドライン引数に基づいてエージェントを選択"""
     if agents_arg is None:
@@ -210,8 +366,6 @@ def update_config_with_poignancy(config, poignancy):
     return config
 
 
-load_dotenv(find_dotenv())
-
 parser = argparse.ArgumentParser(description="console for village")
 parser.add_argument("--name", type=str, default="", help="The simulation name")
 parser.add_argument("--start", type=str, default="20240213-09:30", help="The starting time of the simulated ville")
@@ -221,11 +375,25 @@ parser.add_argument("--stride", type=int, default=10, help="The step stride in m
 parser.add_argument("--verbose", type=str, default="debug", help="The verbose level")
 parser.add_argument("--log", type=str, default="", help="Name of the log file")
 parser.add_argument("--agents", type=str, default=None, help="Number of agents or comma-separated agent names")
+parser.add_argument("--assets", type=str, default="village", help="The assets of the town under frontend/static/assets (e.g. generated by generate_town.py)")
 parser.add_argument("--poignancy", type=int, default=None, help="Poignancy threshold for reflection (default: 150)")
-args = parser.parse_args()
+parser.add_argument("--skip-dormant", action="store_true", help="Skip sleeping agents until they wake up, and jump forward when all agents are sleeping")
+parser.add_argument("--max-stride", type=int, default=0, help="Advance to the next agent event in multiples of --stride, up to this many minutes per step")
+parser.add_argument("--record-path", action="store_true", help="Record the path walked by each agent in the checkpoints, so that compress.py doesn't search it again")
+parser.add_argument("--store", type=str, default="json", choices=["json", "sqlite"], help="Save the checkpoints, memory and conversations as JSON files, or in one SQLite database (simulation.db)")
+parser.add_argument("--keep-every", type=int, default=0, help="Keep every Nth checkpoint in full, the ones between them are compacted into deltas under archive/")
+parser.add_argument("--archive", type=str, default="gzip", choices=["gzip", "zstd", "none"], help="Compression of the archived checkpoints (zstd needs pip install zstandard)")
+parser.add_argument("--live", type=int, default=0, help="Stream the simulation to the viewer on http://127.0.0.1:<port>/live")
+parser.add_argument("--live-host", type=str, default="127.0.0.1", help="The address to serve the live viewer on (e.g. 0.0.0.0 to expose it to other machines)")
+parser.add_argument("--metrics-port", type=int, default=0, help="Serve LLM metrics in prometheus format on this port")
+parser.add_argument("--metrics-host", type=str, default="127.0.0.1", help="The address to serve the metrics on (e.g. 0.0.0.0 to expose them to other machines)")
+parser.add_argument("--profile", type=str, nargs="?", const="spans", default=None, choices=["spans", "cprofile", "pyinstrument"], help="Profile each simulate step, optionally with cprofile or pyinstrument")
 
 
 if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    args = parser.parse_args()
+
     checkpoints_path = "results/checkpoints"
 
     name = args.name
@@ -253,8 +421,9 @@ if __name__ == "__main__":
         sim_config = update_config_with_poignancy(sim_config, args.poignancy)
     else:
         # エージェントを選択
-        selected_personas = select_agents(args.agents, personas)
-        sim_config = get_config(start_time, args.stride, selected_personas)
+        assets_root = os.path.join("assets", args.assets)
+        selected_personas = select_agents(args.agents, list_personas(assets_root))
+        sim_config = get_config(start_time, args.stride, selected_personas, assets_root)
         # 内省閾値を設定
         sim_config = update_config_with_poignancy(sim_config, args.poignancy)
         start_step = 0
@@ -264,5 +433,23 @@ if __name__ == "__main__":
     # ログファイル名のデフォルト設定
     log_file = args.log if args.log else "debug.log"
 
-    server = SimulateServer(name, static_root, checkpoints_folder, sim_config, start_step, args.verbose, log_file, resume)
-    server.simulate(args.step, args.stride)
+    if args.metrics_port > 0:
+        serve_metrics(get_llm_metrics(), args.metrics_port, host=args.metrics_host)
+
+    utils.set_profiler(enabled=args.profile is not None)
+
+    live_bus = None
+    if args.live > 0:
+        # Flaskはライブ配信を使うときだけ読み込む
+        from replay import serve_live
+
+        live_bus = LiveBus()
+        serve_live(live_bus, args.live, host=args.live_host)
+
+    server = SimulateServer(name, static_root, checkpoints_folder, sim_config, start_step, args.verbose, log_file, resume, args.skip_dormant, args.max_stride, args.record_path, live_bus, args.store, args.keep_every, args.archive)
+    if args.profile in ("cprofile", "pyinstrument"):
+        utils.run_profiled(
+            lambda: server.simulate(args.step, args.stride), args.profile, server.profile_folder
+        )
+    else:
+        server.simulate(args.step, args.stride)
@@ -0,0 +1,162 @@
+import os
+import copy
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv, find_dotenv
+
+from start import SimulateServer, get_config, list_personas, select_agents, update_config_with_poignancy
+from modules import utils
+from modules.utils import SimulationContext
+from modules.maze import load_maze_config
+from modules.prompt import preload_templates
+
+checkpoints_path = "results/checkpoints"
+static_root = "frontend/static"
+
+# 各シミュレーションの既定値（sweepファイルの"defaults"で上書き）
+defaults = {
+    "start": "20240213-09:30",
+    "step": 10,
+    "stride": 10,
+    "agents": None,
+    "poignancy": None,
+    "assets": "village",
+    "verbose": "info",
+    "log": "debug.log",
+    "skip_dormant": False,
+    "max_stride": 0,
+    "record_path": False,
+    "store": "json",
+    "keep_every": 0,
+    "archive": "gzip",
+    "config": {},
+}
+
+
+def load_sweep(path):
+    """Load the simulations of the sweep file, each one merged with the defaults"""
+
+    sweep = utils.load_dict(path)
+    base = dict(defaults, **sweep.get("defaults", {}))
+    simulations = []
+    for sim in sweep["simulations"]:
+        sim = dict(copy.deepcopy(base), **sim)
+        assert sim.get("name"), "Every simulation of the sweep needs a name"
+        simulations.append(sim)
+    names = [s["name"] for s in simulations]
+    assert len(set(names)) == len(names), "Duplicated simulation names: " + str(names)
+    return simulations
+
+
+def build_config(sim):
+    assets_root = os.path.join("assets", sim["assets"])
+    selected = select_agents(sim["agents"], list_personas(assets_root, static_root))
+    config = get_config(sim["start"], sim["stride"], selected, assets_root)
+    config = update_config_with_poignancy(config, sim["poignancy"])
+    # llmや埋め込みなど、シミュレーションごとの設定の上書き
+    return utils.update_dict(config, sim["config"])
+
+
+def warm_up(simulations):
+    """Load the immutable data shared by the simulations before the workers are forked"""
+
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    preload_templates()
+    embeddings = {}
+    for sim in simulations:
+        config = sim["sim_config"]
+        load_maze_config(os.path.join(static_root, config["maze"]["path"]))
+        embedding = config["agent_base"]["associate"]["embedding"]
+        # ネットワーク接続を持つモデルはfork後に各プロセスで作る
+        if embedding["provider"] in ("hugging_face", "stub"):
+            embeddings[json.dumps(embedding, sort_keys=True)] = embedding
+    if embeddings:
+        from modules.storage.index import create_embed_model
+
+        for embedding in embeddings.values():
+            create_embed_model(embedding)
+
+
+def run_simulation(sim):
+    name = sim["name"]
+    checkpoints_folder = f"{checkpoints_path}/{name}"
+    if os.path.exists(checkpoints_folder):
+        return {"name": name, "error": f"'{name}' already exists"}
+
+    begin = time.time()
+    try:
+        server = SimulateServer(
+            name,
+            static_root,
+            checkpoints_folder,
+            sim["sim_config"],
+            0,
+            sim["verbose"],
+            sim["log"],
+            False,
+            sim["skip_dormant"],
+            sim["max_stride"],
+            sim["record_path"],
+            store=sim["store"],
+            keep_every=sim["keep_every"],
+            archive=sim["archive"],
+        )
+        server.simulate(sim["step"], sim["stride"])
+    except Exception as e:  # pylint: disable=broad-except
+        return {"name": name, "error": str(e), "seconds": round(time.time() - begin, 2)}
+    return {"name": name, "step": sim["step"], "seconds": round(time.time() - begin, 2)}
+
+
+def run_in_context(sim, models):
+    """Run the simulation in its own context, the llm schedulers and backends are shared"""
+
+    return SimulationContext(sim["name"], models=models).run(run_simulation, sim)
+
+
+def report(result):
+    if "error" in result:
+        print(f"❌ {result['name']}: {result['error']}")
+    else:
+        print(f"✅ {result['name']}: {result['step']} steps in {result['seconds']}s")
+
+
+parser = argparse.ArgumentParser(description="run a sweep of simulations")
+parser.add_argument("sweep", type=str, help="The sweep file (json) listing the simulations")
+parser.add_argument("--workers", type=int, default=2, help="Number of the simulations running at the same time")
+parser.add_argument(
+    "--mode",
+    type=str,
+    default="process",
+    choices=["process", "thread"],
+    help="Run each simulation in a forked process, or in a thread of this process sharing the llm connections",
+)
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    args = parser.parse_args()
+
+    simulations = load_sweep(args.sweep)
+    for sim in simulations:
+        sim["sim_config"] = build_config(sim)
+    warm_up(simulations)
+
+    if args.mode == "thread":
+        # 各シミュレーションはSimulationContextでtimer/gameを分離し、LLMのスケジューラ（同時接続数）を共有する
+        models = {}
+        with ThreadPoolExecutor(args.workers, thread_name_prefix="simulation") as executor:
+            futures = [executor.submit(run_in_context, sim, models) for sim in simulations]
+            for future in as_completed(futures):
+                report(future.result())
+    else:
+        # 各シミュレーションは新しいプロセスで実行し、timer/gameなどのグローバル状態を分離する。
+        # forkが使える環境では、読み込み済みの地図・テンプレート・埋め込みモデルを子プロセスと共有する
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        with ctx.Pool(args.workers, maxtasksperchild=1) as pool:
+            for result in pool.imap_unordered(run_simulation, simulations):
+                report(result)
@@ -0,0 +1,41 @@
+"""ConversationLog of a new simulation and its appended chats"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from modules.conversation import ConversationLog, migrate_conversation, log_file
+
+
+class ConversationLogTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_new_simulation_has_no_log(self):
+        # SimulateServerはステップの前にto_dictを呼ぶ
+        conversation = migrate_conversation(self.folder)
+        self.assertEqual(conversation.to_dict(), {})
+        self.assertEqual(conversation.records(), [])
+        self.assertEqual(conversation.at("20240213-09:00"), [])
+        self.assertEqual(conversation.at_step(1), [])
+        self.assertEqual(conversation.of("あいか"), [])
+        self.assertEqual(conversation.between("あいか", "けんじ"), [])
+        self.assertEqual(conversation.size(), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.folder, log_file)))
+
+    def test_append_and_read(self):
+        conversation = ConversationLog(os.path.join(self.folder, log_file))
+        chats = [{"あいか -> けんじ @ 家": [["あいか", "やあ"], ["けんじ", "こんにちは"]]}]
+        conversation.append("20240213-09:10", 1, chats)
+        reopened = ConversationLog(os.path.join(self.folder, log_file))
+        self.assertEqual(reopened.to_dict(), {"20240213-09:10": chats})
+        self.assertEqual(len(reopened.between("けんじ", "あいか")), 1)
+        self.assertEqual(reopened.size(), os.path.getsize(os.path.join(self.folder, log_file)))
+
+
+if __name__ == "__main__":
+    unittest.main()
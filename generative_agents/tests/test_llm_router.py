@@ -0,0 +1,34 @@
+"""Balancing and validation of RouterLLMModel"""
+
+import unittest
+
+from modules.utils import SimulationContext
+from modules.model.llm_model import RouterLLMModel
+
+
+def _backend(answer):
+    return {"provider": "stub", "base_url": "http://" + answer, "model": "stub", "responses": {"llm_normal": answer}}
+
+
+def create_router(**config):
+    config = dict({"provider": "router", "tiers": {"small": [_backend("a"), _backend("b")]}}, **config)
+    return RouterLLMModel(config)
+
+
+class RouterTest(unittest.TestCase):
+    def test_sequential_requests_are_balanced(self):
+        def _run():
+            router = create_router()
+            return [router.completion("prompt") for _ in range(4)]
+
+        # バックエンドは共有されるので、テストごとに新しいコンテキストで作る
+        answers = SimulationContext("router-test").run(_run)
+        self.assertEqual(answers, ["a", "b", "a", "b"])
+
+    def test_unknown_tier(self):
+        with self.assertRaisesRegex(ValueError, "poignancy_event -> large"):
+            SimulationContext("router-test").run(create_router, routes={"poignancy_event": "large"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Batch windows of LLMScheduler"""
+
+import time
+import threading
+import unittest
+
+from modules.model.scheduler import LLMScheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_full_batch_cancels_its_window(self):
+        scheduler = LLMScheduler(num_parallel=2, window=0.2)
+        sent = {}
+
+        def _request(key):
+            def _run():
+                sent[key] = time.time()
+                return key
+
+            return _run
+
+        begin = time.time()
+        # 1つ目の窓は並列数に達してすぐに送られる
+        futures = [scheduler.submit("caller", k, _request(k)) for k in ("a", "b")]
+        self.assertEqual([f.result(timeout=1) for f in futures], ["a", "b"])
+        # 2つ目の窓は、1つ目の窓のタイマーではなく自分の窓が経ってから送られる
+        time.sleep(0.1)
+        future = scheduler.submit("caller", "c", _request("c"))
+        self.assertEqual(future.result(timeout=1), "c")
+        self.assertGreaterEqual(sent["c"] - begin, 0.1 + 0.2 - 0.02)
+        scheduler.shutdown()
+
+    def test_identical_requests_share_the_result(self):
+        scheduler = LLMScheduler(num_parallel=4, window=0.05)
+        calls = []
+        lock = threading.Lock()
+
+        def _run():
+            with lock:
+                calls.append(1)
+            return "answer"
+
+        futures = [scheduler.submit("caller", "same", _run) for _ in range(3)]
+        self.assertEqual([f.result(timeout=1) for f in futures], ["answer"] * 3)
+        self.assertEqual(len(calls), 1)
+        scheduler.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
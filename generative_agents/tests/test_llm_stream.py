@@ -0,0 +1,94 @@
+"""Early stop of the streamed completions (LLMModel._stream_completion)"""
+
+import unittest
+
+from modules.model.llm_model import LLMModel
+from modules.prompt.scratch import stream_yes_no, stream_choice, stream_score, stream_labeled
+
+
+class FakeStreamModel(LLMModel):
+    """Streams the given chunks, records how many of them were consumed"""
+
+    def setup(self, config):
+        self.chunks = config["chunks"]
+        self.consumed = 0
+        return None
+
+    def _stream_chunks(self, prompt, **kwargs):
+        for chunk in self.chunks:
+            self.consumed += 1
+            yield chunk
+
+    def _completion(self, prompt, **kwargs):
+        return "".join(self.chunks)
+
+
+def _decide(response):
+    # prompt_decide_chatのcallbackと同じ（常にboolを返す）
+    return not ("No" in response or "no" in response or "いいえ" in response)
+
+
+def create_model(chunks):
+    return FakeStreamModel({"provider": "fake", "model": "fake-stream", "chunks": chunks})
+
+
+class StreamCompletionTest(unittest.TestCase):
+    def test_reasoning_line_is_not_the_answer(self):
+        model = create_model(["考え中：\n", "いいえ"])
+        output = model.completion("prompt", callback=_decide, failsafe=False, stream=stream_yes_no)
+        self.assertFalse(output)
+        self.assertEqual(model.meta_responses[-1], "考え中：\nいいえ")
+
+    def test_stop_at_the_answer_line(self):
+        model = create_model(["推理：二人は同じ場所を使う。\n", "答案：<選択肢A>\n", "余計な説明\n"])
+        output = model.completion("prompt", callback=lambda r: "A" in r, failsafe=False, stream=stream_choice)
+        self.assertTrue(output)
+        self.assertEqual(model.consumed, 2)
+
+    def test_fallback_to_the_full_text(self):
+        parse = stream_labeled("行くべき場所", ["カフェ", "公園"])
+        model = create_model(["カフェか公園か考える\n", "やはり公園"])
+        output = model.completion("prompt", callback=lambda r: r.split("\n")[-1][-2:], stream=parse)
+        self.assertEqual(output, "公園")
+        self.assertEqual(model.consumed, 2)
+
+    def test_bare_candidate_line(self):
+        # プロンプトは「行くべき場所：」で終わるので、名前だけが返る
+        parse = stream_labeled("行くべき場所", ["カフェ", "公園"])
+        model = create_model(["公園\n", "（公園なら散歩できる）\n"])
+        output = model.completion("prompt", callback=lambda r: None, stream=parse)
+        self.assertEqual(output, "公園")
+        self.assertEqual(model.consumed, 1)
+
+    def test_one_line_answer_before_the_newline(self):
+        model = create_model(["いい", "え", "。理由は", "特にない"])
+        output = model.completion("prompt", callback=_decide, failsafe=False, stream=stream_yes_no)
+        self.assertFalse(output)
+        self.assertEqual(model.consumed, 2)
+        parse = stream_labeled("行くべき場所", ["図書館", "図書館の書庫", "公園"])
+        model = create_model(["図書", "館", "の書庫", "\n"])
+        output = model.completion("prompt", callback=lambda r: None, stream=parse)
+        # 「図書館」は別の候補の途中なので、行が確定するまで待つ
+        self.assertEqual(output, "図書館の書庫")
+        self.assertEqual(model.consumed, 3)
+
+    def test_partial_score_waits_for_the_line(self):
+        model = create_model(["評価：1", "0", "\n", "説明"])
+        output = model.completion("prompt", callback=lambda r: None, stream=stream_score)
+        self.assertEqual(output, 10)
+        self.assertEqual(model.consumed, 3)
+
+    def test_partial_line_in_think_block(self):
+        model = create_model(["<think>", "はい", "</think>", "いいえ"])
+        output = model.completion("prompt", callback=_decide, failsafe=False, stream=stream_yes_no)
+        self.assertFalse(output)
+        self.assertEqual(model.consumed, 4)
+
+    def test_without_stream_parser(self):
+        model = create_model(["考え中：\n", "いいえ"])
+        output = model.completion("prompt", callback=_decide, failsafe=False, stream=True)
+        self.assertFalse(output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+"""Canned answers of StubLLMModel"""
+
+import unittest
+
+from modules.utils import SimulationContext
+from modules.model.llm_model import StubLLMModel
+
+
+class StubTest(unittest.TestCase):
+    def test_schedule_daily_goes_to_bed(self):
+        prompt = "".join("[{}:00] 睡眠\n".format(h) for h in range(7))
+        prompt += "".join("[{}:00] <活動>\n".format(h) for h in range(7, 24))
+
+        def _run():
+            model = StubLLMModel({"provider": "stub", "base_url": "", "model": "stub"})
+            return model.answer(prompt, "schedule_daily")
+
+        lines = SimulationContext("stub-test").run(_run).split("\n")
+        self.assertEqual(len(lines), 16)
+        self.assertEqual(lines[0].split(" ")[0], "[7:00]")
+        # 22時以降は一つの就寝の計画（日付が変わるまで眠る）
+        self.assertEqual(lines[-1], "[22:00] 就寝する")
+        self.assertTrue(all("寝" not in line for line in lines[:-1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""Dormant agents of SimulateServer (--skip-dormant) with the stub llm
+
+The stub agents go to bed at 22:00 and sleep until the day changes, so a run
+from 21:00 has all the agents dormant from 22:10 to 23:50.
+"""
+
+import os
+import shutil
+import unittest
+import datetime
+
+from benchmarks.common import stub_config
+from compress import compress, MovementSink
+from modules import utils
+from modules.checkpoint import iter_checkpoints
+from modules.constants import frames_per_step
+from modules.movement import positions_at
+from start import SimulateServer, get_config
+
+agents = ["あいか", "けんじ"]
+start = "20240213-21:00"
+stride = 10
+
+
+def create_server(name, **kwargs):
+    """A SimulateServer of the stub agents, the game keeps the memory in results/checkpoints/<name>"""
+
+    config = stub_config(get_config(start, stride, agents))
+    return SimulateServer(
+        name, "frontend/static", f"results/checkpoints/{name}", config, 0, "info", "simulate.log", False, **kwargs
+    )
+
+
+def step_time(step):
+    """The time of the checkpoint of the step"""
+
+    t = datetime.datetime.strptime(start, "%Y%m%d-%H:%M") + datetime.timedelta(minutes=stride * (step - 1))
+    return t.strftime("%Y%m%d-%H:%M")
+
+
+class DormantTest(unittest.TestCase):
+    def setUp(self):
+        self.name = "test-dormant-{}".format(os.getpid())
+        self.folder = f"results/checkpoints/{self.name}"
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def _simulate(self, steps):
+        server = create_server(self.name, skip_dormant=True)
+        thought, think = [], server.game.agent_think
+
+        def _think(name, status):
+            agent = server.game.get_agent(name)
+            # 眠っていて行動が終わっていないエージェントは考えない
+            self.assertFalse(agent.is_dormant())
+            thought.append((utils.get_timer().get_date("%H:%M"), name))
+            return think(name, status)
+
+        server.game.agent_think = _think
+        server.simulate(steps, stride)
+        return server, thought, utils.get_timer().get_date("%Y%m%d-%H:%M")
+
+    def test_dormant_agents_are_skipped_until_they_wake(self):
+        server, thought, now = utils.SimulationContext(self.name).run(self._simulate, 30)
+
+        # 22:00のステップで眠り、日付が変わるまで誰も考えない
+        for name in agents:
+            self.assertIn(("22:00", name), thought)
+            self.assertIn(("00:00", name), thought)
+        self.assertFalse([t for t, _ in thought if "22:10" <= t <= "23:50"])
+
+        # 全員が眠っている間はまとめて進むが、ステップ番号は時刻に合っている
+        checkpoints = dict(iter_checkpoints(self.folder))
+        steps = sorted(c["step"] for c in checkpoints.values())
+        self.assertEqual(steps, list(range(1, 8)) + list(range(19, 31)))
+        for checkpoint in checkpoints.values():
+            self.assertEqual(checkpoint["time"], step_time(checkpoint["step"]))
+        self.assertEqual(now, "20240214-02:00")
+
+        # compress.pyは飛ばしたステップも空のフレームとして埋める
+        movement_file = os.path.join(self.folder, "movement.json")
+        result = compress(self.folder, [MovementSink(movement_file)])[0]
+        self.assertEqual(result["frames"], 30 * frames_per_step)
+        movement = utils.load_dict(movement_file)
+        self.assertEqual(movement["start_datetime"], "2024-02-13T21:00:00")
+        for segment in movement["segments"][len(agents):]:
+            # 第0フレームの後は、各区間がチェックポイントのステップの最初のフレームから始まる
+            self.assertEqual((segment[1] - 1) % frames_per_step, 0)
+            self.assertNotIn((segment[1] - 1) // frames_per_step + 1, range(8, 19))
+        asleep = {n: checkpoints[f"simulate-{step_time(7).replace(':', '')}.json"]["agents"][n]["coord"] for n in agents}
+        for frame in (7 * frames_per_step + 1, 18 * frames_per_step):
+            self.assertEqual(positions_at(movement, frame), asleep)
+
+
+if __name__ == "__main__":
+    unittest.main()
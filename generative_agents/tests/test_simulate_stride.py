@@ -0,0 +1,121 @@
+"""Adaptive stride of SimulateServer (--max-stride)"""
+
+import os
+import shutil
+import unittest
+import datetime
+
+from benchmarks.common import stub_config
+from modules import utils
+from modules.checkpoint import iter_checkpoints
+from start import SimulateServer, get_config
+
+agents = ["あいか", "けんじ"]
+
+
+class FakeAgent:
+    def __init__(self, minutes):
+        self.minutes = minutes
+
+    def next_event_time(self):
+        return utils.get_timer().get_date() + datetime.timedelta(minutes=self.minutes)
+
+
+class FakeGame:
+    def __init__(self, agents):
+        self.agents = agents
+
+    def get_agent(self, name):
+        return self.agents[name]
+
+
+def steps_to_next_event(events, stride, max_stride):
+    """steps_to_next_event of a server whose agents have their next event in events (minutes)"""
+
+    def _run():
+        utils.set_timer("20240213-09:30")
+        server = SimulateServer.__new__(SimulateServer)
+        server.game = FakeGame({str(i): FakeAgent(m) for i, m in enumerate(events)})
+        server.agent_status = {name: {} for name in server.game.agents}
+        server.max_stride = max_stride
+        return server.steps_to_next_event(stride)
+
+    return utils.SimulationContext("stride-test").run(_run)
+
+
+class NextEventTest(unittest.TestCase):
+    def test_round_up_to_the_stride(self):
+        self.assertEqual(steps_to_next_event([25, 40], 10, 60), 3)
+        self.assertEqual(steps_to_next_event([30], 10, 60), 3)
+        # 次のイベントが今か過ぎていても1ステップは進む
+        self.assertEqual(steps_to_next_event([0], 10, 60), 1)
+        self.assertEqual(steps_to_next_event([-5], 10, 60), 1)
+
+    def test_clamp_to_max_stride(self):
+        self.assertEqual(steps_to_next_event([200], 10, 60), 6)
+        self.assertEqual(steps_to_next_event([200], 10, 65), 6)
+        self.assertEqual(steps_to_next_event([200], 10, 5), 1)
+
+
+class AdaptiveStrideTest(unittest.TestCase):
+    """With the stub agents, each sub-plan takes 12 minutes"""
+
+    start = "20240213-09:30"
+    stride = 2
+
+    def setUp(self):
+        self.name = "test-stride-{}".format(os.getpid())
+        self.folder = f"results/checkpoints/{self.name}"
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def _create_server(self):
+        config = stub_config(get_config(self.start, self.stride, agents))
+        return SimulateServer(
+            self.name, "frontend/static", self.folder, config, 0, "info", "simulate.log", False, max_stride=30
+        )
+
+    def _simulate(self, steps, next_event=None):
+        server = self._create_server()
+        if next_event:
+            server.steps_to_next_event = next_event
+        server.simulate(steps, self.stride)
+        return server, utils.get_timer().get_date("%Y%m%d-%H:%M")
+
+    def test_skip_to_the_next_event(self):
+        _, now = utils.SimulationContext(self.name).run(self._simulate, 12)
+        checkpoints = [c for _, c in iter_checkpoints(self.folder)]
+        self.assertEqual(now, "20240213-09:54")
+        self.assertLess(len(checkpoints), 12)
+        for checkpoint in checkpoints:
+            minutes = (checkpoint["step"] - 1) * self.stride
+            t = datetime.datetime.strptime(self.start, "%Y%m%d-%H:%M") + datetime.timedelta(minutes=minutes)
+            self.assertEqual(checkpoint["time"], t.strftime("%Y%m%d-%H:%M"))
+
+    def test_clamp_to_the_remaining_steps(self):
+        _, now = utils.SimulationContext(self.name).run(self._simulate, 3, lambda stride: 5)
+        # 5ステップ先のイベントでも、指定した3ステップで止まる
+        self.assertEqual(now, "20240213-09:36")
+        self.assertEqual([c["step"] for _, c in iter_checkpoints(self.folder)], [1])
+
+    def test_deciding_or_chatting_agents_keep_the_stride(self):
+        def _run():
+            server, _ = self._simulate(1)
+            agent = server.game.get_agent(agents[0])
+            self.assertGreater(server.steps_to_next_event(self.stride), 1)
+            # 会話中・待機中のエージェントは次のステップで考える
+            address = agent.get_event().address
+            for target in ("<persona>", "<waiting>"):
+                agent.get_event().address = [target] + address[1:]
+                self.assertEqual(server.steps_to_next_event(self.stride), 1)
+            agent.get_event().address = address
+            # 行動が終わったエージェントは次の行動を決める
+            agent.action.end = utils.get_timer().get_date() - datetime.timedelta(minutes=1)
+            self.assertEqual(server.steps_to_next_event(self.stride), 1)
+
+        utils.SimulationContext(self.name).run(_run)
+
+
+if __name__ == "__main__":
+    unittest.main()
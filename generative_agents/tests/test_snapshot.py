@@ -0,0 +1,65 @@
+"""Memory snapshots: the vector file, truncated files and the version 1 format"""
+
+import os
+import json
+import array
+import shutil
+import tempfile
+import unittest
+
+from modules.storage.snapshot import save_snapshot, load_snapshot, load_pointer
+
+nodes = [
+    {"id": str(i), "text": "記憶{}".format(i), "metadata": {}, "exclude_llm_keys": [], "exclude_embedding_keys": []}
+    for i in range(3)
+]
+vectors = [[0.5, 1.0], [1.5, 2.0], [2.5, 3.0]]
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_save_and_load(self):
+        save_snapshot(self.path, nodes, vectors, {"max_nodes": 10})
+        self.assertEqual(load_snapshot(self.path), (nodes, vectors, {"max_nodes": 10}))
+
+    def test_truncated_vectors(self):
+        pointer = save_snapshot(self.path, nodes, vectors, {})
+        vectors_file = os.path.join(self.path, "snapshot-{}.f32".format(pointer["generation"]))
+        with open(vectors_file, "r+b") as f:
+            f.truncate(5 * 4)
+        with self.assertRaisesRegex(ValueError, "truncated: 5 floats for 3 vectors of 2"):
+            load_snapshot(self.path)
+
+    def test_load_version_1(self):
+        # 旧形式：snapshot.jsonが状態そのもので、チェックサムはない
+        buffer = array.array("f", [v for vector in vectors for v in vector])
+        with open(os.path.join(self.path, "snapshot-4.f32"), "wb") as f:
+            f.write(buffer.tobytes())
+        state = {
+            "version": 1,
+            "generation": 4,
+            "vectors": "snapshot-4.f32",
+            "dim": 2,
+            "count": len(nodes),
+            "config": {"max_nodes": 10},
+            "nodes": nodes,
+        }
+        with open(os.path.join(self.path, "snapshot.json"), "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        self.assertEqual(load_snapshot(self.path), (nodes, vectors, {"max_nodes": 10}))
+        self.assertEqual(load_pointer(self.path), {"version": 1, "generation": 4, "files": {}})
+
+        # 旧形式の上に保存すると、次の世代が新しい形式で書かれる
+        pointer = save_snapshot(self.path, nodes[:1], vectors[:1], {})
+        self.assertEqual(pointer["version"], 2)
+        self.assertEqual(pointer["generation"], 5)
+        self.assertEqual(load_snapshot(self.path), (nodes[:1], vectors[:1], {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
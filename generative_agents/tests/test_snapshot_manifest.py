@@ -0,0 +1,50 @@
+"""Resume from the manifest after the simulation stopped while saving a step"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from modules import utils
+from modules.checkpoint import load_latest_checkpoint
+from modules.storage.snapshot import save_snapshot, load_snapshot, save_manifest, checksum
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.storage_root = os.path.join(self.folder, "storage")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def _snapshot(self, step):
+        node = {"id": str(step), "text": "", "metadata": {}, "exclude_llm_keys": [], "exclude_embedding_keys": []}
+        save_snapshot(os.path.join(self.storage_root, "agent"), [node], [[float(step)]], {"step": step})
+
+    def _step(self, step):
+        self._snapshot(step)
+        checkpoint = "simulate-{:03d}.json".format(step)
+        data = json.dumps({"step": step}).encode("utf-8")
+        utils.write_atomic(os.path.join(self.folder, checkpoint), data, mode="wb")
+        save_manifest(self.storage_root, checkpoint, step, str(step), checksum(data))
+
+    def test_manifest_creates_the_storage_folder(self):
+        save_manifest(self.storage_root, "simulate-001.json", 1, "1")
+        self.assertTrue(os.path.isfile(os.path.join(self.storage_root, "manifest.json")))
+
+    def test_resume_the_previous_step_after_a_crash(self):
+        for step in (1, 2, 3):
+            self._step(step)
+        # 4ステップ目の記憶を保存した後、マニフェストを更新する前に中断し、最新のチェックポイントも壊れた
+        self._snapshot(4)
+        with open(os.path.join(self.folder, "simulate-003.json"), "w") as f:
+            f.write("{")
+        config = load_latest_checkpoint(self.folder, restore=True)
+        self.assertEqual(config["step"], 2)
+        self.assertEqual(load_snapshot(os.path.join(self.storage_root, "agent"))[2], {"step": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()